@@ -0,0 +1,175 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Query answer cache module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements an in-memory cache of query answers, one per
+    worker process, in front of the queries table in the database.
+
+    Answers are cached until the expiration time set by the query
+    processor that produced them, if any, and are keyed by the lowercase
+    question, whether it is a voice query, and the location of the client,
+    rounded to a coarse grid cell. The cache is an LRU cache whose size is
+    given by the answer_cache_size setting (or the GREYNIR_ANSWER_CACHE_SIZE
+    environment variable). It keeps statistics of hits and misses, both for
+    itself and for the database tier, which is consulted by process_query()
+    on a miss.
+
+"""
+
+from typing import Optional, Tuple
+
+import copy
+import threading
+
+from collections import OrderedDict
+from datetime import datetime
+
+from settings import Settings
+
+
+# Number of decimals of latitude and longitude that are kept in
+# cache keys: 2 decimals correspond to a cell of roughly 1 km
+_LOCATION_DECIMALS = 2
+
+
+class AnswerCache:
+
+    """ A thread-safe LRU cache of query results, where each
+        entry expires at a given time """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        # Map of key to (expiration time, result) tuples
+        self._cache = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.db_hits = 0
+        self.db_misses = 0
+
+    def get(self, key, now=None):
+        """ Return a copy of the cached result for the given key,
+            or None if not found or expired """
+        now = now or datetime.utcnow()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] < now:
+                # Expired: remove the entry
+                del self._cache[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+        # Return a copy, since the caller may modify the result
+        return copy.deepcopy(entry[1])
+
+    def put(self, key, result, expires):
+        """ Store a copy of a result in the cache, until the given time """
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._cache[key] = (expires, result)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def db_lookup(self, found):
+        """ Record the outcome of a lookup in the database tier """
+        with self._lock:
+            if found:
+                self.db_hits += 1
+            else:
+                self.db_misses += 1
+
+    def clear(self):
+        """ Empty the cache and reset the statistics """
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = self.expirations = self.evictions = 0
+            self.db_hits = self.db_misses = 0
+
+    def stats(self):
+        """ Return a dict of cache statistics """
+        lookups = self.hits + self.misses
+        db_lookups = self.db_hits + self.db_misses
+        return dict(
+            size=len(self._cache),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            expirations=self.expirations,
+            evictions=self.evictions,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            db_hits=self.db_hits,
+            db_misses=self.db_misses,
+            db_hit_rate=self.db_hits / db_lookups if db_lookups else 0.0,
+        )
+
+
+# The per-process cache instance, created on first use
+_cache = None  # type: Optional[AnswerCache]
+_cache_lock = threading.Lock()
+
+
+def answer_cache():
+    """ Return the per-process answer cache, creating it if required """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnswerCache(Settings.ANSWER_CACHE_SIZE)
+    return _cache
+
+
+def cache_key(question, voice, location):
+    """ Return the cache key for a question, given the voice flag
+        and the (latitude, longitude) location of the client, if known """
+    cell = None  # type: Optional[Tuple[float, float]]
+    if location:
+        cell = (
+            round(location[0], _LOCATION_DECIMALS),
+            round(location[1], _LOCATION_DECIMALS),
+        )
+    return (question.lower(), bool(voice), cell)
+
+
+def get(key):
+    """ Return a cached result for the given key, or None """
+    return answer_cache().get(key)
+
+
+def put(key, result, expires):
+    """ Cache a result for the given key, until the expiration time """
+    answer_cache().put(key, result, expires)
+
+
+def db_lookup(found):
+    """ Record the outcome of a lookup in the database tier """
+    answer_cache().db_lookup(found)
+
+
+def stats():
+    """ Return a dict of statistics for the per-process cache """
+    return answer_cache().stats()
@@ -0,0 +1,326 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    External API client module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a shared, per-process HTTP client for the
+    external APIs that are called by query modules (apis.is, RÚV,
+    OpenWeatherMap, Wikipedia, Google, etc.).
+
+    Requests go through a single requests.Session, so that connections
+    are pooled and kept alive between queries, with a timeout for each
+    API host. Concurrent requests for the same URL are coalesced into a
+    single fetch, whose result is shared by all callers.
+
+    JSON responses can be cached for a given time to live (TTL). After
+    the TTL, an entry may still be served for a further stale period while
+    it is refreshed in a background thread, so that callers do not wait
+    for the API server (stale-while-revalidate). If a fetch fails, an
+    expired entry is returned rather than nothing.
+
+    Each API host has a circuit breaker: after a number of consecutive
+    failures, requests to the host fail immediately for a cooldown period,
+    instead of tying up request threads until they time out.
+
+    Cached values are shared between callers and must not be modified.
+
+"""
+
+from typing import Dict, Optional
+
+import os
+import json
+import logging
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import querytrace
+
+
+# Default (connect, read) timeout in seconds
+_DEFAULT_TIMEOUT = (3.05, 5.0)
+
+# Timeouts for particular API hosts
+_TIMEOUTS = {
+    "apis.is": (3.05, 4.0),
+    "ruv.is": (3.05, 4.0),
+    "api.openweathermap.org": (3.05, 3.0),
+    "is.wikipedia.org": (3.05, 3.0),
+    "maps.googleapis.com": (3.05, 3.0),
+}
+
+# Maximum number of pooled connections per host
+_POOL_SIZE = 16
+
+# Maximum number of cached responses
+_CACHE_SIZE = 1024
+
+# Number of threads that refresh stale cache entries
+_REFRESH_THREADS = 2
+
+# Number of consecutive failures after which a host's circuit breaker
+# opens, and the number of seconds it stays open
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30.0
+
+
+class CircuitBreaker:
+
+    """ Keeps track of consecutive failures of requests to a host,
+        and tells whether requests should be attempted """
+
+    def __init__(self, threshold=_BREAKER_THRESHOLD, cooldown=_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ Return True if a request may be attempted. When the cooldown
+            period is over, requests are allowed again, but a single
+            further failure opens the breaker anew. """
+        return self.open_until <= monotonic()
+
+    def is_open(self):
+        return not self.allow()
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = monotonic() + self.cooldown
+
+
+class APIClient:
+
+    """ A thread-safe HTTP client with connection pooling, request
+        coalescing, caching and circuit breakers """
+
+    def __init__(self, cache_size=_CACHE_SIZE):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=_POOL_SIZE, pool_maxsize=_POOL_SIZE)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self.cache_size = cache_size
+        # Map of URL to (fetch time, value) tuples
+        self._cache = OrderedDict()  # type: OrderedDict
+        # Map of URL to the Future of a fetch in progress
+        self._inflight = dict()  # type: Dict[str, Future]
+        self._breakers = dict()  # type: Dict[str, CircuitBreaker]
+        self._lock = threading.Lock()
+        self._refresher = None  # type: Optional[ThreadPoolExecutor]
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+            return breaker
+
+    def get(self, url, params=None, timeout=None):
+        """ Send a GET request, returning the response,
+            or None if the request failed """
+        host = urlsplit(url).hostname or ""
+        breaker = self._breaker(host)
+        if not breaker.allow():
+            self.rejected += 1
+            logging.warning("Circuit breaker open for {0}, skipping request".format(host))
+            return None
+        self.requests += 1
+        try:
+            with querytrace.span("api:" + host):
+                r = self._session.get(
+                    url,
+                    params=params,
+                    timeout=timeout or _TIMEOUTS.get(host, _DEFAULT_TIMEOUT),
+                )
+        except Exception as e:
+            self.failures += 1
+            breaker.failure()
+            logging.warning(str(e))
+            return None
+        if r.status_code >= 500:
+            self.failures += 1
+            breaker.failure()
+        else:
+            breaker.success()
+        return r
+
+    def _fetch_json(self, url):
+        """ Request the URL, returning the parsed JSON response or None """
+        r = self.get(url)
+        if r is None:
+            return None
+        # Verify that status is OK
+        if r.status_code != 200:
+            logging.warning("Received status {0} from API server".format(r.status_code))
+            return None
+        # Parse json API response
+        try:
+            return json.loads(r.text)
+        except Exception as e:
+            logging.warning("Error parsing JSON API response: {0}".format(e))
+        return None
+
+    def _fetch(self, url, ttl):
+        """ Fetch the URL, or wait for a fetch of the same URL that is already
+            in progress, and cache the result if it is to be kept """
+        with self._lock:
+            future = self._inflight.get(url)
+            owner = future is None
+            if owner:
+                future = self._inflight[url] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+        val = None
+        try:
+            val = self._fetch_json(url)
+        finally:
+            with self._lock:
+                if val is not None and ttl:
+                    self._cache[url] = (monotonic(), val)
+                    self._cache.move_to_end(url)
+                    if len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                del self._inflight[url]
+            # Wake up any callers waiting for this fetch
+            future.set_result(val)
+        return val
+
+    def _refresh(self, url, ttl):
+        """ Refresh a cache entry in the background, unless
+            a fetch of the URL is already in progress """
+        with self._lock:
+            if url in self._inflight:
+                return
+            if self._refresher is None:
+                self._refresher = ThreadPoolExecutor(max_workers=_REFRESH_THREADS)
+        self._refresher.submit(self._fetch, url, ttl)
+
+    def get_json(self, url, ttl=0, stale_ttl=0):
+        """ Return the parsed JSON response from the URL, or None. If ttl is
+            given, the response is cached for ttl seconds, after which it is
+            returned for stale_ttl seconds more while being refreshed. """
+        entry = None
+        if ttl:
+            with self._lock:
+                entry = self._cache.get(url)
+                if entry is not None:
+                    self._cache.move_to_end(url)
+            if entry is not None:
+                age = monotonic() - entry[0]
+                if age < ttl:
+                    self.hits += 1
+                    return entry[1]
+                if age < ttl + stale_ttl:
+                    self.stale_hits += 1
+                    self._refresh(url, ttl)
+                    return entry[1]
+        self.misses += 1
+        val = self._fetch(url, ttl)
+        if val is None and entry is not None:
+            # The fetch failed: an expired response is better than none
+            return entry[1]
+        return val
+
+    def clear(self):
+        """ Empty the cache and reset the statistics """
+        with self._lock:
+            self._cache.clear()
+            self._breakers.clear()
+            self.requests = self.failures = self.rejected = 0
+            self.hits = self.stale_hits = self.misses = self.coalesced = 0
+
+    def stats(self):
+        """ Return a dict of client statistics """
+        with self._lock:
+            open_breakers = sorted(h for h, b in self._breakers.items() if b.is_open())
+        lookups = self.hits + self.stale_hits + self.misses
+        return dict(
+            requests=self.requests,
+            failures=self.failures,
+            rejected=self.rejected,
+            coalesced=self.coalesced,
+            cache_size=len(self._cache),
+            hits=self.hits,
+            stale_hits=self.stale_hits,
+            misses=self.misses,
+            hit_rate=(self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            open_breakers=open_breakers,
+        )
+
+
+# The per-process client instance, created on first use in each process.
+# A client that a forked worker process inherits from its parent is
+# replaced, since its pooled connections are shared with the parent
+# and its refresh threads do not exist in the child.
+_client = None  # type: Optional[APIClient]
+_client_pid = None  # type: Optional[int]
+_client_lock = threading.Lock()
+
+
+def api_client():
+    """ Return the per-process API client, creating it if required """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = APIClient()
+                _client_pid = pid
+    return _client
+
+
+def get(url, params=None, timeout=None):
+    """ Send a GET request via the shared client,
+        returning the response or None """
+    return api_client().get(url, params=params, timeout=timeout)
+
+
+def get_json(url, ttl=0, stale_ttl=0):
+    """ Return the parsed JSON response from the URL, or None,
+        optionally cached (see APIClient.get_json()) """
+    return api_client().get_json(url, ttl=ttl, stale_ttl=stale_ttl)
+
+
+def stats():
+    """ Return a dict of statistics for the per-process client """
+    return api_client().stats()
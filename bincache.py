@@ -0,0 +1,327 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    BÍN lookup cache module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a single, process-wide cache for word lookups
+    in BÍN and for values derived from them (word roots, nominative and
+    canonical forms, etc.). It is shared by tree processing, query handling
+    and entity recognition.
+
+    The cache is a thread-safe LRU cache whose size is given by the
+    bin_cache_size setting (or the GREYNIR_BIN_CACHE_SIZE environment
+    variable). It keeps statistics of hits, misses and evictions.
+
+    The contents of the cache can be saved to a snapshot file. A snapshot
+    is opened read-only via mmap and consulted on cache misses, decoding
+    only the entries that are actually requested. If the snapshot is
+    loaded before worker processes are forked, they share the mapped pages
+    and do not have to repeat the warm-up individually. Worker processes
+    can hand the entries they add over to a parent process, which saves
+    them to the snapshot (see track_new_entries()).
+
+    Cached values are shared between callers and must not be modified.
+
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import os
+import mmap
+import pickle
+import struct
+import threading
+
+from collections import OrderedDict
+
+from settings import Settings
+from reynir.bindb import BIN_Db
+
+
+class _Snapshot:
+
+    """ A read-only, memory-mapped snapshot of cache entries.
+        The file consists of a header with a magic signature and the
+        offset of the index, followed by the pickled values, and finally
+        the pickled index, which maps keys to (offset, length) tuples. """
+
+    MAGIC = b"GRBINC01"
+    HEADER = struct.Struct("<8sQ")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            self._mm.close()
+            raise ValueError("{0} is not a BÍN cache snapshot".format(path))
+        self._index = pickle.loads(self._mm[index_offset:])
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def get(self, key, default=None):
+        """ Decode and return the value for the given key, if present """
+        pos = self._index.get(key)
+        if pos is None:
+            return default
+        offset, length = pos
+        return pickle.loads(self._mm[offset : offset + length])
+
+    def close(self):
+        self._mm.close()
+
+    @classmethod
+    def write(cls, path, items):
+        """ Write a snapshot file containing the given (key, value) items.
+            The file is written under a temporary name and then renamed,
+            so that processes that have the old snapshot mapped are not affected. """
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        index = dict()  # type: Dict[Any, Tuple[int, int]]
+        with open(tmp_path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, 0))
+            for key, val in items:
+                data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+                index[key] = (f.tell(), len(data))
+                f.write(data)
+            index_offset = f.tell()
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, index_offset))
+        os.replace(tmp_path, path)
+        return len(index)
+
+
+class LookupCache:
+
+    """ A thread-safe LRU cache with statistics, optionally
+        backed by a read-only snapshot """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self._snapshot = None  # type: Optional[_Snapshot]
+        self.hits = 0
+        self.snapshot_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Keys of entries calculated since the last take_new_entries()
+        # call, if tracking is enabled
+        self._new_keys = None  # type: Optional[List[Any]]
+
+    def lookup(self, key, func, *args):
+        """ Return the cached value for key, calling func(*args)
+            to calculate it if not found in the cache """
+        cache = self._cache
+        with self._lock:
+            val = cache.get(key, _MISSING)
+            if val is not _MISSING:
+                cache.move_to_end(key)
+                self.hits += 1
+                return val
+        if self._snapshot is not None:
+            val = self._snapshot.get(key, _MISSING)
+        calculated = val is _MISSING
+        if calculated:
+            # Calculate the value outside the lock, since this may be slow
+            val = func(*args)
+            self.misses += 1
+        else:
+            self.snapshot_hits += 1
+        with self._lock:
+            cache[key] = val
+            if calculated and self._new_keys is not None:
+                self._new_keys.append(key)
+            if len(cache) > self.maxsize:
+                cache.popitem(last=False)
+                self.evictions += 1
+        return val
+
+    def track_new_entries(self):
+        """ Start keeping track of the entries that are calculated,
+            i.e. not found in the cache or in the snapshot """
+        with self._lock:
+            if self._new_keys is None:
+                self._new_keys = []
+
+    def take_new_entries(self):
+        """ Return a list of (key, value) tuples for the entries calculated
+            since the last call that are still in the cache """
+        with self._lock:
+            if not self._new_keys:
+                return []
+            keys = self._new_keys
+            self._new_keys = []
+            cache = self._cache
+            return [(key, cache[key]) for key in keys if key in cache]
+
+    def clear(self):
+        """ Empty the cache and reset the statistics """
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.snapshot_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ Return a dict of cache statistics """
+        lookups = self.hits + self.snapshot_hits + self.misses
+        return dict(
+            size=len(self._cache),
+            maxsize=self.maxsize,
+            snapshot_size=len(self._snapshot) if self._snapshot is not None else 0,
+            hits=self.hits,
+            snapshot_hits=self.snapshot_hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=(self.hits + self.snapshot_hits) / lookups if lookups else 0.0,
+        )
+
+    def load_snapshot(self, path):
+        """ Memory-map a snapshot file, to be consulted on cache misses """
+        snapshot = _Snapshot(path)
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.close()
+            self._snapshot = snapshot
+        return len(snapshot)
+
+    def save_snapshot(self, path, entries=None):
+        """ Save the contents of the cache, merged with the current
+            snapshot (if any) and the given (key, value) entries,
+            to a snapshot file """
+        with self._lock:
+            items = dict()
+            snapshot = self._snapshot
+            if snapshot is not None:
+                for key in snapshot.keys():
+                    items[key] = snapshot.get(key)
+            items.update(self._cache)
+        if entries:
+            items.update(entries)
+        return _Snapshot.write(path, items.items())
+
+
+# Sentinel for missing cache entries
+_MISSING = object()
+
+# The process-wide cache instance, created on first use
+_cache = None  # type: Optional[LookupCache]
+_cache_lock = threading.Lock()
+
+
+def lookup_cache():
+    """ Return the process-wide lookup cache, creating it if required """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LookupCache(Settings.BIN_CACHE_SIZE)
+    return _cache
+
+
+def lookup(key, func, *args):
+    """ Return a cached value for the given key, calling func(*args)
+        to calculate it if not found in the cache """
+    return lookup_cache().lookup(key, func, *args)
+
+
+def _lookup_word(w, at_sentence_start):
+    with BIN_Db.get_db() as db:
+        return db.lookup_word(w, at_sentence_start)
+
+
+def _meanings(w):
+    with BIN_Db.get_db() as db:
+        return db.meanings(w)
+
+
+def _lookup_nominative(w):
+    with BIN_Db.get_db() as db:
+        return db.lookup_nominative(w)
+
+
+def _lookup_raw_nominative(w):
+    with BIN_Db.get_db() as db:
+        return db.lookup_raw_nominative(w)
+
+
+def lookup_word(w, at_sentence_start=False):
+    """ Cached version of BIN_Db.lookup_word(), returning
+        a (word, meanings) tuple """
+    return lookup_cache().lookup(
+        ("w", w, at_sentence_start), _lookup_word, w, at_sentence_start
+    )
+
+
+def meanings(w):
+    """ Cached version of BIN_Db.meanings() """
+    return lookup_cache().lookup(("m", w), _meanings, w)
+
+
+def lookup_nominative(w):
+    """ Cached version of BIN_Db.lookup_nominative() """
+    return lookup_cache().lookup(("nf", w), _lookup_nominative, w)
+
+
+def lookup_raw_nominative(w):
+    """ Cached version of BIN_Db.lookup_raw_nominative() """
+    return lookup_cache().lookup(("rnf", w), _lookup_raw_nominative, w)
+
+
+def stats():
+    """ Return a dict of statistics for the process-wide cache """
+    return lookup_cache().stats()
+
+
+def load_snapshot(path=None):
+    """ Load a snapshot into the process-wide cache, by default from the
+        path given in the GREYNIR_BIN_CACHE_SNAPSHOT environment variable.
+        Returns the number of entries in the snapshot, or 0 if none was loaded. """
+    path = path or Settings.BIN_CACHE_SNAPSHOT
+    if not path or not os.path.exists(path):
+        return 0
+    return lookup_cache().load_snapshot(path)
+
+
+def save_snapshot(path=None, entries=None):
+    """ Save the process-wide cache to a snapshot file, by default to the
+        path given in the GREYNIR_BIN_CACHE_SNAPSHOT environment variable,
+        along with the given (key, value) entries, e.g. from worker processes.
+        Returns the number of entries written, or 0 if no path is given. """
+    path = path or Settings.BIN_CACHE_SNAPSHOT
+    if not path:
+        return 0
+    return lookup_cache().save_snapshot(path, entries)
+
+
+def track_new_entries():
+    """ Keep track of the entries calculated by the process-wide cache,
+        for take_new_entries(). When called before worker processes are
+        forked, the workers keep track of their entries too. """
+    lookup_cache().track_new_entries()
+
+
+def take_new_entries():
+    """ Return a list of (key, value) tuples for the entries calculated by
+        the process-wide cache since the last call, if tracking is enabled """
+    return lookup_cache().take_new_entries()
@@ -23,6 +23,9 @@
 
 """
 
+import json
+
+import numpy as np
 
 from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
@@ -32,6 +35,7 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    LargeBinary,
     Float,
     DateTime,
     Sequence,
@@ -62,6 +66,39 @@ class CaseInsensitiveComparator(Comparator):
 Base = declarative_base()
 
 
+# Data type of the topic vectors in the articles.topic_vector_bin column
+TOPIC_VECTOR_DTYPE = np.dtype("<f4")
+
+
+def pack_topic_vector(vector):
+    """ Convert a topic vector, i.e. a sequence of floats,
+        to bytes for the articles.topic_vector_bin column """
+    return np.asarray(vector, dtype=TOPIC_VECTOR_DTYPE).tobytes()
+
+
+def unpack_topic_vector(binary, json_text=None):
+    """ Return a topic vector as a read-only float32 array, given the values
+        of the articles.topic_vector_bin and articles.topic_vector columns.
+        The JSON column is only used for articles whose topic vector has not
+        been migrated to the binary column. Returns None if the article
+        has no topic vector, or it is not a list of numbers. """
+    if binary:
+        if len(binary) % TOPIC_VECTOR_DTYPE.itemsize != 0:
+            # Truncated or otherwise corrupt value
+            return None
+        return np.frombuffer(binary, dtype=TOPIC_VECTOR_DTYPE)
+    if json_text:
+        try:
+            vector = json.loads(json_text)
+            if isinstance(vector, list):
+                return np.array(vector, dtype=TOPIC_VECTOR_DTYPE)
+        except (TypeError, ValueError):
+            # Invalid JSON (json.JSONDecodeError is a subclass of
+            # ValueError) or a list containing something other than numbers
+            pass
+    return None
+
+
 class Root(Base):
     """ Represents a scraper root, i.e. a base domain and root URL """
 
@@ -159,8 +196,13 @@ class Article(Base):
     tree = Column(String)
     # The tokens of the article in JSON string format
     tokens = Column(String)
-    # The article topic vector as an array of floats in JSON string format
+    # The article topic vector as an array of floats in JSON string format.
+    # This has been superseded by topic_vector_bin and is only read for
+    # articles that have not been migrated (see utils/migratetopics.py).
     topic_vector = Column(String)
+    # The article topic vector as little-endian float32 values
+    # (see pack_topic_vector() and unpack_topic_vector())
+    topic_vector_bin = Column(LargeBinary)
 
     # The back-reference to the Root parent of this Article
     root = relationship(
@@ -450,6 +492,40 @@ class ArticleTopic(Base):
         return cls.__table__
 
 
+class RelatedArticle(Base):
+    """ Represents an article that is similar to another article, as
+        precomputed by the similarity server for recent and popular articles """
+
+    __tablename__ = "related"
+
+    # Number of related articles that are stored for each article
+    MAX_RELATED = 15
+
+    # The article whose related articles are stored. There are no foreign
+    # keys, since the similarity server may store ids of articles that are
+    # being deleted; readers skip those.
+    article_id = Column(psql_UUID(as_uuid=False), nullable=False)
+
+    # A related article
+    related_id = Column(psql_UUID(as_uuid=False), nullable=False)
+
+    # The cosine similarity of the topic vectors of the articles
+    similarity = Column(Float, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("article_id", "related_id", name="related_pkey"),
+    )
+
+    def __repr__(self):
+        return "RelatedArticle(article_id='{0}', related_id='{1}', similarity={2})".format(
+            self.article_id, self.related_id, self.similarity
+        )
+
+    @classmethod
+    def table(cls):
+        return cls.__table__
+
+
 class Trigram(Base):
     """ Represents a trigram of tokens from a parsed sentence """
 
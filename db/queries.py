@@ -198,10 +198,12 @@ class RelatedWordsQuery(_BaseQuery):
 class TermTopicsQuery(_BaseQuery):
     """ A query for topic vectors of documents where a given (stem, cat)
         tuple appears. We return the newest articles first, in case the
-        query result is limited by a specified limit. """
+        query result is limited by a specified limit. The topic vectors
+        are returned from both the binary and the JSON column, to be
+        passed to models.unpack_topic_vector(). """
 
     _Q = """
-        select topic_vector, q.cnt
+        select topic_vector_bin, topic_vector, q.cnt
             from (
                 select a.id as id, sum(w.cnt) as cnt
                 from articles a, words w
@@ -214,6 +216,21 @@ class TermTopicsQuery(_BaseQuery):
         """
 
 
+class FrequentTermsQuery(_BaseQuery):
+    """ A query for the (stem, cat) tuples of the given categories that
+        appear most often in articles published since a given time """
+
+    _Q = """
+        select w.stem, w.cat, sum(w.cnt) as c
+            from words w, articles a
+            where w.article_id = a.id and a.timestamp >= :since
+            and w.cat in :cats
+            group by w.stem, w.cat
+            order by c desc
+            limit :limit;
+        """
+
+
 class ArticleCountQuery(_BaseQuery):
     """ A query yielding the number of articles containing any of the given word stems """
 
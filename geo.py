@@ -29,6 +29,7 @@ import re
 import sys
 import os
 import math
+import numpy as np
 from iceaddr import iceaddr_lookup, placename_lookup
 from cityloc import city_lookup
 from country_list import countries_for_language, available_languages
@@ -723,6 +724,67 @@ def distance(loc1, loc2):
     return _EARTH_RADIUS * c
 
 
+class SpatialIndex:
+
+    """ An index of items with (lat, lon) locations, for finding the items
+        nearest to a location or within a given distance from it.
+        The coordinates are stored in NumPy arrays, and the Haversine
+        distances from a location to all items are calculated in a single
+        vectorized operation. For the data sets in question (petrol stations,
+        bus stops, i.e. thousands of points at most), this is considerably
+        faster than a tree structure traversed in Python. """
+
+    def __init__(self, items, location=None):
+        """ Create an index of the given items. The location function
+            returns the (lat, lon) tuple of an item; by default, the
+            items are (lat, lon) tuples themselves. """
+        self.items = list(items)
+        location = location or (lambda item: item)
+        coords = np.radians(
+            np.array([location(item) for item in self.items], dtype=np.float64)
+        ).reshape(-1, 2)
+        self._lat = coords[:, 0]
+        self._lon = coords[:, 1]
+        self._cos_lat = np.cos(self._lat)
+
+    def __len__(self):
+        return len(self.items)
+
+    def distances(self, loc):
+        """ Return an array of the distances in km from loc to each item """
+        lat, lon = math.radians(loc[0]), math.radians(loc[1])
+        slat = np.sin((self._lat - lat) / 2)
+        slon = np.sin((self._lon - lon) / 2)
+        a = slat * slat + math.cos(lat) * self._cos_lat * slon * slon
+        return 2 * _EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, loc, k=1, within_radius=None):
+        """ Return a list of up to k (distance, item) tuples for the items
+            nearest to loc, in increasing order of distance, optionally
+            only including items within the given radius (in km) """
+        if k < 1 or not self.items:
+            return []
+        dist = self.distances(loc)
+        if k < len(dist):
+            ix = np.argpartition(dist, k - 1)[0:k]
+        else:
+            ix = np.arange(len(dist))
+        ix = ix[np.argsort(dist[ix], kind="stable")]
+        if within_radius is not None:
+            ix = ix[dist[ix] <= within_radius]
+        return [(float(dist[i]), self.items[i]) for i in ix]
+
+    def within(self, loc, radius):
+        """ Return a list of (distance, item) tuples for the items within
+            the given radius (in km) from loc, in increasing order of distance """
+        if not self.items:
+            return []
+        dist = self.distances(loc)
+        ix = np.flatnonzero(dist <= radius)
+        ix = ix[np.argsort(dist[ix], kind="stable")]
+        return [(float(dist[i]), self.items[i]) for i in ix]
+
+
 if __name__ == "__main__":
     """ Test location info lookup via command line. """
     name = sys.argv[1] if len(sys.argv) > 1 else None
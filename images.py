@@ -19,13 +19,11 @@ import sys
 import json
 import logging
 import urllib.request
-import urllib.parse
-from urllib.error import HTTPError
 from io import BytesIO
 from datetime import datetime, timedelta
 from collections import namedtuple
-from contextlib import closing
 import requests
+import apiclient
 from db import SessionContext
 from db.models import Link, BlacklistedLink
 from settings import Settings
@@ -38,28 +36,19 @@ QUERY_TIMEOUT = 4.0
 def _server_query(url, q):
     """ Query a server via HTTP GET with a URL-encoded query string obtained from the dict q """
     doc = None
-    if len(q):
-        url += "?" + urllib.parse.urlencode(q)
-    try:
-        with closing(urllib.request.urlopen(url, timeout=QUERY_TIMEOUT)) as response:
-            if response:
-                # Decode the HTML Content-type header to obtain the
-                # document type and the charset (content encoding), if specified
-                encoding = "ISO-8859-1"
-                ctype = response.getheader("Content-type", "")
-                if ";" in ctype:
-                    s = ctype.split(";")
-                    ctype = s[0]
-                    enc = s[1].strip()
-                    s = enc.split("=")
-                    if s[0] == "charset" and len(s) == 2:
-                        encoding = s[1]
-                if ctype == "application/json":
-                    doc = response.read()  # doc is a bytes object
-                    if doc:
-                        doc = doc.decode(encoding)
-    except HTTPError as ex:
-        logging.warning("server_query exception: {0}".format(ex))
+    r = apiclient.get(url, params=q or None, timeout=QUERY_TIMEOUT)
+    if r is None:
+        return None
+    if r.status_code != 200:
+        logging.warning("server_query status: {0}".format(r.status_code))
+        return None
+    # Check the Content-type header to obtain the document type and
+    # the charset (content encoding), if specified
+    ctype, _, params = r.headers.get("Content-type", "").partition(";")
+    if ctype.strip() == "application/json":
+        if "charset" not in params:
+            r.encoding = "ISO-8859-1"
+        doc = r.text or None
     return doc
 
 
@@ -55,6 +55,8 @@ import reynir_correct
 
 from settings import Settings, ConfigError
 from article import Article as ArticleProxy
+import bincache
+import prefetch
 
 # RUNNING_AS_SERVER is True if we're executing under nginx/Gunicorn,
 # but False if the program was invoked directly as a Python main module.
@@ -89,6 +91,7 @@ app.config["CACHE"] = cache
 
 # Register blueprint routes
 from routes import routes, max_age
+from query import Query
 
 app.register_blueprint(routes)
 
@@ -323,3 +326,14 @@ else:
     # Running as a server module: pre-load the grammar into memory
     with Fast_Parser() as fp:
         pass
+
+    # Map the BÍN lookup cache snapshot, if one has been configured
+    bincache.load_snapshot()
+
+    # Load the query processors and the query grammar at worker boot,
+    # rather than when the first query arrives
+    Query.init_class()
+
+    # Start fetching the data sets used by query modules (petrol prices,
+    # exchange rates, schedules, etc.) in the background
+    prefetch.start()
@@ -33,7 +33,8 @@ from collections import defaultdict
 import logging
 
 from reynir import Abbreviations, TOK
-from reynir.bindb import BIN_Db
+
+import bincache
 
 from db import SessionContext, OperationalError
 from db.models import Entity
@@ -60,7 +61,7 @@ def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
     # Last name to full name mapping ('Clinton' -> 'Hillary Clinton')
     lastnames = dict()
 
-    with BIN_Db.get_db() as db, SessionContext(
+    with SessionContext(
         session=enclosing_session, commit=True, read_only=True
     ) as session:
 
@@ -208,7 +209,7 @@ def recognize_entities(token_stream, enclosing_session=None, token_ctor=TOK):
                         # Clinton -> Hillary [Rodham] Clinton
                         if lastname[0].isupper():
                             # Look for Icelandic patronyms/matronyms
-                            _, m = db.lookup_word(lastname, False)
+                            _, m = bincache.lookup_word(lastname, False)
                             if m and any(mm.fl in {"föð", "móð"} for mm in m):
                                 # We don't store Icelandic patronyms/matronyms
                                 # as surnames
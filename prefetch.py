@@ -0,0 +1,212 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Background prefetch module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module keeps in-memory snapshots of periodically updated data
+    sets that query modules use, such as petrol prices, exchange rates,
+    news headlines and the TV and bus schedules.
+
+    A query module registers a data set with a function that fetches it
+    and a refresh interval, and reads the current snapshot with get().
+    A scheduler thread in each process fetches the data sets again when
+    their interval has passed, and replaces the snapshot in one assignment
+    once the new data is complete, so readers see either the old snapshot
+    or the new one, never a partial update. If a fetch fails, the old
+    snapshot is kept and the fetch is retried shortly.
+
+    The scheduler thread is started on the first get() in each process,
+    so worker processes that are forked from a preloaded parent start
+    their own. Only when a data set has never been fetched in the process
+    does get() fetch it in the calling thread.
+
+    Snapshots are shared between threads and must not be modified.
+
+"""
+
+from typing import Any, Dict, Optional
+
+import os
+import logging
+import threading
+
+from time import monotonic
+
+
+# Seconds until a failed fetch is retried
+_RETRY_INTERVAL = 60.0
+
+# Maximum number of seconds that the scheduler sleeps at a time
+_MAX_SLEEP = 60.0
+
+
+class Dataset:
+
+    """ A periodically refreshed data set """
+
+    def __init__(self, name, fetch, interval, is_current=None):
+        self.name = name
+        # Function that returns the data set, or None if it is not available
+        self.fetch = fetch
+        # Seconds between refreshes
+        self.interval = interval
+        # Optional function that returns False if the current snapshot must be
+        # replaced even if the interval has not passed (e.g. at midnight)
+        self.is_current = is_current
+        self.value = None  # type: Any
+        self.fetched_at = None  # type: Optional[float]
+        self.due = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def is_due(self, now):
+        if now >= self.due:
+            return True
+        if self.value is None or self.is_current is None:
+            return False
+        return not self.is_current(self.value)
+
+    def refresh(self, if_missing=False):
+        """ Fetch the data set and publish it as the current snapshot.
+            If if_missing is True, a snapshot that another thread
+            has published in the meantime is kept. """
+        if if_missing and self.value is not None:
+            return True
+        # The lock is not held during the fetch: a process that is forked
+        # while a fetch is in progress would otherwise inherit a lock that
+        # is never released. Concurrent fetches of a data set that has not
+        # been fetched yet are harmless.
+        try:
+            value = self.fetch()
+        except Exception as e:
+            logging.warning("Error fetching {0}: {1}".format(self.name, e))
+            value = None
+        with self._lock:
+            now = monotonic()
+            if if_missing and self.value is not None:
+                return True
+            if value is None:
+                self.failures += 1
+                self.due = now + min(self.interval, _RETRY_INTERVAL)
+                return False
+            # Replace the snapshot in a single assignment
+            self.value = value
+            self.fetched_at = now
+            self.due = now + self.interval
+            self.refreshes += 1
+            return True
+
+    def stats(self):
+        return dict(
+            loaded=self.value is not None,
+            age=monotonic() - self.fetched_at if self.fetched_at is not None else None,
+            interval=self.interval,
+            refreshes=self.refreshes,
+            failures=self.failures,
+        )
+
+
+class Prefetcher:
+
+    """ A registry of data sets, refreshed by a background thread """
+
+    def __init__(self):
+        self._datasets = dict()  # type: Dict[str, Dataset]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+
+    def register(self, name, fetch, interval, is_current=None):
+        """ Register a data set under the given name """
+        with self._lock:
+            if name not in self._datasets:
+                self._datasets[name] = Dataset(name, fetch, interval, is_current)
+        # Let a running scheduler fetch the new data set
+        self._wakeup.set()
+
+    def start(self):
+        """ Start the scheduler thread, if not already running in this process """
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="prefetch", daemon=True
+            )
+            self._pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = monotonic()
+            with self._lock:
+                datasets = list(self._datasets.values())
+            for ds in datasets:
+                if ds.is_due(now):
+                    ds.refresh()
+            now = monotonic()
+            sleep = min([ds.due - now for ds in datasets] + [_MAX_SLEEP])
+            if sleep > 0.0:
+                self._wakeup.wait(sleep)
+
+    def get(self, name):
+        """ Return the current snapshot of a data set, or None if not available """
+        self.start()
+        ds = self._datasets[name]
+        value = ds.value
+        if value is None:
+            # Never fetched in this process: fetch it now
+            ds.refresh(if_missing=True)
+            value = ds.value
+        return value
+
+    def stats(self):
+        """ Return a dict of statistics for each data set """
+        with self._lock:
+            return {name: ds.stats() for name, ds in self._datasets.items()}
+
+
+# The per-process prefetcher instance
+_prefetcher = Prefetcher()
+
+
+def register(name, fetch, interval, is_current=None):
+    """ Register a data set, fetched by calling fetch() every
+        interval seconds, or when is_current(snapshot) returns False """
+    _prefetcher.register(name, fetch, interval, is_current)
+
+
+def get(name):
+    """ Return the current snapshot of a registered data set, or None """
+    return _prefetcher.get(name)
+
+
+def start():
+    """ Start refreshing the registered data sets in the background """
+    _prefetcher.start()
+
+
+def stats():
+    """ Return a dict of statistics for the registered data sets """
+    return _prefetcher.stats()
@@ -29,6 +29,10 @@
     A multiprocessing pool is employed to process articles in parallel on all available
     CPUs.
 
+    Call counts and wall-clock times are recorded for each processor module, hook
+    function and nonterminal handler, as well as for database commits. These are
+    aggregated across the worker processes and reported when processing completes.
+
 """
 
 import getopt
@@ -38,6 +42,8 @@ import sys
 import time
 import os
 
+from time import perf_counter
+
 # from multiprocessing.dummy import Pool
 from multiprocessing import Pool
 from contextlib import closing
@@ -46,7 +52,8 @@ from datetime import datetime
 from settings import Settings, ConfigError
 from db import Scraper_DB
 from db.models import Article, Person
-from tree import Tree
+from tree import Tree, ProcessorDispatch
+import bincache
 
 
 _PROFILING = False
@@ -84,14 +91,15 @@ class TokenContainer:
         if not self.tokens:
             return
 
-        # Get functions from processor module
-        article_begin = getattr(processor, "article_begin", None)
-        article_end = getattr(processor, "article_end", None)
-        paragraph_begin = getattr(processor, "paragraph_begin", None)
-        paragraph_end = getattr(processor, "paragraph_end", None)
-        sentence_begin = getattr(processor, "sentence_begin", None)
-        sentence_end = getattr(processor, "sentence_end", None)
-        token_func = getattr(processor, "token", None)
+        # Get functions from the precompiled dispatch table of the processor module
+        dispatch = ProcessorDispatch.get(processor)
+        article_begin = dispatch.article_begin
+        article_end = dispatch.article_end
+        paragraph_begin = dispatch.paragraph_begin
+        paragraph_end = dispatch.paragraph_end
+        sentence_begin = dispatch.sentence_begin
+        sentence_end = dispatch.sentence_end
+        token_func = dispatch.token
 
         # Make sure at least one of these functions is is present
         if not any(
@@ -120,32 +128,89 @@ class TokenContainer:
             "processor": processor,
         }
 
+        call = dispatch.call
+
         if article_begin:
-            article_begin(state)
+            call("article_begin", article_begin, state)
 
         # Paragraphs
         for p in self.tokens:
             if paragraph_begin:
-                paragraph_begin(state, p)
+                call("paragraph_begin", paragraph_begin, state, p)
 
             # Sentences
             for s in p:
                 if sentence_begin:
-                    sentence_begin(state, p, s)
+                    call("sentence_begin", sentence_begin, state, p, s)
 
                 # Tokens
                 if token_func:
                     for idx, t in enumerate(s):
-                        token_func(state, p, s, t, idx)
+                        call("token", token_func, state, p, s, t, idx)
 
                 if sentence_end:
-                    sentence_end(state, p, s)
+                    call("sentence_end", sentence_end, state, p, s)
 
             if paragraph_end:
-                paragraph_end(state, p)
+                call("paragraph_end", paragraph_end, state, p)
 
         if article_end:
-            article_end(state)
+            call("article_end", article_end, state)
+
+
+# Key for the total time spent in a processor module
+_TOTAL = "(total)"
+
+# Pseudo-module names for timings that don't belong to a processor module
+_DB = "(database)"
+_LOAD = "(tree load)"
+
+
+def merge_timings(total, timings):
+    """ Merge a dict of {module: {key: [calls, seconds]}} timings into total """
+    for module, keys in timings.items():
+        tm = total.setdefault(module, dict())
+        for key, (calls, seconds) in keys.items():
+            t = tm.get(key)
+            if t is None:
+                tm[key] = [calls, seconds]
+            else:
+                t[0] += calls
+                t[1] += seconds
+
+
+def timing_report(timings, wall_time, file=None):
+    """ Print a summary report of processing timings, sorted by time spent """
+    print("\n------ Processing timings -------", file=file)
+    print(
+        "{0:<28} {1:<28} {2:>10} {3:>10} {4:>10} {5:>6}".format(
+            "Module", "Hook/nonterminal", "Calls", "Seconds", "ms/call", "%"
+        ),
+        file=file,
+    )
+    rows = [
+        (module, key, calls, seconds)
+        for module, keys in timings.items()
+        for key, (calls, seconds) in keys.items()
+    ]
+    rows.sort(key=lambda r: r[3], reverse=True)
+    for module, key, calls, seconds in rows:
+        print(
+            "{0:<28} {1:<28} {2:>10} {3:>10.2f} {4:>10.3f} {5:>6.1f}".format(
+                module[-28:],
+                key[-28:],
+                calls,
+                seconds,
+                1000.0 * seconds / calls if calls else 0.0,
+                100.0 * seconds / wall_time if wall_time else 0.0,
+            ),
+            file=file,
+        )
+    print(
+        "Wall time {0:.2f} seconds; percentages are of wall time, "
+        "summed over all workers".format(wall_time),
+        file=file,
+    )
 
 
 class Processor:
@@ -169,6 +234,12 @@ class Processor:
 
         Processor._init_class()
         self.num_workers = num_workers
+        # Aggregated timings, as {module: {key: [calls, seconds]}}
+        self.timings = dict()
+        # The most recent BÍN lookup cache statistics from each worker process
+        self.cache_stats = dict()
+        # BÍN lookup cache entries calculated by the worker processes
+        self.cache_entries = dict()
 
         self.processors = []
         self.pmodules = None
@@ -213,16 +284,22 @@ class Processor:
 
     def go_single(self, url):
         """ Single article processor that will be called by a process within a
-            multiprocessing pool """
+            multiprocessing pool. Returns a (timings, pid, cache stats, new cache
+            entries) tuple for aggregation in the parent process. """
 
         print("Processing article {0}".format(url))
         sys.stdout.flush()
 
         # If first article within a new process, import the processor modules
+        # and compile their dispatch tables
         if self.pmodules is None:
             self.pmodules = [
                 importlib.import_module(modname) for modname in self.processors
             ]
+            for m in self.pmodules:
+                ProcessorDispatch.get(m)
+
+        timings = dict()
 
         # Load the article
         with closing(self._db.session) as session:
@@ -234,15 +311,18 @@ class Processor:
                     print("Article not found in scraper database")
                 else:
                     if article.tree and article.tokens:
+                        t0 = perf_counter()
                         tree = Tree(url, article.authority)
                         tree.load(article.tree)
 
                         token_container = TokenContainer(
                             article.tokens, url, article.authority
                         )
+                        timings[_LOAD] = {_TOTAL: [1, perf_counter() - t0]}
 
                         # Run all processors in turn
                         for p in self.pmodules:
+                            t0 = perf_counter()
                             if p.PROCESSOR_TYPE == "tree":
                                 tree.process(session, p)
                             elif p.PROCESSOR_TYPE == "token":
@@ -253,12 +333,16 @@ class Processor:
                                     + p.PROCESSOR_TYPE
                                     + "' (should be 'tree' or 'token')"
                                 )
+                            ProcessorDispatch.get(p).record(_TOTAL, perf_counter() - t0)
 
                     # Mark the article as being processed
                     article.processed = datetime.utcnow()
 
                 # So far, so good: commit to the database
+                # (this flushes the rows added by the processors)
+                t0 = perf_counter()
                 session.commit()
+                timings[_DB] = {"commit": [1, perf_counter() - t0]}
 
             except Exception as e:
                 # If an exception occurred, roll back the transaction
@@ -272,7 +356,54 @@ class Processor:
 
         sys.stdout.flush()
 
-    def go(self, from_date=None, limit=0, force=False, update=False, title=None):
+        # Collect the timings of the processor modules for this article
+        for p in self.pmodules:
+            timings[p.__name__] = ProcessorDispatch.get(p).collect_timings()
+        return timings, os.getpid(), bincache.stats(), bincache.take_new_entries()
+
+    def _accumulate(self, stats):
+        """ Accumulate the timings, cache statistics and new
+            cache entries returned by go_single() """
+        timings, pid, cache_stats, cache_entries = stats
+        merge_timings(self.timings, timings)
+        self.cache_stats[pid] = cache_stats
+        self.cache_entries.update(cache_entries)
+
+    def report(self, wall_time, report_file=None):
+        """ Print a summary of the processing timings and BÍN lookup
+            cache statistics, and optionally write them to a JSON file """
+        timing_report(self.timings, wall_time)
+        cache = dict(hits=0, snapshot_hits=0, misses=0, evictions=0)
+        for cs in self.cache_stats.values():
+            for key in cache:
+                cache[key] += cs[key]
+        lookups = cache["hits"] + cache["snapshot_hits"] + cache["misses"]
+        cache["hit_rate"] = (
+            (cache["hits"] + cache["snapshot_hits"]) / lookups if lookups else 0.0
+        )
+        print(
+            "BÍN lookup cache: {0} lookups, hit rate {1:.1f}%, {2} evictions".format(
+                lookups, 100.0 * cache["hit_rate"], cache["evictions"]
+            )
+        )
+        if report_file:
+            with open(report_file, "w", encoding="utf-8") as f:
+                json.dump(
+                    dict(wall_time=wall_time, timings=self.timings, bin_cache=cache),
+                    f,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+
+    def go(
+        self,
+        from_date=None,
+        limit=0,
+        force=False,
+        update=False,
+        title=None,
+        report_file=None,
+    ):
         """ Process already parsed articles from the database """
 
         # noinspection PyComparisonWithNone,PyShadowingNames
@@ -314,17 +445,34 @@ class Processor:
                 for a in q.yield_per(200):
                     yield field(a)
 
+        # Map the BÍN lookup cache snapshot, if configured, before forking
+        # the worker processes, so that they share it
+        bincache.load_snapshot()
+
+        t0 = perf_counter()
         if _PROFILING:
             # If profiling, just do a simple map within a single thread and process
             for url in iter_parsed_articles():
-                self.go_single(url)
+                self._accumulate(self.go_single(url))
+            # Save the warmed-up lookup cache for subsequent runs
+            bincache.save_snapshot()
         else:
+            if Settings.BIN_CACHE_SNAPSHOT:
+                # Have the worker processes return the lookup cache
+                # entries that they calculate, for the snapshot
+                bincache.track_new_entries()
             # Use a multiprocessing pool to process the articles
             # Defaults to using as many processes as there are CPUs
             pool = Pool(self.num_workers)
-            pool.map(self.go_single, iter_parsed_articles())
+            for stats in pool.imap_unordered(self.go_single, iter_parsed_articles()):
+                self._accumulate(stats)
             pool.close()
             pool.join()
+            # Save the lookup cache entries of the workers, so that
+            # subsequent runs and the web server workers start warm
+            bincache.save_snapshot(entries=self.cache_entries)
+            self.cache_entries = dict()
+        self.report(perf_counter() - t0, report_file)
 
 
 def process_articles(
@@ -335,6 +483,7 @@ def process_articles(
     title=None,
     processor=None,
     num_workers=None,
+    report_file=None,
 ):
     """ Process multiple articles according to the given parameters """
     print("------ Greynir starting processing -------")
@@ -364,7 +513,14 @@ def process_articles(
             single_processor=processor,
             num_workers=num_workers,
         )
-        proc.go(from_date, limit=limit, force=force, update=update, title=title)
+        proc.go(
+            from_date,
+            limit=limit,
+            force=force,
+            update=update,
+            title=title,
+            report_file=report_file,
+        )
     finally:
         proc = None
         Processor.cleanup()
@@ -381,7 +537,9 @@ def process_article(url, processor=None):
     """ Process a single article, eventually with a single processor """
     try:
         proc = Processor(processor_directory="processors", single_processor=processor)
+        bincache.load_snapshot()
         proc.go_single(url)
+        bincache.save_snapshot()
     finally:
         proc = None
         Processor.cleanup()
@@ -420,6 +578,8 @@ __doc__ = """
         -p P, --processor=P: Specify a single processor to invoke
         -t T, --title=T: Specify a title pattern in the persons table
                             to select articles to reprocess
+        -w N, --workers=N: Limit the number of worker processes to N
+        -r F, --report=F: Write a JSON report of processing timings to file F
         --update: Process files that have been reparsed but not reprocessed
 
 """
@@ -433,7 +593,7 @@ def _main(argv=None):
         try:
             opts, args = getopt.getopt(
                 argv[1:],
-                "hifl:u:p:t:w:",
+                "hifl:u:p:t:w:r:",
                 [
                     "help",
                     "init",
@@ -444,6 +604,7 @@ def _main(argv=None):
                     "processor=",
                     "title=",
                     "workers=",
+                    "report=",
                 ],
             )
         except getopt.error as msg:
@@ -456,6 +617,7 @@ def _main(argv=None):
         title = None  # Title pattern
         proc = None  # Single processor to invoke
         num_workers = None  # Number of workers to run simultaneously
+        report_file = None  # File to write a JSON timing report to
         # Process options
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -488,6 +650,9 @@ def _main(argv=None):
             elif o in ("-w", "--workers"):
                 # Limit the number of workers
                 num_workers = int(a) if int(a) else None
+            elif o in ("-r", "--report"):
+                # Write a timing report to this file
+                report_file = a
 
         if init:
             # Initialize the scraper database
@@ -525,6 +690,7 @@ def _main(argv=None):
                     title=title,
                     processor=proc,
                     num_workers=num_workers,
+                    report_file=report_file,
                 )
                 # process_articles(limit = limit)
 
@@ -25,18 +25,16 @@
 """
 
 import logging
-import requests
-import json
 import os
 import re
 import locale
 import math
 from urllib.parse import urlencode
-from functools import lru_cache
 
 from tzwhere import tzwhere
 from pytz import country_timezones
 
+import apiclient
 from geo import country_name_for_isocode, iceprep_for_cc
 from reynir.bindb import BIN_Db
 from settings import changedlocale
@@ -365,30 +363,15 @@ def gen_answer(a):
     return dict(answer=a), a, a
 
 
-def query_json_api(url):
-    """ Request the URL, expecting a json response which is 
-        parsed and returned as a Python data structure. """
-
-    # Send request
-    try:
-        r = requests.get(url)
-    except Exception as e:
-        logging.warning(str(e))
-        return None
-
-    # Verify that status is OK
-    if r.status_code != 200:
-        logging.warning("Received status {0} from API server".format(r.status_code))
-        return None
-
-    # Parse json API response
-    try:
-        res = json.loads(r.text)
-        return res
-    except Exception as e:
-        logging.warning("Error parsing JSON API response: {0}".format(e))
-
-    return None
+def query_json_api(url, ttl=0, stale_ttl=0):
+    """ Request the URL, expecting a json response which is
+        parsed and returned as a Python data structure.
+        The request goes through the shared API client, which pools
+        connections and coalesces concurrent requests for the same URL.
+        If ttl is given, the response is cached for ttl seconds, and then
+        served for stale_ttl seconds more while it is refreshed in the
+        background. Cached responses must not be modified. """
+    return apiclient.get_json(url, ttl=ttl, stale_ttl=stale_ttl)
 
 
 # The Google API identifier (you must obtain your
@@ -541,7 +524,9 @@ def query_places_api(
 _PLACEDETAILS_API_URL = "https://maps.googleapis.com/maps/api/place/details/json?{0}"
 
 
-@lru_cache(maxsize=32)
+_PLACEDETAILS_CACHE_TTL = 3600  # seconds
+
+
 def query_place_details(place_id, fields=None):
     """ Look up place details by ID in Google's Place Details API. If "fields"
         parameter is omitted, *all* fields are returned. For details, see
@@ -562,7 +547,7 @@ def query_place_details(place_id, fields=None):
 
     # Send API request
     url = _PLACEDETAILS_API_URL.format(qstr)
-    res = query_json_api(url)
+    res = query_json_api(url, ttl=_PLACEDETAILS_CACHE_TTL)
 
     return res
 
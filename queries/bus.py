@@ -38,14 +38,15 @@
 # TODO: Hvað er ég lengi í næsta strætóskýli?
 
 import re
-from threading import Lock
 from functools import lru_cache
 from collections import defaultdict
 from datetime import datetime
 import random
 
 import query
+import prefetch
 from queries import natlang_seq, numbers_to_neutral
+from geo import SpatialIndex
 from settings import Settings
 from reynir import correct_spaces
 from reynir.bindb import BIN_Db
@@ -53,9 +54,17 @@ from reynir.bindb import BIN_Db
 import straeto
 
 
-# Today's bus schedule, cached
-SCHEDULE_TODAY = None
-SCHEDULE_LOCK = Lock()
+_SCHEDULE_REFRESH_INTERVAL = 24 * 60 * 60  # seconds
+
+
+# Today's bus schedule is built in the background, and replaced
+# as soon as it is no longer valid (i.e. after midnight)
+prefetch.register(
+    "bus_schedule",
+    straeto.BusSchedule,
+    _SCHEDULE_REFRESH_INTERVAL,
+    is_current=lambda schedule: schedule.is_valid_today,
+)
 
 
 # Indicate that this module wants to handle parse trees for queries,
@@ -562,6 +571,21 @@ def _meaning_filter_func(mm):
     return mm2 or mm
 
 
+@lru_cache(maxsize=None)
+def _bus_stop_index():
+    """ Return a spatial index of all bus stops. The stops are loaded
+        from static data by the straeto module and do not change. """
+    return SpatialIndex(
+        straeto.BusStop._all_stops.values(), location=lambda stop: stop.location
+    )
+
+
+def closest_stops(location, n=1, within_radius=None):
+    """ Return a list of (distance, stop) tuples for the bus stops closest
+        to the given location, in increasing order of distance """
+    return _bus_stop_index().nearest(location, n, within_radius=within_radius)
+
+
 @lru_cache(maxsize=None)
 def to_accusative(np):
     """ Return the noun phrase after casting it from nominative to accusative case """
@@ -630,7 +654,7 @@ def query_nearest_stop(query, session, result):
         voice_answer = "Ég veit ekki hvar þú ert."
         return response, answer, voice_answer
     # Get the stop closest to the user
-    stop = straeto.BusStop.closest_to(location)
+    dist, stop = closest_stops(location)[0]
     answer = stop.name
     # Use the same word for the bus stop as in the query
     stop_word = result.stop_word if "stop_word" in result else "stoppistöð"
@@ -639,7 +663,7 @@ def query_nearest_stop(query, session, result):
         stop_word,
         "er", stop.name + ";",
         "þangað", "eru",
-        voice_distance(straeto.distance(location, stop.location)),
+        voice_distance(dist),
     ]
     # Store a location coordinate and a bus stop name in the context
     query.set_context({"location": stop.location, "bus_stop": stop.name})
@@ -682,11 +706,11 @@ def query_arrival_time(query, session, result):
             return response, answer, voice_answer
 
     # Obtain today's bus schedule
-    global SCHEDULE_TODAY
-    with SCHEDULE_LOCK:
-        if SCHEDULE_TODAY is None or not SCHEDULE_TODAY.is_valid_today:
-            # We don't have today's schedule: create it
-            SCHEDULE_TODAY = straeto.BusSchedule()
+    schedule_today = prefetch.get("bus_schedule")
+    if schedule_today is None:
+        answer = voice_answer = "Ekki tókst að sækja tímatöflu strætó."
+        response = dict(answer=answer)
+        return response, answer, voice_answer
 
     # Obtain the set of stops that the user may be referring to
     if stop_name:
@@ -697,10 +721,11 @@ def query_arrival_time(query, session, result):
             straeto.BusStop.sort_by_proximity(stops, query.location)
     else:
         # Obtain the closest stops (at least within 400 meters radius)
-        stops = straeto.BusStop.closest_to(location, n=2, within_radius=0.4)
-        if not stops:
+        closest = closest_stops(location, n=2, within_radius=0.4)
+        if not closest:
             # This will fetch the single closest stop, regardless of distance
-            stops = [straeto.BusStop.closest_to(location)]
+            closest = closest_stops(location)
+        stops = [stop for _, stop in closest]
 
     # Handle the case where no bus number was specified (i.e. is 'Any')
     if result.bus_number == "Any" and stops:
@@ -751,19 +776,19 @@ def query_arrival_time(query, session, result):
     # !!! route '1' would mean 'AL.1' instead of 'ST.1'.
     if stops:
         stop = stops[0]
-        arrivals, arrives = SCHEDULE_TODAY.arrivals(route_number, stop)
+        arrivals, arrives = schedule_today.arrivals(route_number, stop)
         if not arrives and len(stops) > 1:
             # If the requested bus doesn't stop at all at the closest
             # stop, check the 2nd closest stop, if it is close enough
             stop = stops[1]
-            arrivals, arrives = SCHEDULE_TODAY.arrivals(route_number, stop)
+            arrivals, arrives = schedule_today.arrivals(route_number, stop)
         arrivals = list(arrivals.items())
         a = ["Á", to_accusative(stop.name), "í átt að"]
 
     if arrivals:
         # Get a predicted arrival time for each direction from the
         # real-time bus location server
-        prediction = SCHEDULE_TODAY.predicted_arrival(route_number, stop)
+        prediction = schedule_today.predicted_arrival(route_number, stop)
         now = datetime.utcnow()
         hms_now = (now.hour, now.minute + (now.second // 30), 0)
         first = True
@@ -26,11 +26,11 @@
 # TODO: "hvað eru 10 evrur í íslenskum krónum"
 
 import re
-import cachetools
 import json
 import random
 import logging
 
+import prefetch
 from queries import query_json_api, format_icelandic_float, is_plural
 from settings import Settings
 
@@ -434,19 +434,23 @@ def QCurAmountConversion(node, params, result):
 
 
 _CURR_API_URL = "https://apis.is/currency/lb"
-_CURR_CACHE_TTL = 3600  # seconds
+_CURR_REFRESH_INTERVAL = 3600  # seconds
 
 
-@cachetools.cached(cachetools.TTLCache(1, _CURR_CACHE_TTL))
 def _fetch_exchange_rates():
-    """ Fetch exchange rate data from apis.is and cache it. """
+    """ Fetch exchange rate data from apis.is. """
     res = query_json_api(_CURR_API_URL)
     if not res or "results" not in res:
         logging.warning(
             "Unable to fetch exchange rate data from {0}".format(_CURR_API_URL)
         )
         return None
-    return {c["shortName"]: c["value"] for c in res["results"]}
+    xr = {c["shortName"]: c["value"] for c in res["results"]}
+    xr["ISK"] = 1.0
+    return xr
+
+
+prefetch.register("currency", _fetch_exchange_rates, _CURR_REFRESH_INTERVAL)
 
 
 def _query_exchange_rate(curr1, curr2):
@@ -458,12 +462,10 @@ def _query_exchange_rate(curr1, curr2):
         return 1
 
     # Get exchange rate data
-    xr = _fetch_exchange_rates()
+    xr = prefetch.get("currency")
     if xr is None:
         return None
 
-    xr["ISK"] = 1.0
-
     # ISK currency index (basket), 'gengisvísitala'
     if curr1 == "GVT" and "GVT" in xr:
         return xr["GVT"]
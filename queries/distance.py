@@ -32,7 +32,7 @@ import re
 import logging
 import math
 
-from reynir.bindb import BIN_Db
+import bincache
 from queries import (
     gen_answer,
     time_period_desc,
@@ -137,24 +137,26 @@ _QTRAVELTIME_REGEXES = (
     r"^({0}) (({1}) ({2}) ({3}))".format(_PREFIX_RX, _VERBS_RX, _PREPS_RX, _DEST_RX),
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_REGEXES = _QDISTANCE_REGEXES + _QTRAVELTIME_REGEXES
+
 
 def _addr2nom(address):
     """ Convert location name to nominative form. """
     # TODO: Implement more intelligently.
     # This is a tad simplistic and mucks up some things,
     # e.g. "Ráðhús Reykjavíkur" becomes "Ráðhús Reykjavík".
-    with BIN_Db.get_db() as db:
-        nf = []
-        for w in address.split():
-            bin_res = db.lookup_nominative(w)
-            if not bin_res and not w.islower():
-                # Try lowercase form
-                bin_res = db.lookup_nominative(w.lower())
-            if bin_res:
-                nf.append(bin_res[0].ordmynd)
-            else:
-                nf.append(w)
-        return " ".join(nf)
+    nf = []
+    for w in address.split():
+        bin_res = bincache.lookup_nominative(w)
+        if not bin_res and not w.islower():
+            # Try lowercase form
+            bin_res = bincache.lookup_nominative(w.lower())
+        if bin_res:
+            nf.append(bin_res[0].ordmynd)
+        else:
+            nf.append(w)
+    return " ".join(nf)
 
 
 def dist_answer_for_loc(matches, query):
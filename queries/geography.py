@@ -34,6 +34,7 @@ from cityloc import capital_for_cc
 
 from queries import country_desc, nom2dat
 from reynir.bindb import BIN_Db
+import bincache
 from geo import (
     icelandic_city_name,
     isocode_for_country_name,
@@ -148,7 +149,7 @@ def QGeoLocationDescQuery(node, params, result):
 
 def QGeoSubject(node, params, result):
     n = capitalize_placename(result._text)
-    bin_res = BIN_Db().lookup_nominative(n)
+    bin_res = bincache.lookup_nominative(n)
     res = bin_res[0].stofn if bin_res else n
     result.subject = res
 
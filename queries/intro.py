@@ -41,6 +41,9 @@ _MY_NAME_IS_REGEXES = (
     r"^ég ber nafnið (.+)$",
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_REGEXES = _MY_NAME_IS_REGEXES
+
 _RESPONSES = {
     "hk": "Gaman að kynnast þér, {0}. Ég heiti Embla.",
     "kk": "Sæll og blessaður, {0}. Ég heiti Embla.",
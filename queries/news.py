@@ -27,9 +27,9 @@
 # TODO: Fyrirsagnir, og að styðja "Segðu mér meira um X"
 
 import logging
-import cachetools
 import random
 
+import prefetch
 from queries import gen_answer, query_json_api
 
 
@@ -102,20 +102,28 @@ def QNewsQuery(node, params, result):
 
 
 _NEWS_API = "https://ruv.is/json/frettir/hladbord"
-_NEWS_CACHE_TTL = 300  # seconds, ttl = 5 mins
+_NEWS_REFRESH_INTERVAL = 300  # seconds, refreshed every 5 mins
 
 
-@cachetools.cached(cachetools.TTLCache(1, _NEWS_CACHE_TTL))
-def _get_news_data(max_items=8):
+def _fetch_news_data():
     """ Fetch news headline data from RÚV, preprocess it. """
     res = query_json_api(_NEWS_API)
     if not res or "nodes" not in res or not len(res["nodes"]):
         return None
 
-    items = [
+    return [
         {"title": i["node"]["title"], "intro": i["node"]["intro"]} for i in res["nodes"]
     ]
 
+
+prefetch.register("news", _fetch_news_data, _NEWS_REFRESH_INTERVAL)
+
+
+def _get_news_data(max_items=8):
+    """ Return the current news headlines, refreshed in the background """
+    items = prefetch.get("news")
+    if not items:
+        return None
     return items[:max_items]
 
 
@@ -53,6 +53,9 @@ _OPINION_REGEXES = (
     r"ert þú í uppnámi út af (.+)$",
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_REGEXES = _OPINION_REGEXES
+
 
 def handle_plain_text(q):
     """ Handle a plain text query concerning opinion on any subject. """
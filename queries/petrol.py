@@ -27,10 +27,10 @@
 # TODO: Laga krónutölur og fjarlægðartölur f. talgervil
 
 import logging
-import cachetools
 import random
 
-from geo import distance
+import prefetch
+from geo import SpatialIndex
 from queries import (
     query_json_api,
     format_icelandic_float,
@@ -216,12 +216,12 @@ _COMPANY_NAME_FIXES = {"Costco Iceland": "Costco"}
 
 
 _PETROL_API = "https://apis.is/petrol"
-_PETROL_CACHE_TTL = 3600  # seconds, ttl 1 hour
+_PETROL_REFRESH_INTERVAL = 3600  # seconds, refreshed every hour
 
 
-@cachetools.cached(cachetools.TTLCache(1, _PETROL_CACHE_TTL))
-def _get_petrol_station_data():
-    """ Fetch list of petrol stations w. prices from apis.is (Gasvaktin) """
+def _fetch_petrol_station_data():
+    """ Fetch list of petrol stations w. prices from apis.is (Gasvaktin),
+        returning a spatial index of the stations """
     pd = query_json_api(_PETROL_API)
     if not pd or "results" not in pd:
         return None
@@ -231,32 +231,40 @@ def _get_petrol_station_data():
         name = s.get("company", "")
         s["company"] = _COMPANY_NAME_FIXES.get(name, name)
 
-    return pd["results"]
+    return SpatialIndex(
+        pd["results"], location=lambda s: (s["geo"]["lat"], s["geo"]["lon"])
+    )
 
 
-def _stations_with_distance(loc):
-    """ Return list of petrol stations w. added distance data. """
-    pd = _get_petrol_station_data()
-    if not pd:
-        return None
+prefetch.register("petrol", _fetch_petrol_station_data, _PETROL_REFRESH_INTERVAL)
 
-    if loc:
-        # Calculate distance of all stations
-        for s in pd:
-            s["distance"] = distance(loc, (s["geo"]["lat"], s["geo"]["lon"]))
 
-    return pd
+def _petrol_station_index():
+    """ Return the current spatial index of petrol stations,
+        refreshed in the background """
+    return prefetch.get("petrol")
+
+
+def _get_petrol_station_data():
+    """ Return the current list of petrol stations """
+    index = _petrol_station_index()
+    return index.items if index else None
+
+
+def _with_distance(dist_station):
+    """ Return a copy of the shared station data, w. added distance """
+    dist, station = dist_station
+    return dict(station, distance=dist)
 
 
 def _closest_petrol_station(loc):
     """ Find petrol station closest to the given location. """
-    stations = _stations_with_distance(loc)
-    if not stations:
+    index = _petrol_station_index()
+    if not index or not loc:
         return None
 
-    # Sort by distance
-    dist_sorted = sorted(stations, key=lambda s: s["distance"])
-    return dist_sorted[0] if dist_sorted else None
+    closest = index.nearest(loc)
+    return _with_distance(closest[0]) if closest else None
 
 
 def _cheapest_petrol_station():
@@ -274,16 +282,16 @@ _CLOSE_DISTANCE = 5.0  # km
 
 
 def _closest_cheapest_petrol_station(loc):
-    stations = _stations_with_distance(loc)
-    if not stations:
+    index = _petrol_station_index()
+    if not index or not loc:
         return None
 
-    # Filter out all stations that are not close by
-    filtered = filter(lambda x: x["distance"] <= _CLOSE_DISTANCE, stations)
+    # Only consider stations that are close by
+    nearby = index.within(loc, _CLOSE_DISTANCE)
 
     # Sort by price
-    price_sorted = sorted(filtered, key=lambda s: s["bensin95"])
-    return price_sorted[0] if price_sorted else None
+    price_sorted = sorted(nearby, key=lambda t: t[1]["bensin95"])
+    return _with_distance(price_sorted[0]) if price_sorted else None
 
 
 _ERRMSG = "Ekki tókst að sækja upplýsingar um bensínstöðvar."
@@ -34,6 +34,7 @@ import re
 import random
 from datetime import datetime, timedelta
 
+import prefetch
 from queries import query_json_api, gen_answer
 
 
@@ -173,25 +174,31 @@ def _clean_desc(d):
 
 _RUV_SCHEDULE_API_ENDPOINT = "https://apis.is/tv/ruv/"
 _API_ERRMSG = "Ekki tókst að sækja sjónvarpsdagskrá."
-_CACHED_SCHEDULE = None
-_LAST_FETCHED = None
+_SCHEDULE_REFRESH_INTERVAL = 24 * 60 * 60  # seconds
+
+
+def _fetch_tv_schedule():
+    """ Fetch current television schedule from API, returning
+        a (date fetched, schedule) tuple. """
+    sched = query_json_api(_RUV_SCHEDULE_API_ENDPOINT)
+    if sched and "results" in sched and len(sched["results"]):
+        return datetime.today().date(), sched["results"]
+    return None
+
+
+# The schedule is fetched again when the date changes
+prefetch.register(
+    "tv_schedule",
+    _fetch_tv_schedule,
+    _SCHEDULE_REFRESH_INTERVAL,
+    is_current=lambda fetched: fetched[0] == datetime.today().date(),
+)
 
 
 def _query_tv_schedule_api():
-    """ Fetch current television schedule from API, or return cached copy. """
-    global _CACHED_SCHEDULE
-    global _LAST_FETCHED
-    if (
-        not _CACHED_SCHEDULE
-        or not _LAST_FETCHED
-        or _LAST_FETCHED.date() != datetime.today().date()
-    ):
-        _CACHED_SCHEDULE = None
-        sched = query_json_api(_RUV_SCHEDULE_API_ENDPOINT)
-        if sched and "results" in sched and len(sched["results"]):
-            _LAST_FETCHED = datetime.utcnow()
-            _CACHED_SCHEDULE = sched["results"]
-    return _CACHED_SCHEDULE
+    """ Return the current television schedule, refreshed in the background. """
+    fetched = prefetch.get("tv_schedule")
+    return None if fetched is None else fetched[1]
 
 
 def _span(p):
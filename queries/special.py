@@ -1785,6 +1785,9 @@ _SPECIAL_QUERIES = {
 
 }
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_PHRASES = frozenset(_SPECIAL_QUERIES.keys())
+
 
 def handle_plain_text(q):
     """ Handle a plain text query, contained in the q parameter
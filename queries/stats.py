@@ -356,6 +356,9 @@ _Q2HANDLER = {
     _MOST_MENTIONED_PEOPLE_QUERIES: _gen_most_mentioned_answer,
 }
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_PHRASES = frozenset().union(*_Q2HANDLER.keys())
+
 
 def handle_plain_text(q):
     """ Handle a plain text query about query statistics. """
@@ -145,6 +145,9 @@ _PHONECALL_REGEXES = frozenset(
         r"(vinsamlegast hringdu í síma )([\d|\-|\s]+)$",    )
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_REGEXES = _PHONECALL_REGEXES
+
 
 def handle_plain_text(q):
     """ Handle a plain text query requesting a call to a telephone number. """
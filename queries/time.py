@@ -35,7 +35,7 @@ import random
 from datetime import datetime
 from pytz import country_timezones, timezone
 
-from reynir.bindb import BIN_Db
+import bincache
 from geo import isocode_for_country_name, lookup_city_info, capitalize_placename
 from queries import timezone4loc
 
@@ -61,6 +61,10 @@ _TIME_QUERIES = frozenset(
     )
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_PHRASES = _TIME_QUERIES
+PLAIN_TEXT_REGEXES = (r"^hvað er klukkan [áí] ",)
+
 
 # Lemmas of keywords that could indicate that the user is trying to use this module
 TOPIC_LEMMAS = [
@@ -106,7 +110,7 @@ def handle_plain_text(q):
         # Look up nominative
         # This only works for single-word city/country names found
         # in BÍN and could be improved (e.g. fails for "Nýju Jórvík")
-        bin_res = BIN_Db().lookup_nominative(loc)
+        bin_res = bincache.lookup_nominative(loc)
         words = [m.stofn for m in bin_res]
         words.append(loc)  # In case it's not in BÍN (e.g. "New York", "San José")
 
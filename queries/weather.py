@@ -323,9 +323,14 @@ _OWM_API_URL_BYNAME = (
 )
 
 
+# Weather data is refreshed every ten minutes by OpenWeatherMap
+_OWM_CACHE_TTL = 600  # seconds
+
+
 def _query_owm_by_name(city, country_code=None):
     d = query_json_api(
-        _OWM_API_URL_BYNAME.format(city, country_code or "", _get_OWM_API_key())
+        _OWM_API_URL_BYNAME.format(city, country_code or "", _get_OWM_API_key()),
+        ttl=_OWM_CACHE_TTL,
     )
     return _postprocess_owm_data(d)
 
@@ -334,7 +339,9 @@ _OWM_API_URL_BYLOC = "https://api.openweathermap.org/data/2.5/weather?lat={0}&lo
 
 
 def _query_owm_by_coords(lat, lon):
-    d = query_json_api(_OWM_API_URL_BYLOC.format(lat, lon, _get_OWM_API_key()))
+    d = query_json_api(
+        _OWM_API_URL_BYLOC.format(lat, lon, _get_OWM_API_key()), ttl=_OWM_CACHE_TTL
+    )
     return _postprocess_owm_data(d)
 
 
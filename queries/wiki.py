@@ -235,12 +235,13 @@ def _clean_voice_answer(answer):
 
 
 _WIKI_API_URL = "https://is.wikipedia.org/w/api.php?format=json&action=query&prop=extracts&exintro&explaintext&redirects=1&titles={0}"
+_WIKI_CACHE_TTL = 3600  # seconds
 
 
 def _query_wiki_api(subject):
     """ Fetch JSON from Wikipedia API """
     url = _WIKI_API_URL.format(subject)
-    return query_json_api(url)
+    return query_json_api(url, ttl=_WIKI_CACHE_TTL, stale_ttl=_WIKI_CACHE_TTL)
 
 
 def get_wiki_summary(subject_nom):
@@ -38,6 +38,7 @@ from datetime import datetime, timedelta
 
 from queries import gen_answer
 from reynir.bindb import BIN_Db
+import bincache
 
 
 # Spell out how character names are pronounced in Icelandic
@@ -125,6 +126,9 @@ _DECLENSION_RX = (
     r"^hvað eru beygingarmyndir {0} (.+)$".format(_WORDTYPE_RX_GEN),
 )
 
+# The plain text queries handled by this module, for the query router
+PLAIN_TEXT_REGEXES = _SPELLING_RX + _DECLENSION_RX
+
 
 def lookup_best_word(word):
     """ Look up word in BÍN, pick right one acc. to a criterion. """
@@ -133,11 +137,11 @@ def lookup_best_word(word):
         def nouns_only(bin_meaning):
             return bin_meaning.ordfl in ("kk", "kvk", "hk")
 
-        res = list(filter(nouns_only, db.lookup_nominative(word)))
+        res = list(filter(nouns_only, bincache.lookup_nominative(word)))
         if not res:
             # Try with uppercase first char
             capw = word.capitalize()
-            res = list(filter(nouns_only, db.lookup_nominative(capw)))
+            res = list(filter(nouns_only, bincache.lookup_nominative(capw)))
             if not res:
                 return None
 
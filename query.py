@@ -24,31 +24,75 @@
     in the form of parse trees and returns the results requested,
     if the query is valid and understood.
 
+    Before parsing, a query is offered to the handle_plain_text() functions
+    of the query processor modules, via a router. A module can declare the
+    plain text queries it handles in PLAIN_TEXT_PHRASES (exact lowercase
+    query strings, without a trailing question mark) and PLAIN_TEXT_REGEXES
+    (regular expressions that are searched for in the lowercase query).
+    Its handle_plain_text() function is then only called for matching
+    queries. Modules that declare neither are offered every query.
+
+    When a query comes with several alternative interpretations from a
+    speech recognizer, they can optionally be tokenized and parsed
+    concurrently in a thread pool, while being executed in order of
+    priority, within a deadline for voice queries.
+
+    A parsed query is processed by the modules whose grammar fragments
+    contribute the matched alternative of the Query nonterminal, rather
+    than by every module that handles parse trees.
+
+    The query grammar, i.e. Reynir.grammar plus the grammar fragments of the
+    query processor modules, is cached on disk together with its compiled
+    binary form. The cache is keyed by a hash of the grammar text, so that
+    it is only recompiled when the grammar or a fragment changes.
+
 """
 
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import copyreg
+import hashlib
 import importlib
 import logging
+import pickle
 from datetime import datetime, timedelta
 import json
 import re
 import random
+import reynir
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import Lock
+from time import monotonic
 
 from settings import Settings
 
 from db import SessionContext, desc
 from db.models import Query as QueryRow
 
-from tree import Tree
+from tree import Tree, ProcessorDispatch
 from reynir import TOK, tokenize, correct_spaces
 from reynir.fastparser import Fast_Parser, ParseForestDumper, ParseError, ffi
-from reynir.binparser import BIN_Grammar, GrammarError
+from reynir.binparser import BIN_Grammar, BIN_LiteralTerminal, GrammarError
 from reynir.reducer import Reducer
 from reynir.bindb import BIN_Db
 from nertokenizer import recognize_entities
+import bincache
+import answercache
+import querytrace
 from images import get_image_url
 from processor import modules_in_dir
 
+# Under Gunicorn/eventlet, the threading module is monkey-patched, so the
+# threads of a ThreadPoolExecutor are greenlets that run one at a time,
+# and only yield to each other (and to a waiting request) on I/O.
+# Concurrent query parsing is therefore disabled in that setting.
+try:
+    from eventlet import patcher as eventlet_patcher
+except ImportError:
+    eventlet_patcher = None
+
 
 # The grammar root nonterminal for queries; see Reynir.grammar
 _QUERY_ROOT = "QueryRoot"
@@ -91,7 +135,10 @@ class QueryGrammar(BIN_Grammar):
     def is_grammar_modified(cls):
         """ Override inherited function to specify that query grammars
             should always be reparsed, since the set of plug-in query
-            handlers may have changed, as well as their grammar fragments. """
+            handlers may have changed, as well as their grammar fragments.
+            Whether the grammar text actually needs to be read is decided
+            by QueryParser._load_grammar(), which compares a hash of the
+            text with the one of the cached grammar. """
         return True
 
     def read(self, fname, verbose=False, binary_fname=None):
@@ -118,28 +165,48 @@ class QueryGrammar(BIN_Grammar):
                 yield line
 
         try:
-            # Note that if Settings.DEBUG is True, we always write a fresh
-            # binary grammar file, regardless of file timestamps. This helps
-            # in query development, as query grammar fragment strings may change
+            # The grammar text is only read if the cached query grammar
+            # does not match it (see QueryParser._load_grammar()),
+            # so we always write a fresh binary grammar file, regardless
+            # of file timestamps. Query grammar fragment strings may change
             # without any .grammar source file change (which is the default
             # trigger for generating new binary grammar files).
             return self.read_from_generator(
-                fname,
-                grammar_generator(),
-                verbose,
-                binary_fname,
-                force_new_binary=Settings.DEBUG,
+                fname, grammar_generator(), verbose, binary_fname, force_new_binary=True
             )
         except (IOError, OSError):
             raise GrammarError("Unable to open or read grammar file", fname, 0)
 
 
+def _reduce_literal_terminal(t):
+    """ Pickle a BIN_LiteralTerminal by name, since its instances contain
+        lambdas. The constructor recreates the callable attributes. """
+    state = {k: v for k, v in t.__dict__.items() if not callable(v)}
+    return type(t), (t.name,), state
+
+
+copyreg.pickle(BIN_LiteralTerminal, _reduce_literal_terminal)
+
+
+def _file_digest(fname):
+    """ Return the SHA-256 hex digest of a file's contents """
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 class QueryParser(Fast_Parser):
 
     """ A subclass of Fast_Parser, specialized to parse queries """
 
     _GRAMMAR_BINARY_FILE = Fast_Parser._GRAMMAR_FILE + ".query.bin"
 
+    # The parsed query grammar, cached along with the hash of its text
+    # and the hash of the corresponding binary grammar file
+    _GRAMMAR_CACHE_FILE = Fast_Parser._GRAMMAR_FILE + ".query.pickle"
+
     # Keep a separate grammar class instance and time stamp for
     # QueryParser. This Python sleight-of-hand overrides
     # class attributes that are defined in BIN_Parser, see binparser.py.
@@ -164,6 +231,152 @@ class QueryParser(Fast_Parser):
     def grammar_additions(cls):
         return cls._grammar_additions
 
+    @classmethod
+    def grammar_digest(cls):
+        """ Return a hash of the complete query grammar text,
+            as well as the versions of the parser and of reynir """
+        h = hashlib.sha256()
+        for s in (reynir.__version__, cls._VERSION, _GRAMMAR_PREAMBLE):
+            h.update(s.encode("utf-8"))
+        h.update(_file_digest(cls._GRAMMAR_FILE).encode("ascii"))
+        h.update(cls._grammar_additions.encode("utf-8"))
+        return h.hexdigest()
+
+    @classmethod
+    def _load_cached_grammar(cls, digest):
+        """ Return the cached query grammar if it matches the given digest and
+            the binary grammar file is the one written along with it, or None """
+        try:
+            with open(cls._GRAMMAR_CACHE_FILE, "rb") as f:
+                cache = pickle.load(f)
+            if cache["digest"] != digest:
+                return None
+            if cache["binary_digest"] != _file_digest(cls._GRAMMAR_BINARY_FILE):
+                return None
+            return cache["grammar"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Unable to load cached query grammar: {0}".format(e))
+            return None
+
+    @classmethod
+    def _save_cached_grammar(cls, digest, grammar):
+        """ Write the query grammar to the cache file, together
+            with its digest and the digest of the binary grammar file """
+        cache = dict(
+            digest=digest,
+            binary_digest=_file_digest(cls._GRAMMAR_BINARY_FILE),
+            grammar=grammar,
+        )
+        tmp_fname = "{0}.{1}.tmp".format(cls._GRAMMAR_CACHE_FILE, os.getpid())
+        try:
+            with open(tmp_fname, "wb") as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fname, cls._GRAMMAR_CACHE_FILE)
+        except Exception as e:
+            logging.warning("Unable to cache query grammar: {0}".format(e))
+
+    @classmethod
+    def _load_grammar(cls, verbose, ts):
+        """ Load the query grammar from the cache if it is up to date,
+            otherwise read it from its text and cache it. This is called
+            while holding the global grammar lock, see Fast_Parser. """
+        digest = cls.grammar_digest()
+        g = cls._load_cached_grammar(digest)
+        if g is None:
+            g = super()._load_grammar(verbose, ts)
+            cls._save_cached_grammar(digest, g)
+            return g
+        if ts is None:
+            ts = os.path.getmtime(cls._GRAMMAR_FILE)
+        cls._grammar = g
+        cls._grammar_ts = ts
+        return g
+
+
+# Matches quoted terminals in grammar productions
+_QUOTED_TERMINAL_RE = re.compile(r"'[^']*'|\"[^\"]*\"")
+# Matches nonterminal names, possibly with variants, in grammar productions
+_NONTERMINAL_RE = re.compile(r"[^\W\d_][\w]*")
+
+
+def query_alternatives(fragment):
+    """ Return the base names of the nonterminals that a query grammar
+        fragment adds as alternatives to the Query nonterminal """
+    names = set()
+    in_query = False
+    for line in fragment.split("\n"):
+        # Remove comments
+        line = line.split("#", 1)[0].rstrip()
+        if not line:
+            continue
+        if not line[0].isspace() and not line.startswith("|"):
+            # A new production or a pragma, such as $score()
+            lhs, arrow, line = line.partition("→")
+            in_query = bool(arrow) and lhs.strip() == "Query"
+        if in_query:
+            line = _QUOTED_TERMINAL_RE.sub("", line)
+            for name in _NONTERMINAL_RE.findall(line):
+                if name[0].isupper():
+                    # Cut off variants, as NonterminalNode does for nt_base
+                    names.add(name.split("_")[0])
+    return names
+
+
+class PlainTextRouter:
+
+    """ Routes plain text queries to the handle_plain_text() functions of
+        the query processor modules that declare them as handled. The
+        declared phrases are collected into a single dict, and the declared
+        regexes are compiled into a single alternation, so that a query
+        that no module handles is rejected by one dict lookup and one regex
+        search. """
+
+    def __init__(self, processors):
+        # The handle_plain_text() functions, in module order
+        self._handlers = []
+        # Indices of handlers that are called for every query
+        self._always = []
+        # Map of phrase to the indices of the handlers that declare it
+        self._phrases = defaultdict(list)  # type: Dict[str, List[int]]
+        # Handler indices with the compiled alternation of their regexes
+        self._regexes = []  # type: List[Tuple[int, Any]]
+        alternatives = []
+        for processor in processors:
+            handle_plain_text = getattr(processor, "handle_plain_text", None)
+            if handle_plain_text is None:
+                continue
+            ix = len(self._handlers)
+            self._handlers.append(handle_plain_text)
+            phrases = getattr(processor, "PLAIN_TEXT_PHRASES", None)
+            regexes = getattr(processor, "PLAIN_TEXT_REGEXES", None)
+            if not phrases and not regexes:
+                self._always.append(ix)
+                continue
+            for phrase in phrases or ():
+                self._phrases[phrase].append(ix)
+            if regexes:
+                rx = "|".join("(?:{0})".format(r) for r in regexes)
+                self._regexes.append((ix, re.compile(rx)))
+                alternatives.append(rx)
+        # The combined regex, used to find out whether any module's
+        # regexes match before checking them module by module
+        self._combined = (
+            re.compile("|".join("(?:{0})".format(rx) for rx in alternatives))
+            if alternatives
+            else None
+        )
+
+    def route(self, ql):
+        """ Return the handle_plain_text() functions that should be offered
+            the given lowercase query, in module order """
+        ixs = set(self._always)
+        ixs.update(self._phrases.get(ql, ()))
+        if self._combined is not None and self._combined.search(ql):
+            ixs.update(ix for ix, rx in self._regexes if rx.search(ql))
+        return [self._handlers[ix] for ix in sorted(ixs)]
+
 
 _IGNORED_QUERY_PREFIXES = ("embla", "hæ embla", "hey embla", "sæl embla")
 _IGNORED_PREFIX_RE = r"^({0})\s*".format("|".join(_IGNORED_QUERY_PREFIXES))
@@ -178,6 +391,9 @@ class Query:
 
     _parser = None
     _processors = []
+    _tree_processors = []
+    _tree_routes = dict()
+    _router = None
     _help_texts = dict()
 
     def __init__(self, session, query, voice, auto_uppercase, location, client_id):
@@ -217,6 +433,9 @@ class Query:
         # Query context, which is None until fetched via self.fetch_context()
         # This should be a dict that can be represented in JSON
         self._context = None
+        # Background parsing of the query, if started via parse_in_background()
+        self._parse_future = None
+        self._parse_deadline = None
 
     def _preprocess_query_string(self, q):
         """ Preprocess the query string prior to further analysis """
@@ -239,27 +458,43 @@ class Query:
             try:
                 m = importlib.import_module(modname)
                 procs.append(m)
+                # Compile the module's dispatch table for tree processing
+                ProcessorDispatch.get(m)
             except ImportError as e:
                 logging.error(
                     "Error importing query processor module {0}: {1}".format(modname, e)
                 )
         cls._processors = procs
+        cls._router = PlainTextRouter(procs)
 
         # Obtain query grammar fragments from those processors
         # that handle parse trees. Also collect topic lemmas that
         # can be used to provide context-sensitive help texts
         # when queries cannot be parsed.
+        # Also map the alternatives that each fragment adds to the
+        # Query nonterminal to the processor that owns them.
         grammar_fragments = []
         help_texts = defaultdict(list)
+        tree_processors = []
+        tree_routes = defaultdict(list)
         for processor in procs:
             handle_tree = getattr(processor, "HANDLE_TREE", None)
             if handle_tree:
+                tree_processors.append(processor)
+                alternatives = set()
                 # Check whether this processor supplies
                 # a query grammar fragment
                 fragment = getattr(processor, "GRAMMAR", None)
                 if fragment and isinstance(fragment, str):
                     # Looks legit: add it to our list
                     grammar_fragments.append(fragment)
+                    alternatives = query_alternatives(fragment)
+                if not alternatives:
+                    # This processor doesn't add to the Query nonterminal:
+                    # it gets to process every parse tree
+                    alternatives = {None}
+                for nt_base in alternatives:
+                    tree_routes[nt_base].append(processor)
             # Collect topic lemmas and corresponding help text functions
             topic_lemmas = getattr(processor, "TOPIC_LEMMAS", None)
             if topic_lemmas:
@@ -271,6 +506,8 @@ class Query:
                     for lemma in topic_lemmas:
                         help_texts[lemma].append(help_text_func)
         cls._help_texts = help_texts
+        cls._tree_processors = tree_processors
+        cls._tree_routes = tree_routes
 
         # Coalesce the grammar additions from the fragments
         grammar_additions = "\n".join(grammar_fragments)
@@ -300,18 +537,20 @@ class Query:
                 num = 0
                 try:
                     # Parse the sentence
-                    forest = bp.go(sent)
+                    with querytrace.span("parse"):
+                        forest = bp.go(sent)
                     if forest is not None:
                         num = Fast_Parser.num_combinations(forest)
                         if num > 1:
                             # Reduce the resulting forest
-                            forest = rdc.go(forest)
+                            with querytrace.span("reduce"):
+                                forest = rdc.go(forest)
                 except ParseError:
                     forest = None
                 if num > 0:
                     num_parsed_sent += 1
-                    # Obtain a text representation of the parse tree
-                    trees[num_sent] = ParseForestDumper.dump_forest(forest)
+                    # Keep the (unambiguous) forest, to be loaded as a tree
+                    trees[num_sent] = forest
 
             elif t[0] == TOK.P_BEGIN:
                 pass
@@ -323,6 +562,42 @@ class Query:
         result = dict(num_sent=num_sent, num_parsed_sent=num_parsed_sent)
         return result, trees
 
+    def _tokenize_and_parse(self):
+        """ Tokenize and parse the query string, returning a tuple of
+            the token list, the query string as seen by the parser,
+            the parse result and the parse forests. This does not modify
+            the query object, so it can be called in a worker thread. """
+        q = self._query.strip()
+        with querytrace.span("tokenize"):
+            toklist = tokenize(q, auto_uppercase=self._auto_uppercase and q.islower())
+            toklist = list(toklist)
+        # The following seems not to be needed and may complicate things
+        # toklist = list(recognize_entities(toklist, enclosing_session=self._session))
+
+        actual_q = correct_spaces(" ".join(t.txt for t in toklist if t.txt))
+        if actual_q:
+            actual_q = actual_q[0].upper() + actual_q[1:]
+            if not any(actual_q.endswith(s) for s in ("?", ".", "!")):
+                actual_q += "?"
+
+        parse_result, trees = Query._parse(toklist)
+        return toklist, actual_q, parse_result, trees
+
+    def parse_in_background(self, executor, deadline=None):
+        """ Start tokenizing and parsing the query in a thread of the given
+            executor. A subsequent call to parse() waits for the outcome,
+            until the given deadline (a time.monotonic() value), if any. """
+        if self._query.strip():
+            self._parse_future = executor.submit(
+                querytrace.bind(self._tokenize_and_parse)
+            )
+            self._parse_deadline = deadline
+
+    def cancel_parse(self):
+        """ Cancel parsing in the background, if it has not started yet """
+        if self._parse_future is not None:
+            self._parse_future.cancel()
+
     def parse(self, result):
         """ Parse the query from its string, returning True if valid """
         self._tree = None  # Erase previous tree, if any
@@ -336,16 +611,21 @@ class Query:
             self.set_error("E_EMPTY_QUERY")
             return False
 
-        toklist = tokenize(q, auto_uppercase=self._auto_uppercase and q.islower())
-        toklist = list(toklist)
-        # The following seems not to be needed and may complicate things
-        # toklist = list(recognize_entities(toklist, enclosing_session=self._session))
-
-        actual_q = correct_spaces(" ".join(t.txt for t in toklist if t.txt))
-        if actual_q:
-            actual_q = actual_q[0].upper() + actual_q[1:]
-            if not any(actual_q.endswith(s) for s in ("?", ".", "!")):
-                actual_q += "?"
+        if self._parse_future is not None:
+            # The query is being parsed in the background: wait for it
+            timeout = None
+            if self._parse_deadline is not None:
+                timeout = max(0.0, self._parse_deadline - monotonic())
+            try:
+                toklist, actual_q, parse_result, trees = self._parse_future.result(
+                    timeout
+                )
+            except FutureTimeoutError:
+                self._parse_future.cancel()
+                self.set_error("E_PARSE_TIMEOUT")
+                return False
+        else:
+            toklist, actual_q, parse_result, trees = self._tokenize_and_parse()
 
         # Update the beautified query string, as the actual_q string
         # probably has more correct capitalization
@@ -355,8 +635,6 @@ class Query:
             # Log the query string as seen by the parser
             print("Query is: '{0}'".format(actual_q))
 
-        parse_result, trees = Query._parse(toklist)
-
         if not trees:
             # No parse at all
             self.set_error("E_NO_PARSE_TREES")
@@ -378,11 +656,11 @@ class Query:
             return False
         # Looks good
         # Store the resulting parsed query as a tree
-        tree_string = "S1\n" + trees[1]
         if Settings.DEBUG:
-            print(tree_string)
-        self._tree = Tree()
-        self._tree.load(tree_string)
+            print("S1\n" + ParseForestDumper.dump_forest(trees[1]))
+        with querytrace.span("tree_load"):
+            self._tree = Tree()
+            self._tree.load_forest(1, trees[1])
         # Store the token list
         self._toklist = toklist
         return True
@@ -391,14 +669,15 @@ class Query:
         """ Attempt to execute a plain text query, without having to parse it """
         if not self._query:
             return False
-        for processor in self._processors:
-            handle_plain_text = getattr(processor, "handle_plain_text", None)
-            if handle_plain_text is not None:
-                # This processor has a handle_plain_text function:
-                # call it
-                if handle_plain_text(self):
-                    # Successfully handled: we're done
-                    return True
+        ql = self.query_lower.rstrip("?")
+        for handle_plain_text in self._router.route(ql):
+            # This processor declares that it handles the query:
+            # call its handle_plain_text function
+            with querytrace.span("process:" + handle_plain_text.__module__):
+                handled = handle_plain_text(self)
+            if handled:
+                # Successfully handled: we're done
+                return True
         return False
 
     def execute_from_tree(self):
@@ -407,21 +686,38 @@ class Query:
         if self._tree is None:
             self.set_error("E_QUERY_NOT_PARSED")
             return False
-        for processor in self._processors:
+        for processor in self.tree_processors():
             self._error = None
             self._qtype = None
-            # If a processor defines HANDLE_TREE and sets it to
-            # a truthy value, it wants to handle parse trees
-            handle_tree = getattr(processor, "HANDLE_TREE", None)
-            if handle_tree:
-                # Process the tree, which has only one sentence
+            # Process the tree, which has only one sentence
+            with querytrace.span("process:" + processor.__name__):
                 self._tree.process(self._session, processor, query=self)
-                if self._answer and self._error is None:
-                    # The processor successfully answered the query
-                    return True
+            if self._answer and self._error is None:
+                # The processor successfully answered the query
+                return True
         # No processor was able to answer the query
         return False
 
+    def tree_processors(self):
+        """ Return the query processors that should process the parse tree,
+            i.e. the ones whose grammar fragments contribute the matched
+            alternative of the Query nonterminal. If the owner cannot be
+            determined, all processors that handle parse trees are returned. """
+        owners = set(self._tree_routes.get(None, ()))
+        root = self._tree[1] if 1 in self._tree else None
+        # The tree is QueryRoot → Query → <alternative>
+        query = root.child if root is not None else None
+        if query is not None and getattr(query, "nt_base", None) == "Query":
+            child = query.child
+            while child is not None:
+                owners.update(self._tree_routes.get(getattr(child, "nt_base", None), ()))
+                child = child.nxt
+        if len(owners) == len(self._tree_routes.get(None, ())):
+            # No alternative of the Query nonterminal was recognized
+            return self._tree_processors
+        # Return the owners in the usual module order
+        return [p for p in self._tree_processors if p in owners]
+
     def last_answer(self, *, within_minutes=5):
         """ Return the last answer given to this client, by default
             within the last 5 minutes (0=forever) """
@@ -600,15 +896,14 @@ class Query:
             based on lemmas in the query string """
         # Collect a set of lemmas that occur in the query string
         lemmas = set()
-        with BIN_Db.get_db() as db:
-            for token in query.lower().split():
-                if token.isalpha():
-                    m = db.meanings(token)
-                    if not m:
-                        # Try an uppercase version, just in case (pun intended)
-                        m = db.meanings(token.capitalize())
-                    if m:
-                        lemmas |= set(mm.stofn.lower() for mm in m)
+        for token in query.lower().split():
+            if token.isalpha():
+                m = bincache.meanings(token)
+                if not m:
+                    # Try an uppercase version, just in case (pun intended)
+                    m = bincache.meanings(token.capitalize())
+                if m:
+                    lemmas |= set(mm.stofn.lower() for mm in m)
         # Collect a list of potential help text functions from the query modules
         help_text_funcs = []
         for lemma in lemmas:
@@ -751,7 +1046,7 @@ def to_accusative(np, *, meaning_filter_func=None):
     with BIN_Db.get_db() as db:
         return _to_case(
             np,
-            db.lookup_word,
+            bincache.lookup_word,
             db.cast_to_accusative,
             meaning_filter_func=meaning_filter_func,
         )
@@ -762,13 +1057,78 @@ def to_dative(np, *, meaning_filter_func=None):
     with BIN_Db.get_db() as db:
         return _to_case(
             np,
-            db.lookup_word,
+            bincache.lookup_word,
             db.cast_to_dative,
             meaning_filter_func=meaning_filter_func,
         )
 
 
-def process_query(
+# Thread pool for parsing alternative query interpretations concurrently,
+# created on first use
+_parse_executor = None
+_parse_executor_lock = Lock()
+_parse_threads_disabled = False
+
+
+def _using_green_threads():
+    """ Return True if the threading module has been monkey-patched by
+        eventlet, as in a Gunicorn eventlet worker """
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched(
+        "thread"
+    )
+
+
+def parse_executor():
+    """ Return the thread pool used for parsing query interpretations
+        concurrently, or None if concurrent parsing is not enabled
+        or not possible (under eventlet) """
+    global _parse_executor, _parse_threads_disabled
+    if Settings.QUERY_PARSE_THREADS < 2 or _parse_threads_disabled:
+        return None
+    if _parse_executor is None:
+        with _parse_executor_lock:
+            if _parse_threads_disabled:
+                return None
+            if _parse_executor is None:
+                if _using_green_threads():
+                    logging.warning(
+                        "query_parse_threads is ignored under eventlet; "
+                        "queries are parsed one at a time"
+                    )
+                    _parse_threads_disabled = True
+                    return None
+                _parse_executor = ThreadPoolExecutor(
+                    max_workers=Settings.QUERY_PARSE_THREADS
+                )
+    return _parse_executor
+
+
+def process_query(q, voice, **options):
+    """ Process an incoming natural language query.
+        If voice is True, return a voice-friendly string to
+        be spoken to the user. If auto_uppercase is True,
+        the string probably came from voice input and we
+        need to intelligently guess which words in the query
+        should be upper case (to the extent that it matters).
+        The q parameter can either be a single query string
+        or an iterable of strings that will be processed in
+        order until a successful one is found. If concurrent
+        parsing is enabled, all strings are tokenized and parsed
+        in parallel in advance, but still executed in order.
+        The processing is traced (see querytrace.py), and in
+        debug mode, the trace is returned in the result. """
+    trace = querytrace.begin()
+    result = None
+    try:
+        result = _process_query(q, voice, **options)
+    finally:
+        querytrace.end(trace, result.get("qtype") if result else None)
+    if Settings.DEBUG:
+        result["timing"] = trace.to_dict()
+    return result
+
+
+def _process_query(
     q,
     voice,
     *,
@@ -781,15 +1141,8 @@ def process_query(
     bypass_cache=False,
     private=False
 ):
-    """ Process an incoming natural language query.
-        If voice is True, return a voice-friendly string to
-        be spoken to the user. If auto_uppercase is True,
-        the string probably came from voice input and we
-        need to intelligently guess which words in the query
-        should be upper case (to the extent that it matters).
-        The q parameter can either be a single query string
-        or an iterable of strings that will be processed in
-        order until a successful one is found. """
+    """ Process an incoming natural language query, as described
+        for process_query(), within the active trace """
 
     now = datetime.utcnow()
     result = None
@@ -807,124 +1160,168 @@ def process_query(
             # in decreasing priority order
             it = q
 
+        # If there are several query strings, start tokenizing and
+        # parsing them all in parallel, if enabled. Voice queries
+        # are subject to a deadline for the parsing.
+        queries = []
+        executor = parse_executor() if len(it) > 1 else None
+        if executor is not None:
+            if Query._parser is None:
+                Query.init_class()
+            deadline = None
+            if voice:
+                deadline = monotonic() + Settings.QUERY_PARSE_DEADLINE
+            for qtext in it:
+                query = Query(
+                    session, qtext.strip(), voice, auto_uppercase, location, client_id
+                )
+                query.parse_in_background(executor, deadline)
+                queries.append(query)
+
         # Iterate through the submitted query strings,
         # assuming that they are in decreasing order of probability,
         # attempting to execute them in turn until we find
         # one that works (or we're stumped)
 
-        for qtext in it:
-
-            qtext = qtext.strip()
-            clean_q = qtext.rstrip("?")
-            if first_clean_q is None:
-                # Store the first (most likely) query string
-                # that comes in from the speech-to-text processor,
-                # since we want to return that one to the client
-                # if no query string is matched - not the last
-                # (least likely) query string
-                first_clean_q = clean_q
-                first_qtext = qtext
-            # First, look in the query cache for the same question
-            # (in lower case), having a not-expired answer
-            cached_answer = None
-            if voice and not bypass_cache:
-                # Only use the cache for voice queries
-                # (handling detailed responses in other queries
-                # is too much for the cache)
-                cached_answer = (
-                    session.query(QueryRow)
-                    .filter(QueryRow.question_lc == clean_q.lower())
-                    .filter(QueryRow.expires >= now)
-                    .order_by(desc(QueryRow.expires))
-                    .limit(1)
-                    .one_or_none()
-                )
-            if cached_answer is not None:
-                # The same question is found in the cache and has not expired:
-                # return the previous answer
-                a = cached_answer
-                result = dict(
-                    valid=True,
-                    q_raw=qtext,
-                    q=a.bquestion,
-                    answer=a.answer,
-                    response=dict(answer=a.answer or ""),
-                    voice=a.voice,
-                    expires=a.expires,
-                    qtype=a.qtype,
-                    key=a.key,
-                )
-                # !!! TBD: Log the cached answer as well?
-                return result
-            query = Query(session, qtext, voice, auto_uppercase, location, client_id)
-            result = query.execute()
-            if result["valid"] and "error" not in result:
-                # Successful: our job is done
-                if not private:
-                    # If not in private mode, log the result
-                    try:
-                        qrow = QueryRow(
-                            timestamp=now,
-                            interpretations=it,
-                            question=clean_q,
-                            # bquestion is the beautified query string
-                            bquestion=result["q"],
-                            answer=result["answer"],
-                            voice=result.get("voice"),
-                            # Only put an expiration on voice queries
-                            expires=query.expires if voice else None,
-                            qtype=result.get("qtype"),
-                            key=result.get("key"),
-                            latitude=location[0] if location else None,
-                            longitude=location[1] if location else None,
-                            # Client identifier
-                            client_id=client_id,
-                            client_type=client_type or None,
-                            client_version=client_version or None,
-                            # IP address
-                            remote_addr=remote_addr or None,
-                            # Context dict, stored as JSON, if present
-                            # (set during query execution)
-                            context=query.context,
-                            # All other fields are set to NULL
+        try:
+            for ix, qtext in enumerate(it):
+
+                qtext = qtext.strip()
+                clean_q = qtext.rstrip("?")
+                if first_clean_q is None:
+                    # Store the first (most likely) query string
+                    # that comes in from the speech-to-text processor,
+                    # since we want to return that one to the client
+                    # if no query string is matched - not the last
+                    # (least likely) query string
+                    first_clean_q = clean_q
+                    first_qtext = qtext
+                # First, look in the in-memory answer cache for the same
+                # question (in lower case), having a not-expired answer
+                cache_key = answercache.cache_key(clean_q, voice, location)
+                cached_answer = None
+                with querytrace.span("cache"):
+                    if not bypass_cache:
+                        cached_answer = answercache.get(cache_key)
+                    if cached_answer is None and voice and not bypass_cache:
+                        # Then look in the queries table in the database.
+                        # Only voice queries can be answered from there
+                        # (handling detailed responses in other queries
+                        # is too much for the database cache)
+                        a = (
+                            session.query(QueryRow)
+                            .filter(QueryRow.question_lc == clean_q.lower())
+                            .filter(QueryRow.expires >= now)
+                            .order_by(desc(QueryRow.expires))
+                            .limit(1)
+                            .one_or_none()
                         )
-                        session.add(qrow)
-                    except Exception as e:
-                        logging.error("Error logging query: {0}".format(e))
-                return result
+                        answercache.db_lookup(a is not None)
+                        if a is not None:
+                            cached_answer = dict(
+                                valid=True,
+                                q=a.bquestion,
+                                answer=a.answer,
+                                response=dict(answer=a.answer or ""),
+                                voice=a.voice,
+                                expires=a.expires,
+                                qtype=a.qtype,
+                                key=a.key,
+                            )
+                            answercache.put(cache_key, cached_answer, a.expires)
+                if cached_answer is not None:
+                    # The same question is found in the cache and has not expired:
+                    # return the previous answer
+                    cached_answer["q_raw"] = qtext
+                    # !!! TBD: Log the cached answer as well?
+                    return cached_answer
+                if queries:
+                    # This query is already being parsed in the background
+                    query = queries[ix]
+                else:
+                    query = Query(
+                        session, qtext, voice, auto_uppercase, location, client_id
+                    )
+                result = query.execute()
+                if result["valid"] and "error" not in result:
+                    # Successful: our job is done
+                    if query.expires and not bypass_cache:
+                        # The answer can be cached until it expires
+                        answercache.put(cache_key, result, query.expires)
+                    if not private:
+                        # If not in private mode, log the result
+                        try:
+                            qrow = QueryRow(
+                                timestamp=now,
+                                interpretations=it,
+                                question=clean_q,
+                                # bquestion is the beautified query string
+                                bquestion=result["q"],
+                                answer=result["answer"],
+                                voice=result.get("voice"),
+                                # Only put an expiration on voice queries
+                                expires=query.expires if voice else None,
+                                qtype=result.get("qtype"),
+                                key=result.get("key"),
+                                latitude=location[0] if location else None,
+                                longitude=location[1] if location else None,
+                                # Client identifier
+                                client_id=client_id,
+                                client_type=client_type or None,
+                                client_version=client_version or None,
+                                # IP address
+                                remote_addr=remote_addr or None,
+                                # Context dict, stored as JSON, if present
+                                # (set during query execution)
+                                context=query.context,
+                                # All other fields are set to NULL
+                            )
+                            with querytrace.span("query_log"):
+                                session.add(qrow)
+                                session.flush()
+                        except Exception as e:
+                            logging.error("Error logging query: {0}".format(e))
+                    return result
+
+            # Failed to answer the query, i.e. no query processor
+            # module was able to parse the query and provide an answer
+            result = result or dict(valid=False, error="E_NO_RESULT")
+            if first_clean_q:
+                # Re-insert the query data from the first (most likely)
+                # string returned from the speech-to-text processor,
+                # replacing residual data that otherwise would be there
+                # from the last (least likely) query string
+                result["q_raw"] = first_qtext
+                result["q"] = beautify_query(first_qtext)
+                # Attempt to include a helpful response in the result
+                Query.try_to_help(first_clean_q, result)
+
+                # Log the failure
+                qrow = QueryRow(
+                    timestamp=now,
+                    interpretations=it,
+                    question=first_clean_q,
+                    bquestion=result["q"],
+                    answer=result.get("answer"),
+                    voice=result.get("voice"),
+                    error=result.get("error"),
+                    latitude=location[0] if location else None,
+                    longitude=location[1] if location else None,
+                    # Client identifier
+                    client_id=client_id,
+                    client_type=client_type or None,
+                    client_version=client_version or None,
+                    # IP address
+                    remote_addr=remote_addr or None
+                    # All other fields are set to NULL
+                )
+                with querytrace.span("query_log"):
+                    session.add(qrow)
+                    session.flush()
 
-        # Failed to answer the query, i.e. no query processor
-        # module was able to parse the query and provide an answer
-        result = result or dict(valid=False, error="E_NO_RESULT")
-        if first_clean_q:
-            # Re-insert the query data from the first (most likely)
-            # string returned from the speech-to-text processor,
-            # replacing residual data that otherwise would be there
-            # from the last (least likely) query string
-            result["q_raw"] = first_qtext
-            result["q"] = beautify_query(first_qtext)
-            # Attempt to include a helpful response in the result
-            Query.try_to_help(first_clean_q, result)
-
-            # Log the failure
-            qrow = QueryRow(
-                timestamp=now,
-                interpretations=it,
-                question=first_clean_q,
-                bquestion=result["q"],
-                answer=result.get("answer"),
-                voice=result.get("voice"),
-                error=result.get("error"),
-                latitude=location[0] if location else None,
-                longitude=location[1] if location else None,
-                # Client identifier
-                client_id=client_id,
-                client_type=client_type or None,
-                client_version=client_version or None,
-                # IP address
-                remote_addr=remote_addr or None
-                # All other fields are set to NULL
-            )
-            session.add(qrow)
+            return result
 
-        return result
+        finally:
+            # Don't start parsing any remaining query strings
+            for query in queries:
+                query.cancel_parse()
@@ -0,0 +1,226 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Query tracing module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module records where the time goes while a query is processed.
+
+    process_query() starts a trace for each query. While the trace is
+    active in a thread, the stages of the query pipeline (cache lookup,
+    tokenization, parsing, reduction, tree construction, each query
+    processor that is attempted, external API calls and logging of the
+    query) record named spans in it, using the span() context manager.
+    Outside of a trace, span() does nothing. A trace can be carried over
+    to worker threads, such as the ones that parse query interpretations
+    concurrently, with bind().
+
+    When a query is done, its trace is added to per-process statistics,
+    which keep a latency histogram for the whole query and for each span
+    name, by query type.
+
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import threading
+
+from contextlib import contextmanager
+from time import perf_counter
+
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Name of the span that covers the whole query
+_TOTAL = "(total)"
+
+# Query type of queries that were not answered
+_NO_QTYPE = "(none)"
+
+
+class Trace:
+
+    """ The spans recorded while processing a single query """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.end = None  # type: Optional[float]
+        # List of (name, start, end) tuples, in seconds from perf_counter()
+        self.spans = []  # type: List[Tuple[str, float, float]]
+
+    def add(self, name, t0, t1):
+        # list.append() is atomic, so spans may be added from several threads
+        self.spans.append((name, t0, t1))
+
+    def finish(self):
+        self.end = perf_counter()
+
+    @property
+    def total(self):
+        """ Elapsed time of the trace, in seconds """
+        return (self.end or perf_counter()) - self.start
+
+    def to_dict(self):
+        """ Return the trace as a dict, with times in milliseconds
+            from the start of the trace """
+        start = self.start
+        return dict(
+            total_ms=round(1000.0 * self.total, 3),
+            spans=[
+                dict(
+                    name=name,
+                    start_ms=round(1000.0 * (t0 - start), 3),
+                    ms=round(1000.0 * (t1 - t0), 3),
+                )
+                for name, t0, t1 in sorted(self.spans, key=lambda s: s[1])
+            ],
+        )
+
+
+class Histogram:
+
+    """ A latency histogram with fixed buckets """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(_BUCKETS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for ix, bound in enumerate(_BUCKETS):
+            if ms <= bound:
+                self.buckets[ix] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = ["<={0}".format(b) for b in _BUCKETS] + [">{0}".format(_BUCKETS[-1])]
+        return dict(
+            count=self.count,
+            mean_ms=self.total_ms / self.count if self.count else 0.0,
+            max_ms=self.max_ms,
+            histogram={
+                label: n for label, n in zip(labels, self.buckets) if n
+            },
+        )
+
+
+class TraceStats:
+
+    """ Latency histograms by query type and span name """
+
+    def __init__(self):
+        # Map of query type to a map of span name to histogram
+        self._stats = dict()  # type: Dict[str, Dict[str, Histogram]]
+        self._lock = threading.Lock()
+
+    def add(self, qtype, trace):
+        """ Add a finished trace of a query of the given type """
+        # Sum up the spans of each name, since a span may occur more than
+        # once in a trace (e.g. when several interpretations are parsed)
+        ms = dict()  # type: Dict[str, float]
+        for name, t0, t1 in trace.spans:
+            ms[name] = ms.get(name, 0.0) + 1000.0 * (t1 - t0)
+        ms[_TOTAL] = 1000.0 * trace.total
+        with self._lock:
+            hists = self._stats.setdefault(qtype or _NO_QTYPE, dict())
+            for name, val in ms.items():
+                hist = hists.get(name)
+                if hist is None:
+                    hist = hists[name] = Histogram()
+                hist.add(val)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                qtype: {name: hist.to_dict() for name, hist in sorted(hists.items())}
+                for qtype, hists in self._stats.items()
+            }
+
+
+# The trace that is active in each thread, if any
+_local = threading.local()
+
+# The per-process statistics
+_stats = TraceStats()
+
+
+def current():
+    """ Return the trace that is active in this thread, or None """
+    return getattr(_local, "trace", None)
+
+
+def begin():
+    """ Start a new trace and make it active in this thread """
+    trace = Trace()
+    _local.trace = trace
+    return trace
+
+
+def end(trace, qtype=None):
+    """ Finish a trace, deactivate it and add it to the statistics
+        under the given query type """
+    trace.finish()
+    _local.trace = None
+    _stats.add(qtype, trace)
+
+
+@contextmanager
+def span(name):
+    """ Record the time spent within the context as a named span
+        in the active trace, if any """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, t0, perf_counter())
+
+
+def bind(func):
+    """ Return a function that calls func with the trace that is active
+        in this thread also active in the thread that calls it """
+    trace = current()
+
+    def traced(*args, **kwargs):
+        previous = current()
+        _local.trace = trace
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.trace = previous
+
+    return traced
+
+
+def stats():
+    """ Return a dict of latency statistics by query type and span name """
+    return _stats.to_dict()
@@ -38,6 +38,8 @@ from correct import check_grammar
 from reynir.binparser import canonicalize_token
 from article import Article as ArticleProxy
 from query import process_query
+import answercache
+import querytrace
 from doc import SUPPORTED_DOC_MIMETYPES, MIMETYPE_TO_DOC_CLASS
 from speech import get_synthesized_text_url
 
@@ -480,6 +482,26 @@ def query_history_api(version=1):
     return better_jsonify(valid=True)
 
 
+@routes.route("/query_cache.api", methods=["GET", "POST"])
+@routes.route("/query_cache.api/v<int:version>", methods=["GET", "POST"])
+def query_cache_api(version=1):
+    """ Return hit and miss statistics for the query answer cache
+        of the worker process that serves the request """
+    if not (1 <= version <= 1):
+        return better_jsonify(valid=False, reason="Unsupported version")
+    return better_jsonify(valid=True, stats=answercache.stats())
+
+
+@routes.route("/query_timing.api", methods=["GET", "POST"])
+@routes.route("/query_timing.api/v<int:version>", methods=["GET", "POST"])
+def query_timing_api(version=1):
+    """ Return latency histograms of the query pipeline stages, by query
+        type, for the worker process that serves the request """
+    if not (1 <= version <= 1):
+        return better_jsonify(valid=False, reason="Unsupported version")
+    return better_jsonify(valid=True, stats=querytrace.stats())
+
+
 @routes.route("/feedback.api", methods=["POST"])
 @routes.route("/feedback.api/v<int:version>", methods=["POST"])
 def feedback_api(version=1):
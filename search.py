@@ -26,9 +26,11 @@
 """
 
 from datetime import timedelta
+from uuid import UUID
 
 from settings import Settings
-from db.models import Root, Article
+from db import desc
+from db.models import Root, Article, RelatedArticle
 from similar import SimilarityClient
 
 
@@ -53,17 +55,71 @@ class Search:
             cls.similarity_client = SimilarityClient()
 
 
+    @classmethod
+    def related_articles(cls, session, uuids, n):
+        """ Return a dict of article id: list of (article_id, similarity) tuples
+            for the n articles most similar to each of the articles with the
+            given ids, for the articles whose related articles have been
+            precomputed by the similarity server """
+        if n > RelatedArticle.MAX_RELATED:
+            return dict()
+        # Map of the ids in canonical form, as stored, to the given ids
+        valid = dict()
+        for uuid in uuids:
+            try:
+                valid[str(UUID(uuid))] = uuid
+            except ValueError:
+                # Not a valid UUID, which the database would reject
+                pass
+        if not valid:
+            return dict()
+        q = (
+            session.query(RelatedArticle)
+            .filter(RelatedArticle.article_id.in_(list(valid)))
+            .order_by(RelatedArticle.article_id, desc(RelatedArticle.similarity))
+        )
+        related = dict()
+        for r in q:
+            result = related.setdefault(valid[r.article_id], [])
+            if len(result) < n:
+                result.append((r.related_id, r.similarity))
+        return related
+
+
     @classmethod
     def list_similar_to_article(cls, session, uuid, n):
         """ List n articles that are similar to the article with the given id """
-        cls._connect()
-        # Returns a list of tuples: (article_id, similarity)
-        result = cls.similarity_client.list_similar_to_article(uuid, n = n + 5)
-        result = result.get("articles", [])
+        # Use the precomputed related articles, if any
+        result = cls.related_articles(session, [uuid], n + 5).get(uuid)
+        if result is None:
+            cls._connect()
+            # Returns a list of tuples: (article_id, similarity)
+            result = cls.similarity_client.list_similar_to_article(uuid, n = n + 5)
+            result = result.get("articles", [])
         # Convert the result tuples into article descriptors
         return cls.list_articles(session, result, n)
 
 
+    @classmethod
+    def list_similar_to_articles(cls, session, uuids, n):
+        """ List n articles that are similar to each of the articles with
+            the given ids, returning a dict of id: list of article descriptors.
+            The similarity queries for the articles whose related articles
+            have not been precomputed are sent to the server in one batch. """
+        results = cls.related_articles(session, uuids, n + 5)
+        missing = [uuid for uuid in uuids if uuid not in results]
+        if missing:
+            cls._connect()
+            batch = cls.similarity_client.list_similar_batch(
+                [dict(id=uuid, n=n + 5) for uuid in missing]
+            )
+            for uuid, result in zip(missing, batch):
+                results[uuid] = result.get("articles", [])
+        return {
+            uuid: cls.list_articles(session, results[uuid], n) for uuid in uuids
+        }
+
+
     @classmethod
     def list_similar_to_topic(cls, session, topic_vector, n):
         """ List n articles that are similar to the given topic vector """
@@ -94,12 +150,17 @@ class Search:
     def list_articles(cls, session, result, n):
         """ Convert similarity result tuples into article descriptors """
         similar = []
+        # Skip the original article (or at least a verbatim copy of it)
+        result = [(sid, similarity) for sid, similarity in result if similarity <= 0.9999]
+        if not result:
+            return similar
+        # Fetch all the articles in a single query
+        q = session.query(Article).join(Root).filter(
+            Article.id.in_([sid for sid, _ in result])
+        )
+        articles = {sa.id: sa for sa in q}
         for sid, similarity in result:
-            if similarity > 0.9999:
-                # The original article (or at least a verbatim copy of it)
-                continue
-            q = session.query(Article).join(Root).filter(Article.id == sid)
-            sa = q.one_or_none()
+            sa = articles.get(sid)
             if sa and sa.heading and sa.heading.strip(): # Skip articles without headings
                 # Similarity in percent
                 spercent = 100.0 * similarity
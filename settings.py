@@ -644,6 +644,28 @@ class Settings:
             "similarity server on port {0}".format(PORT)
         )
 
+    # Number of lists of the approximate nearest-neighbour index that
+    # the similarity server searches per query (0 = exact search)
+    SIMSERVER_ANN_PROBES = os.environ.get("SIMSERVER_ANN_PROBES", "0")
+    try:
+        SIMSERVER_ANN_PROBES = int(SIMSERVER_ANN_PROBES)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_ANN_PROBES={0}"
+            .format(SIMSERVER_ANN_PROBES)
+        )
+
+    # Age in days of the articles whose related articles the similarity
+    # server precomputes and stores in the related table (0 = none)
+    SIMSERVER_RELATED_DAYS = os.environ.get("SIMSERVER_RELATED_DAYS", "0")
+    try:
+        SIMSERVER_RELATED_DAYS = int(SIMSERVER_RELATED_DAYS)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_RELATED_DAYS={0}"
+            .format(SIMSERVER_RELATED_DAYS)
+        )
+
     NN_PARSING_ENABLED = os.environ.get('NN_PARSING_ENABLED', False)
     try:
         NN_PARSING_ENABLED = bool(int(NN_PARSING_ENABLED))
@@ -670,6 +692,49 @@ class Settings:
     except ValueError:
         raise ConfigError("Invalid environment variable value: NN_TRANSLATION_PORT = {0}".format(NN_TRANSLATION_PORT))
 
+    # Maximum number of entries in the process-wide BÍN lookup cache
+    BIN_CACHE_SIZE = os.environ.get("GREYNIR_BIN_CACHE_SIZE", "65536")
+    try:
+        BIN_CACHE_SIZE = int(BIN_CACHE_SIZE)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_BIN_CACHE_SIZE={0}"
+            .format(BIN_CACHE_SIZE)
+        )
+    # Path of a BÍN lookup cache snapshot file to share between worker processes
+    BIN_CACHE_SNAPSHOT = os.environ.get("GREYNIR_BIN_CACHE_SNAPSHOT")
+
+    # Number of threads for parsing alternative query interpretations
+    # concurrently (0 or 1 to parse them one at a time, on demand)
+    QUERY_PARSE_THREADS = os.environ.get("GREYNIR_QUERY_PARSE_THREADS", "0")
+    try:
+        QUERY_PARSE_THREADS = int(QUERY_PARSE_THREADS)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_QUERY_PARSE_THREADS={0}"
+            .format(QUERY_PARSE_THREADS)
+        )
+    # Deadline in seconds for parsing the interpretations of a voice query
+    # when they are parsed concurrently
+    QUERY_PARSE_DEADLINE = os.environ.get("GREYNIR_QUERY_PARSE_DEADLINE", "2.5")
+    try:
+        QUERY_PARSE_DEADLINE = float(QUERY_PARSE_DEADLINE)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_QUERY_PARSE_DEADLINE={0}"
+            .format(QUERY_PARSE_DEADLINE)
+        )
+
+    # Maximum number of entries in the per-process query answer cache
+    ANSWER_CACHE_SIZE = os.environ.get("GREYNIR_ANSWER_CACHE_SIZE", "4096")
+    try:
+        ANSWER_CACHE_SIZE = int(ANSWER_CACHE_SIZE)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_ANSWER_CACHE_SIZE={0}"
+            .format(ANSWER_CACHE_SIZE)
+        )
+
     # Configuration settings from the Greynir.conf file
 
     @staticmethod
@@ -703,8 +768,20 @@ class Settings:
                 Settings.SIMSERVER_HOST = val
             elif par == "simserver_port":
                 Settings.SIMSERVER_PORT = int(val)
+            elif par == "simserver_ann_probes":
+                Settings.SIMSERVER_ANN_PROBES = int(val)
+            elif par == "simserver_related_days":
+                Settings.SIMSERVER_RELATED_DAYS = int(val)
             elif par == "debug":
                 Settings.DEBUG = bool(val)
+            elif par == "bin_cache_size":
+                Settings.BIN_CACHE_SIZE = int(val)
+            elif par == "answer_cache_size":
+                Settings.ANSWER_CACHE_SIZE = int(val)
+            elif par == "query_parse_threads":
+                Settings.QUERY_PARSE_THREADS = int(val)
+            elif par == "query_parse_deadline":
+                Settings.QUERY_PARSE_DEADLINE = float(val)
             else:
                 raise ConfigError("Unknown configuration parameter '{0}'".format(par))
         except ValueError:
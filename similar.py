@@ -23,10 +23,22 @@
     This module implements a client for the similarity server
     whose source code can be found in vectors/simserver.py.
 
+    The client keeps its connection to the server open between requests,
+    and it is reopened if the client is used in a forked process, such as
+    a Gunicorn worker, so that each process gets its own connection. A
+    lock serializes the requests of the threads that share the client.
+
+    Many similarity queries can be sent in a single round trip with
+    list_similar_batch(). Large batches are split into several requests,
+    which are pipelined, i.e. sent without waiting for the previous replies.
+
 """
 
+from typing import List
+
 import os
 import sys
+import threading
 from contextlib import closing
 from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
 
@@ -76,6 +88,16 @@ def _Client(address, authkey=None):
     return c
 
 
+# Maximum number of similarity queries in a single batch request
+# (the server accepts at most 1000)
+_BATCH_SIZE = 100
+
+# Maximum number of batch requests that are sent ahead of the replies.
+# This is kept small, since the server blocks when sending a reply if the
+# client is still sending requests and the socket buffers are full.
+_PIPELINE_DEPTH = 4
+
+
 class SimilarityClient:
 
     """ A client that interacts with the similarity server over a
@@ -86,12 +108,19 @@ class SimilarityClient:
 
     def __init__(self):
         self._conn = None
+        # The process in which the connection was opened
+        self._pid = None
+        self._lock = threading.RLock()
 
     def _connect(self):
         """ Connect to a similarity server, with authentication """
         if self._conn is not None:
-            # Already connected
-            return
+            if self._pid == os.getpid():
+                # Already connected
+                return
+            # The connection was inherited from a parent process, which may
+            # still be using it: abandon it without closing it
+            self._conn = None
         if not Settings.SIMSERVER_PORT:
             # No similarity server configured
             return
@@ -110,6 +139,7 @@ class SimilarityClient:
         address = (Settings.SIMSERVER_HOST, Settings.SIMSERVER_PORT)
         try:
             self._conn = _Client(address, authkey=secret_password)
+            self._pid = os.getpid()
         except Exception as ex:
             print(
                 "Unable to connect to similarity server at {0}:{1}; error {2}".format(
@@ -123,37 +153,84 @@ class SimilarityClient:
         """ Connect to the server and send it a request, retrying if the
             server has closed the connection in the meantime. Return a
             dict with a result list or an empty list if no connection. """
-        retries = 0
-        while retries < 2:
-            self._connect()
-            if self._conn is None:
-                break
-            try:
-                self._conn.send(kwargs)
-                return self._conn.recv()
-            except (EOFError, BlockingIOError):
-                self.close()
-                retries += 1
-                continue
+        with self._lock:
+            retries = 0
+            while retries < 2:
+                self._connect()
+                if self._conn is None:
+                    break
+                try:
+                    self._conn.send(kwargs)
+                    return self._conn.recv()
+                except (EOFError, OSError):
+                    self.close()
+                    retries += 1
+                    continue
         return dict(articles=[])
 
+    def _pipeline(self, batches, results):
+        """ Send batch requests to the server, keeping up to _PIPELINE_DEPTH
+            of them in flight, and append the result lists of their replies
+            to results. Raises an exception if the connection fails,
+            leaving the results of the replies received so far. """
+        conn = self._conn
+        # Resume after the last batch whose reply was received
+        received = sent = len(results) // _BATCH_SIZE
+        while received < len(batches):
+            while sent < len(batches) and sent - received < _PIPELINE_DEPTH:
+                conn.send(dict(cmd="similar_batch", requests=batches[sent]))
+                sent += 1
+            reply = conn.recv()
+            batch_results = reply.get("results", [])
+            if len(batch_results) != len(batches[received]):
+                # Invalid batch: keep the results aligned with the queries
+                batch_results = [dict(articles=[])] * len(batches[received])
+            results.extend(batch_results)
+            received += 1
+
+    def _retry_batch(self, requests):
+        """ Send similarity queries to the server in batch requests, retrying
+            the remaining batches if the server has closed the connection in
+            the meantime. Returns a list of result dicts, one per query,
+            which are empty if there is no connection. """
+        batches = [
+            requests[i : i + _BATCH_SIZE] for i in range(0, len(requests), _BATCH_SIZE)
+        ]
+        results = []  # type: List[dict]
+        with self._lock:
+            retries = 0
+            while retries < 2:
+                self._connect()
+                if self._conn is None:
+                    break
+                try:
+                    self._pipeline(batches, results)
+                    return results
+                except (EOFError, OSError):
+                    self.close()
+                    retries += 1
+                    continue
+        results.extend(dict(articles=[]) for _ in range(len(requests) - len(results)))
+        return results
+
     def _retry_cmd(self, **kwargs):
         """ Connect to the server and send it a command, retrying if the
             server has closed the connection in the meantime. """
-        retries = 0
-        while retries < 2:
-            self._connect()
-            if self._conn is None:
-                break
-            try:
-                self._conn.send(kwargs)
-                # Successful: we're done
-                return
-            except EOFError:
-                # Close the connection from the client side and re-connect
-                self.close()
-                retries += 1
-                continue
+        with self._lock:
+            retries = 0
+            while retries < 2:
+                self._connect()
+                if self._conn is None:
+                    break
+                try:
+                    self._conn.send(kwargs)
+                    # Successful: we're done
+                    return
+                except (EOFError, OSError):
+                    # Close the connection from the client side and re-connect
+                    self.close()
+                    retries += 1
+                    continue
 
     def list_similar_to_article(self, article_id, n=10):
         """ Returns a dict containing a list of (article_id, similarity) tuples """
@@ -169,6 +246,16 @@ class SimilarityClient:
             list of (article_id, similarity) tuples """
         return self._retry_list(cmd="similar", terms=terms, n=n)
 
+    def list_similar_batch(self, requests):
+        """ Run many similarity queries in as few round trips as possible.
+            Each request is a dict with an id, topic or terms key, as in
+            the single queries above, and optionally n, the number of
+            results (10 by default). Returns a list containing a result
+            dict for each request, in the same order. """
+        if not requests:
+            return []
+        return self._retry_batch(list(requests))
+
     def refresh_topics(self):
         """ Cause the server to refresh article topic vectors from the database """
         self._retry_cmd(cmd="refresh")
@@ -179,7 +266,9 @@ class SimilarityClient:
 
     def close(self):
         """ Close a client connection """
-        if self._conn is not None:
-            self._conn.close()
-            self._conn = None
+        with self._lock:
+            if self._conn is not None:
+                if self._pid == os.getpid():
+                    self._conn.close()
+                self._conn = None
 
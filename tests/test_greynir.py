@@ -259,6 +259,23 @@ def test_geo():
     assert capitalize_placename("bosnía og hersegóvína") == "Bosnía og Hersegóvína"
     assert capitalize_placename("Norður-Makedónía") == "Norður-Makedónía"
 
+    # Test nearest-neighbour lookups in a spatial index
+    rvk = (64.1466, -21.9426)
+    akureyri = (65.6885, -18.1262)
+    egilsstadir = (65.2669, -14.3948)
+    index = SpatialIndex([akureyri, egilsstadir, rvk])
+    assert [loc for _, loc in index.nearest(rvk, 2)] == [rvk, akureyri]
+    assert [loc for _, loc in index.nearest(egilsstadir, 5)] == [
+        egilsstadir,
+        akureyri,
+        rvk,
+    ]
+    dist, loc = index.nearest((64.15, -21.95))[0]
+    assert loc == rvk and abs(dist - distance((64.15, -21.95), rvk)) < 1e-6
+    assert index.nearest(rvk, 2, within_radius=100.0) == [(0.0, rvk)]
+    assert [loc for _, loc in index.within(akureyri, 200.0)] == [akureyri, egilsstadir]
+    assert SpatialIndex([]).nearest(rvk) == []
+
 
 def test_doc():
     """ Test document-related functions in doc.py """
@@ -445,3 +462,53 @@ def test_numbers():
         numbers_to_neutral("Baugatangi 1-17, Reykjavík")
         == "Baugatangi eitt-17, Reykjavík"
     )
+
+
+def test_answercache():
+    """ Test expiry, eviction and copying in the query answer cache """
+    from datetime import timedelta
+    from answercache import AnswerCache, cache_key
+
+    c = AnswerCache(2)
+    now = datetime.utcnow()
+    k = cache_key("Hvað er klukkan", True, (64.156896, -21.951200))
+    assert k == cache_key("hvað er klukkan", True, (64.157, -21.9512))
+    assert k != cache_key("hvað er klukkan", False, (64.157, -21.9512))
+    c.put(k, dict(response=dict(answer="12:00")), now + timedelta(minutes=1))
+    r = c.get(k, now)
+    assert r == dict(response=dict(answer="12:00"))
+    # Modifying the returned result does not affect the cache
+    r["response"]["answer"] = "13:00"
+    assert c.get(k, now)["response"]["answer"] == "12:00"
+    # Expired entries are removed
+    assert c.get(k, now + timedelta(minutes=2)) is None
+    assert c.get(k, now) is None
+    # The least recently used entry is evicted
+    for i in range(3):
+        c.put(i, dict(answer=i), now + timedelta(minutes=1))
+    assert c.get(0, now) is None
+    assert c.get(2, now) == dict(answer=2)
+    stats = c.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 3
+    assert stats["expirations"] == 1 and stats["evictions"] == 1
+
+
+def test_querytrace():
+    """ Test spans and latency statistics in query traces """
+    import querytrace
+
+    with querytrace.span("outside"):
+        pass
+    trace = querytrace.begin()
+    with querytrace.span("parse"):
+        pass
+    assert querytrace.bind(lambda: querytrace.current())() is trace
+    with querytrace.span("parse"):
+        pass
+    querytrace.end(trace, "TestQtype")
+    assert querytrace.current() is None
+    d = trace.to_dict()
+    assert [s["name"] for s in d["spans"]] == ["parse", "parse"]
+    stats = querytrace.stats()["TestQtype"]
+    assert set(stats.keys()) == {"(total)", "parse"}
+    assert stats["parse"]["count"] == 1
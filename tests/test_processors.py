@@ -162,5 +162,70 @@ def test_entities():
     assert session.is_empty()
 
 
+def test_deep_tree():
+    """ Process a pathologically deep tree, which would exceed the
+        Python recursion limit with a recursive traversal """
+    depth = 5000
+    lines = ["S1", "N0 P"]
+    lines.extend("N{0} Setning".format(i) for i in range(1, depth))
+    lines.append('T{0} no_kk_et_nf "hestur"'.format(depth))
+    lines.append("Q0")
+    tree = Tree()
+    tree.load("\n".join(lines))
+
+    class DeepProcessor:
+        """ Counts the handled nonterminals and collects the sentence text """
+
+        def __init__(self):
+            self.count = 0
+            self.text = None
+
+        def Setning(self, node, params, result):
+            self.count += 1
+
+        def sentence(self, state, result):
+            self.text = result._text
+
+    processor = DeepProcessor()
+    tree.process(SessionShim(), processor)
+    assert processor.count == depth - 1
+    assert processor.text == "hestur"
+
+
+def test_load_forest():
+    """ Test that a tree loaded directly from a parse forest is the same
+        as one loaded from the text dump of the forest """
+
+    def terminals(node):
+        while node is not None:
+            if node.child is None:
+                yield (node.text, node.tokentype, node.aux, node.at_start)
+            else:
+                yield from terminals(node.child)
+            node = node.nxt
+
+    text = """
+       Jón greiddi 25 þúsund krónur fyrir „Bláa hestinn“ þann 3. mars 2019.
+       Klukkan 14:30 hringdi hún í síma 555-1234.
+    """
+    toklist = tokenize(text)
+    fp = Fast_Parser(verbose=False)
+    ip = IncrementalParser(fp, toklist, verbose=False)
+    num_sent = 0
+    for p in ip.paragraphs():
+        for sent in p.sentences():
+            assert sent.parse(), "Sentence does not parse: " + sent.text
+            num_sent += 1
+            tree1 = Tree()
+            tree1.load("S1\n" + ParseForestDumper.dump_forest(sent.tree))
+            tree2 = Tree()
+            tree2.load_forest(1, sent.tree)
+            assert str(tree1[1]) == str(tree2[1])
+            assert list(terminals(tree1[1])) == list(terminals(tree2[1]))
+    assert num_sent == 2
+
+
 if __name__ == "__main__":
     test_entities()
+    test_deep_tree()
+    test_load_forest()
@@ -0,0 +1,163 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for the topic vectors of the similarity server in vectors/simserver.py
+
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+# The similarity server imports its modules from the vectors/ subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_TESTS = os.sep + "tests"
+if basepath.endswith(_TESTS):
+    basepath = basepath[0 : -len(_TESTS)]
+    sys.path.append(basepath)
+sys.path.append(os.path.join(basepath, "vectors"))
+
+# The vectors/ modules require gensim, which is not needed by the main server
+pytest.importorskip("gensim")
+
+import simserver
+from simserver import SimilarityServer, TopicVectors
+
+
+_DIMENSIONS = 20
+
+
+def normalized(v):
+    return v / np.linalg.norm(v)
+
+
+def random_vectors(rng, n, first=0):
+    return [
+        ("a{0}".format(i), rng.standard_normal(_DIMENSIONS))
+        for i in range(first, first + n)
+    ]
+
+
+def test_updated():
+    rng = np.random.RandomState(1)
+    base = TopicVectors(_DIMENSIONS)
+    for article_id, v in random_vectors(rng, 10):
+        base.add(article_id, v)
+    a0 = np.array(base.vector("a0"))
+    x, y, z = (rng.standard_normal(_DIMENSIONS) for _ in range(3))
+
+    # The first instance created from the base shares its matrix
+    tv1 = base.updated([("x", x)])
+    assert np.shares_memory(tv1.matrix, base.matrix)
+    # Later ones don't, so rows added to them don't overwrite each other
+    tv2 = base.updated([("y", y)])
+    assert not np.shares_memory(tv2.matrix, base.matrix)
+    assert np.allclose(tv1.vector("x"), normalized(x))
+    assert np.allclose(tv2.vector("y"), normalized(y))
+    assert tv1.vector("y") is None and tv2.vector("x") is None
+    assert len(base) == 10 and base.vector("x") is None
+
+    # Replacing a row copies the shared matrix,
+    # leaving the instances it was created from unchanged
+    tv3 = tv1.updated([("a0", z)])
+    assert np.allclose(tv3.vector("a0"), normalized(z))
+    assert np.allclose(tv1.vector("a0"), a0)
+    assert np.allclose(base.vector("a0"), a0)
+    assert len(tv3) == len(tv1) == 11
+
+    # Adding beyond the capacity of the shared matrix copies it
+    tv4 = tv3.updated(random_vectors(rng, 2000, first=10))
+    assert len(tv4) == 2011 and len(tv3) == 11
+    assert np.allclose(tv3.vector("x"), normalized(x))
+
+
+def test_related_incremental():
+    """ Check that updating the related articles with new and replaced
+        articles gives the same lists as recomputing them all """
+    rng = np.random.RandomState(2)
+    tv = TopicVectors(_DIMENSIONS)
+    for article_id, v in random_vectors(rng, 2000):
+        tv.add(article_id, v)
+    targets = set("a{0}".format(i) for i in range(1500, 2000))
+
+    def related(server, full, new_ids=()):
+        stored = dict()
+
+        def store(full, related, changed, removed):
+            stored.update((a, related[a]) for a in changed)
+
+        server._related_targets = lambda atopics: set(
+            a for a in targets if atopics.vector(a) is not None
+        )
+        server._store_related = store
+        server._update_related(full, list(new_ids))
+        return stored
+
+    server = SimilarityServer()
+    server._atopics = tv
+    first = related(server, True)
+    assert set(first) == targets
+
+    # A new article, which is also a target, and a replaced one,
+    # which is in some of the existing lists
+    replaced = first["a1500"][0][0]
+    vectors = [
+        ("new", rng.standard_normal(_DIMENSIONS)),
+        (replaced, rng.standard_normal(_DIMENSIONS)),
+    ]
+    targets.add("new")
+    server._atopics = tv.updated(vectors)
+    changed = related(server, False, [article_id for article_id, _ in vectors])
+    assert "new" in changed and "a1500" in changed
+    incremental = server._related
+
+    full = SimilarityServer()
+    full._atopics = server._atopics
+    related(full, True)
+    assert set(incremental) == set(full._related)
+    for article_id, lst in full._related.items():
+        assert [a for a, _ in incremental[article_id]] == [a for a, _ in lst]
+        assert np.allclose(
+            [s for _, s in incremental[article_id]], [s for _, s in lst]
+        )
+
+
+def test_popular(monkeypatch):
+    monkeypatch.setattr(simserver.Settings, "SIMSERVER_RELATED_DAYS", 2)
+    monkeypatch.setattr(simserver, "_RELATED_MAX_COUNTED", 10)
+    server = SimilarityServer()
+    scheduled = []
+    server._schedule_related = lambda: scheduled.append(True)
+    for _ in range(simserver._RELATED_POPULAR_QUERIES):
+        server._count_query("p")
+    assert "p" in server._popular and "p" not in server._queries
+    assert len(scheduled) == 1
+
+    # The counts of rarely queried articles are bounded
+    for i in range(100):
+        server._count_query("a{0}".format(i))
+    assert len(server._queries) <= 10
+
+    # Popular articles that are no longer queried are dropped
+    server._popular["old"] = time.time() - 3 * 24 * 3600
+    assert server._recent_popular() == {"p"}
+    assert "old" not in server._popular
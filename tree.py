@@ -27,18 +27,24 @@
 
 """
 
-from typing import Dict
+from typing import Any, Dict, FrozenSet, List, Tuple
+import sys
 import json
 import re
 
+from time import perf_counter
+
 from contextlib import closing
 from collections import OrderedDict, namedtuple
 
 from settings import Settings, DisallowedNames, VerbObjects
 from reynir.bindb import BIN_Db
+from reynir import TOK
 from reynir.binparser import BIN_Token
+from reynir.fastparser import ParseForestNavigator
 from reynir.simpletree import SimpleTreeBuilder
-from reynir.cache import LRU_Cache
+
+import bincache
 
 
 BIN_ORDFL = {
@@ -68,6 +74,98 @@ BIN_ORDFL = {
 
 _REPEAT_SUFFIXES = frozenset(("+", "*", "?"))
 
+# Sentinel for the params of a Result whose child results have
+# not been constructed yet (see Result.params)
+LAZY_PARAMS = object()
+
+# Sentinel returned from the traversal of a subtree that contains
+# no nonterminal that is handled by the current processor
+_COLD = object()
+
+# Sentinel for missing dictionary entries
+_MISSING = object()
+
+
+class ProcessorDispatch:
+
+    """ A dispatch table for a processor module, compiled once per module.
+        Handler functions are keyed by interned nonterminal base names,
+        and the hook functions (article_begin, sentence, visit, default...)
+        are looked up in advance, so that tree traversal does not need
+        to call getattr() on the processor module for every node.
+
+        The dispatch table also accumulates call counts and wall-clock
+        time for each hook and nonterminal handler of the processor. """
+
+    # Hook functions that processors may define, for tree and token processors
+    HOOKS = (
+        "article_begin",
+        "article_end",
+        "sentence",
+        "visit",
+        "default",
+        "paragraph_begin",
+        "paragraph_end",
+        "sentence_begin",
+        "sentence_end",
+        "token",
+    )
+
+    # Compiled dispatch tables, keyed by processor module
+    _cache = dict()  # type: Dict[Any, ProcessorDispatch]
+
+    def __init__(self, processor):
+        self.processor = processor
+        handlers = dict()
+        if processor is not None:
+            for name in dir(processor):
+                if name.startswith("__"):
+                    continue
+                func = getattr(processor, name, None)
+                if callable(func):
+                    handlers[sys.intern(name)] = func
+        self.handlers = handlers
+        for hook in self.HOOKS:
+            setattr(self, hook, handlers.get(hook))
+        # Call counts and total seconds, keyed by hook or nonterminal name
+        self.timings = dict()  # type: Dict[str, List[Any]]
+
+    def handler(self, nt_base):
+        """ Return the handler function for the given nonterminal base name,
+            or the processor's default() function, or None if neither exists """
+        return self.handlers.get(nt_base, self.default)
+
+    def record(self, key, seconds):
+        """ Record a call taking the given number of seconds """
+        t = self.timings.get(key)
+        if t is None:
+            self.timings[key] = [1, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+
+    def call(self, key, func, *args):
+        """ Call a hook function, recording its timing under the given key """
+        t0 = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record(key, perf_counter() - t0)
+
+    def collect_timings(self):
+        """ Return the timings accumulated so far, and reset them """
+        timings, self.timings = self.timings, dict()
+        return timings
+
+    @classmethod
+    def get(cls, processor):
+        """ Return the dispatch table for the given processor module,
+            compiling it if not already found in the cache """
+        dispatch = cls._cache.get(processor)
+        if dispatch is None:
+            dispatch = cls._cache[processor] = cls(processor)
+        return dispatch
+
 
 class Result:
 
@@ -87,10 +185,26 @@ class Result:
         like so: [ op ]. When the "+" operator node is processed, it will automatically
         get an "operand" attribute containing [ left_op, right_op ].
 
+        Results for subtrees that no processor handler is interested in are
+        created with params=LAZY_PARAMS, in which case the child results are
+        only constructed if and when they are actually requested.
+
     """
 
+    # The instance __dict__ holds the result attributes, while the
+    # associated node, state and params are kept in slots
+    __slots__ = ("__dict__", "_node", "_state", "_params")
+
+    # Lazily evaluated attributes and the node methods that calculate them
+    # (note that these can be overridden by setting them directly)
+    _LAZY_ATTRIBS = {
+        "_nominative": "nominative",
+        "_indefinite": "indefinite",
+        "_canonical": "canonical",
+        "_root": "root",
+    }
+
     def __init__(self, node, state, params):
-        self.dict = dict()  # Our own custom dict for instance attributes
         self._node = node
         self._state = state
         self._params = params
@@ -105,80 +219,61 @@ class Result:
 
     @property
     def params(self):
+        if self._params is LAZY_PARAMS:
+            # Construct the child results on demand
+            state = self._state
+            self._params = [c.lazy_result(state) for c in self._node.children()]
         return self._params
 
+    @property
+    def dict(self):
+        """ The dictionary of result attributes """
+        return self.__dict__
+
     def __repr__(self):
         return "Result with {0} params\nDict is: {1}".format(
-            len(self._params) if self._params else 0, self.dict
+            len(self.params) if self.params else 0, self.__dict__
         )
 
-    def __setattr__(self, key, val):
-        """ Fancy attribute setter using our own dict for instance attributes """
-        if key == "__dict__" or key == "dict" or key in self.__dict__:
-            # Relay to Python's default attribute resolution mechanism
-            super().__setattr__(key, val)
-        else:
-            # Set attribute in our own dict
-            self.dict[key] = val
-
     def __getattr__(self, key):
-        """ Fancy attribute getter with special cases for _root and _nominative """
+        """ Attribute getter with lazy evaluation of _root, _nominative, etc. """
         # Note: this is only called for attributes that are not found by 'normal' means
-        d = self.dict
-        if key in d:
-            return d[key]
-        # Key not found: try lazy evaluation
-        if key == "_nominative":
-            # Lazy evaluation of the _nominative attribute
-            # (Note that it can be overridden by setting it directly)
-            d[key] = val = self._node.nominative(self._state, self._params)
-            return val
-        if key == "_indefinite":
-            # Lazy evaluation of the _indefinite attribute
-            # (Note that it can be overridden by setting it directly)
-            d[key] = val = self._node.indefinite(self._state, self._params)
-            return val
-        if key == "_canonical":
-            # Lazy evaluation of the _canonical attribute
-            # (Note that it can be overridden by setting it directly)
-            d[key] = val = self._node.canonical(self._state, self._params)
-            return val
-        if key == "_root":
-            # Lazy evaluation of the _root attribute
-            # (Note that it can be overridden by setting it directly)
-            d[key] = val = self._node.root(self._state, self._params)
-            return val
         if key == "_text":
             # Lazy evaluation of the _text attribute
-            # (Note that it can be overridden by setting it directly)
-            d[key] = val = self._node.contained_text()
-            return val
-        # Not found in our custom dict
-        raise AttributeError("Result object has no attribute named '{0}'".format(key))
+            val = self._node.contained_text()
+        else:
+            func = self._LAZY_ATTRIBS.get(key)
+            if func is None:
+                raise AttributeError(
+                    "Result object has no attribute named '{0}'".format(key)
+                )
+            val = getattr(self._node, func)(self._state, self.params)
+        self.__dict__[key] = val
+        return val
 
     def __contains__(self, key):
-        return key in self.dict
+        return key in self.__dict__
 
     def __getitem__(self, key):
-        return self.dict[key]
+        return self.__dict__[key]
 
     def __setitem__(self, key, val):
-        self.dict[key] = val
+        self.__dict__[key] = val
 
     def __delitem__(self, key):
-        del self.dict[key]
+        del self.__dict__[key]
 
     def get(self, key, default=None):
-        return self.dict.get(key, default)
+        return self.__dict__.get(key, default)
 
     def attribs(self):
         """ Enumerate all attributes, and values, of this result object """
-        for key, val in self.dict.items():
+        for key, val in self.__dict__.items():
             yield (key, val)
 
     def user_attribs(self):
         """ Enumerate all user-defined attributes and values of this result object """
-        for key, val in self.dict.items():
+        for key, val in self.__dict__.items():
             if isinstance(key, str) and not key.startswith("_") and not callable(val):
                 yield (key, val)
 
@@ -186,35 +281,37 @@ class Result:
         """ Copy all user attributes from p into this result """
         if p is self or p is None:
             return
-        d = self.dict
-        for key, val in p.user_attribs():
+        d = self.__dict__
+        for key, val in p.__dict__.items():
             # Pass all named parameters whose names do not start with an underscore
             # up to the parent, by default
+            if not isinstance(key, str) or key.startswith("_") or callable(val):
+                continue
             # Generally we have left-to-right priority, i.e.
             # the leftmost entity wins in case of conflict.
             # However, lists, sets and dictionaries with the same
             # member name are combined.
-            if key not in d:
+            left = d.get(key, _MISSING)
+            if left is _MISSING:
                 d[key] = val
-            else:
-                # Combine lists and dictionaries
-                left = d[key]
-                if isinstance(left, list) and isinstance(val, list):
+            elif isinstance(left, list):
+                if isinstance(val, list):
                     # Extend lists
                     left.extend(val)
-                elif isinstance(left, set) and isinstance(val, set):
+            elif isinstance(left, set):
+                if isinstance(val, set):
                     # Return union of sets
                     left |= val
-                elif isinstance(left, dict) and isinstance(val, dict):
-                    # Keep the left entries but add any new/additional val entries
-                    # (This gives left priority; left.update(val) would give right priority)
-                    d[key] = dict(val, **left)
+            elif isinstance(left, dict) and isinstance(val, dict):
+                # Keep the left entries but add any new/additional val entries
+                # (This gives left priority; left.update(val) would give right priority)
+                d[key] = dict(val, **left)
 
     def del_attribs(self, alist):
         """ Delete the attribs in alist from the result object """
         if isinstance(alist, str):
             alist = (alist,)
-        d = self.dict
+        d = self.__dict__
         for a in alist:
             if a in d:
                 del d[a]
@@ -222,16 +319,18 @@ class Result:
     def enum_children(self, test_f=None):
         """ Enumerate the child parameters of this node, yielding (child_node, result)
             where the child node meets the given test, if any """
-        if self._params:
-            for p, c in zip(self._params, self._node.children()):
+        params = self.params
+        if params:
+            for p, c in zip(params, self._node.children()):
                 if test_f is None or test_f(c):
                     yield (c, p)
 
     def enum_descendants(self, test_f=None):
         """ Enumerate the descendant parameters of this node, yielding (child_node, result)
             where the child node meets the given test, if any """
-        if self._params:
-            for p, c in zip(self._params, self._node.children()):
+        params = self.params
+        if params:
+            for p, c in zip(params, self._node.children()):
                 if p is not None:
                     # yield from p.enum_descendants(test_f)
                     for d_c, d_p in p.enum_descendants(test_f):
@@ -306,6 +405,8 @@ class Node:
     """ Base class for terminal and nonterminal nodes reconstructed from
         trees in text format loaded from the scraper database """
 
+    __slots__ = ("child", "nxt")
+
     def __init__(self):
         self.child = None
         self.nxt = None
@@ -328,6 +429,15 @@ class Node:
         """ Does the node have the given variant? """
         return False
 
+    def is_handled(self, dispatch):
+        """ Would processing this node invoke a handler in the given dispatch table? """
+        return False
+
+    def lazy_result(self, state):
+        """ Return a result object for this node, postponing the construction
+            of child results until they are requested """
+        raise NotImplementedError  # Should be overridden
+
     @property
     def at_start(self):
         """ Return True if this node spans the start of a sentence """
@@ -365,14 +475,19 @@ class Node:
     def descendants(self, test_f=None):
         """ Do a depth-first traversal of all children of this node,
             returning those that pass a test function, if given """
+        # Iterative post-order traversal, using an explicit stack of the
+        # nodes whose children are being enumerated
+        stack = []
         c = self.child
-        while c:
-            for cc in c.descendants():
-                if test_f is None or test_f(cc):
-                    yield cc
-            if test_f is None or test_f(c):
-                yield c
-            c = c.nxt
+        while c is not None or stack:
+            if c is not None:
+                stack.append(c)
+                c = c.child
+            else:
+                c = stack.pop()
+                if test_f is None or test_f(c):
+                    yield c
+                c = c.nxt
 
     def contained_text(self):
         """ Return a string consisting of the literal text of all
@@ -653,7 +768,7 @@ class TerminalDescriptor:
         if " " in word:
             # Multi-word phrase: we return it unchanged
             return word
-        _, meanings = bindb.lookup_word(word, at_start)
+        _, meanings = bincache.lookup_word(word, at_start)
         if meanings:
             for m in meanings:
                 if self._bin_filter(m):
@@ -665,8 +780,7 @@ class TerminalDescriptor:
 
 def _root_lookup(text, at_start, terminal):
     """ Look up the root of a word that isn't found in the cache """
-    with BIN_Db.get_db() as bin_db:
-        w, m = bin_db.lookup_word(text, at_start)
+    w, m = bincache.lookup_word(text, at_start)
     if m:
         # Find the meaning that matches the terminal
         td = TerminalNode._TD[terminal]
@@ -680,10 +794,35 @@ def _root_lookup(text, at_start, terminal):
     return w.replace("-", "")
 
 
+def _cached_root(text, at_start, terminal):
+    """ Return the root of a word, via the shared BÍN lookup cache """
+    return bincache.lookup(
+        ("root", text, at_start, terminal), _root_lookup, text, at_start, terminal
+    )
+
+
 class TerminalNode(Node):
 
     """ A Node corresponding to a terminal """
 
+    __slots__ = (
+        "td",
+        "token",
+        "text",
+        "_at_start",
+        "tokentype",
+        "is_word",
+        "is_literal",
+        "is_declinable",
+        "augmented_terminal",
+        "aux",
+        "_aux",
+        "root_cache",
+        "nominative_cache",
+        "indefinite_cache",
+        "canonical_cache",
+    )
+
     # Undeclinable terminal categories
     _NOT_DECLINABLE = frozenset(
         ["ao", "eo", "spao", "fs", "st", "stt", "nhm", "uh", "töl"]
@@ -691,9 +830,6 @@ class TerminalNode(Node):
     # Cache of terminal descriptors
     _TD = dict()  # type: Dict[str, TerminalDescriptor]
 
-    # Cache of word roots (stems) keyed by (word, at_start, terminal)
-    _root_cache = LRU_Cache(_root_lookup, maxsize=16384)
-
     def __init__(self, terminal, augmented_terminal, token, tokentype, aux, at_start):
         super().__init__()
         td = self._TD.get(terminal)
@@ -779,19 +915,19 @@ class TerminalNode(Node):
         # Lookup the token in the BIN database
         if (not self.is_word) or self.is_literal:
             return self.text
-        return self._root_cache(self.text, self._at_start, self.td.terminal)
+        return _cached_root(self.text, self._at_start, self.td.terminal)
 
     def _lazy_eval_root(self):
         """ Return a word root (stem) function object, with arguments, that can be
             used for lazy evaluation of word stems. """
         if (not self.is_word) or self.is_literal:
             return self.text
-        return self._root_cache, (self.text, self._at_start, self.td.terminal)
+        return _cached_root, (self.text, self._at_start, self.td.terminal)
 
     def lookup_alternative(self, bin_db, replace_func, sort_func=None):
         """ Return a different (but always nominative case) word form, if available,
             by altering the beyging spec via the given replace_func function """
-        w, m = bin_db.lookup_word(self.text, self._at_start)
+        w, m = bincache.lookup_word(self.text, self._at_start)
         if m:
             # Narrow the meanings down to those that are compatible with the terminal
             m = [x for x in m if self.td._bin_filter(x)]
@@ -816,7 +952,7 @@ class TerminalNode(Node):
                     # looking for. It also must be the same word category and
                     # the same stem and identifier ('utg'). In fact the 'utg' check
                     # alone should be sufficient, but better safe than sorry.
-                    n = bin_db.lookup_raw_nominative(parts[-1])  # Note: this call is cached
+                    n = bincache.lookup_raw_nominative(parts[-1])
                     r = [
                         nm
                         for nm in n
@@ -839,6 +975,18 @@ class TerminalNode(Node):
                 w = result[0].ordmynd
         return w.replace("-", "")
 
+    def _cached_alternative(self, kind, bin_db, replace_func, sort_func=None):
+        """ Return an alternative word form via the shared BÍN lookup cache.
+            The result depends only on the word, its position and the terminal,
+            in addition to the kind of alternative ('nom', 'indef' or 'canon'). """
+        return bincache.lookup(
+            (kind, self.text, self._at_start, self.td.terminal),
+            self.lookup_alternative,
+            bin_db,
+            replace_func,
+            sort_func,
+        )
+
     def _nominative(self, bin_db):
         """ Look up the nominative form of the word associated with this terminal """
         # Lookup the token in the BIN database
@@ -864,7 +1012,7 @@ class TerminalNode(Node):
         sort_func = None if self.has_variant("gr") else sort_by_gr
 
         # Lookup the same word stem but in the nominative case
-        w = self.lookup_alternative(bin_db, replace_beyging, sort_func=sort_func)
+        w = self._cached_alternative("nom", bin_db, replace_beyging, sort_func)
 
         if self.text.isupper():
             # Original word was all upper case: convert result to upper case
@@ -908,8 +1056,7 @@ class TerminalNode(Node):
             return b.replace("gr", "").replace("VB", "SB")
 
         # Lookup the same word stem but in the nominative case
-        w = self.lookup_alternative(bin_db, replace_beyging)
-        return w
+        return self._cached_alternative("indef", bin_db, replace_beyging)
 
     def _canonical(self, bin_db):
         """ Look up the singular indefinite nominative form of a noun
@@ -950,8 +1097,7 @@ class TerminalNode(Node):
             return b.replace("FT", "ET").replace("gr", "").replace("VB", "SB")
 
         # Lookup the same word stem but in the nominative case
-        w = self.lookup_alternative(bin_db, replace_beyging)
-        return w
+        return self._cached_alternative("canon", bin_db, replace_beyging)
 
     def root(self, state, params):
         """ Calculate the root form (stem) of this node's text """
@@ -998,6 +1144,10 @@ class TerminalNode(Node):
         result._tokentype = self.tokentype
         return result
 
+    def lazy_result(self, state):
+        """ A terminal result has no children, so it is simply constructed """
+        return self.process(state, None)
+
     def build_simple_tree(self, builder):
         """ Create a terminal node in a simple tree for this TerminalNode """
         d = dict(x=self.text, k=self.tokentype)
@@ -1032,6 +1182,8 @@ class PersonNode(TerminalNode):
 
     """ Specialized TerminalNode for person terminals """
 
+    __slots__ = ("fullnames",)
+
     def __init__(self, terminal, augmented_terminal, token, tokentype, aux, at_start):
         super().__init__(terminal, augmented_terminal, token, tokentype, aux, at_start)
         # Load the full names from the auxiliary JSON information
@@ -1065,7 +1217,7 @@ class PersonNode(TerminalNode):
         at_start = self._at_start
         name = []
         for part in self.text.split(" "):
-            w, m = bin_db.lookup_word(part, at_start)
+            w, m = bincache.lookup_word(part, at_start)
             at_start = False
             if m:
                 m = [
@@ -1112,14 +1264,25 @@ class NonterminalNode(Node):
 
     """ A Node corresponding to a nonterminal """
 
+    __slots__ = ("nt", "nt_base", "variants", "is_repeated")
+
+    # Cache of (base name, variants, is_repeated) tuples, keyed by nonterminal,
+    # shared between all nodes having the same nonterminal
+    _NT = dict()  # type: Dict[str, Tuple[str, FrozenSet[str], bool]]
+
     def __init__(self, nonterminal):
         super().__init__()
         self.nt = nonterminal
-        elems = nonterminal.split("_")
-        # Calculate the base name of this nonterminal (without variants)
-        self.nt_base = elems[0]
-        self.variants = set(elems[1:])
-        self.is_repeated = self.nt_base[-1] in _REPEAT_SUFFIXES
+        info = self._NT.get(nonterminal)
+        if info is None:
+            # Not found in cache: parse the nonterminal name
+            elems = nonterminal.split("_")
+            # Calculate the base name of this nonterminal (without variants),
+            # interned for fast lookup in processor dispatch tables
+            nt_base = sys.intern(elems[0])
+            info = (nt_base, frozenset(elems[1:]), nt_base[-1] in _REPEAT_SUFFIXES)
+            self._NT[nonterminal] = info
+        self.nt_base, self.variants, self.is_repeated = info
 
     def build_simple_tree(self, builder):
         builder.push_nonterminal(self.nt_base)
@@ -1168,6 +1331,24 @@ class NonterminalNode(Node):
         """ The canonical form of a nonterminal is a sequence of the canonical forms of its children (parameters) """
         return " ".join(p._canonical for p in params if p is not None and p._canonical)
 
+    def is_handled(self, dispatch):
+        """ Would processing this node invoke a handler in the given dispatch table? """
+        # Handlers are not invoked for epsilon nonterminals (i.e. with no children),
+        # or for repetition parents (X?, X* or X+)
+        return (
+            self.child is not None
+            and not self.is_repeated
+            and dispatch.handler(self.nt_base) is not None
+        )
+
+    def lazy_result(self, state):
+        """ Return a result for a subtree that contains no handled nonterminals.
+            Such a subtree has no user attributes, and its text and child
+            results are calculated only if and when they are requested. """
+        result = Result(self, state, LAZY_PARAMS)
+        result._nonterminal = self.nt
+        return result
+
     def process(self, state, params):
         """ Apply any requested processing to this node """
         result = Result(self, state, params)
@@ -1184,13 +1365,10 @@ class NonterminalNode(Node):
         if params and not self.is_repeated:
             # Don't invoke if this is an epsilon nonterminal (i.e. has no children),
             # or if this is a repetition parent (X?, X* or X+)
-            processor = state["processor"]
-            func = (
-                getattr(processor, self.nt_base, state["_default"])
-                if processor
-                else None
-            )
+            dispatch = state["_dispatch"]
+            func = dispatch.handler(self.nt_base)
             if func is not None:
+                t0 = perf_counter()
                 try:
                     func(self, params, result)
                 except TypeError as ex:
@@ -1198,6 +1376,7 @@ class NonterminalNode(Node):
                         .format(func.__qualname__, ex)
                     )
                     raise
+                dispatch.record(self.nt_base, perf_counter() - t0)
         return result
 
 
@@ -1361,6 +1540,10 @@ class TreeBase:
     def handle_T(self, n, s):
         """ Terminal """
         terminal, augmented_terminal, token, tokentype, aux, cat = self._parse_T(s)
+        self.push_terminal(n, terminal, augmented_terminal, token, tokentype, aux, cat)
+
+    def push_terminal(self, n, terminal, augmented_terminal, token, tokentype, aux, cat):
+        """ Add a terminal node into the tree at the right level """
         constructor = self._TC.get(cat, TerminalNode)
         self.push(
             n,
@@ -1394,6 +1577,53 @@ class TreeBase:
                 assert False, "*** No handler for {0}".format(line)
 
 
+class ForestLoader(ParseForestNavigator):
+
+    """ Builds the nodes of a tree directly from a parse forest. The result
+        is the same as when the text dump of the forest, as produced by
+        ParseForestDumper (without token dicts), is loaded with Tree.load(). """
+
+    def __init__(self, tree):
+        super().__init__(visit_all=True)  # Visit all nodes
+        self._tree = tree
+
+    def visit_token(self, level, w):
+        token = w.token
+        text = token.t1
+        # Word tokens have no auxiliary information in the text dump
+        if token.t0 == TOK.WORD:
+            tokentype = "WORD"
+            aux = ""
+        else:
+            tokentype = token.kind
+            aux = "" if token.t2 is None else json.dumps(token.t2, ensure_ascii=False)
+        terminal = w.terminal.name
+        self._tree.push_terminal(
+            level,
+            terminal,
+            terminal,
+            '"' + text + '"',
+            tokentype,
+            aux,
+            terminal.split("_", maxsplit=1)[0],
+        )
+        return None
+
+    def visit_nonterminal(self, level, w):
+        # Interior nodes do not become tree nodes
+        # and do not increment the nesting level
+        if not w.is_interior:
+            if w.is_empty and w.nonterminal.is_optional:
+                # Skip optional nodes that don't contain anything
+                return NotImplemented  # Don't visit child nodes
+            self._tree.handle_N(level, w.nonterminal.name)
+        return None
+
+    def visit_family(self, results, level, w, ix, prod):
+        if w.is_ambiguous:
+            raise ValueError("An ambiguous parse forest cannot be loaded as a tree")
+
+
 class Tree(TreeBase):
 
     """ A processable tree corresponding to a single parsed article """
@@ -1403,17 +1633,99 @@ class Tree(TreeBase):
         self.url = url
         self.authority = authority
 
+    def load_forest(self, n, forest):
+        """ Loads sentence n from an unambiguous (e.g. reduced) parse forest,
+            without going through the text format """
+        self.handle_S(n)
+        ForestLoader(self).go(forest)
+        self.handle_Q(0)
+
+    def _visit(self, state, node):
+        """ Visit the subtree rooted at node in post-order, obtaining results from
+            the children of each node and passing them to the node. Returns the
+            result for node, None if visit() pruned it, or _COLD for a subtree
+            that contains no handled nonterminals (if the processor has no
+            visit() function).
+
+            This is implemented with explicit stacks instead of recursion, so
+            that deep trees do not exhaust the Python call stack. The results
+            of child nodes are accumulated on a single value stack, from which
+            they are sliced off when their parent node is processed. """
+        visit = state["_visit"]
+        dispatch = state["_dispatch"]
+        # Value stack of results from child nodes that have been processed
+        results = []
+        # Stacks of nodes being visited, the start index of their children's
+        # results in the value stack, and the next child to visit
+        nodes = []
+        starts = []
+        nexts = []
+        c = node
+        while True:
+            if c is not None:
+                # Descend into the node c
+                if visit is not None and not visit(state, c):
+                    # The visit() function returned False: skip this node
+                    # and its children
+                    results.append(None)
+                elif c.child is not None:
+                    # Visit the children of c before processing it
+                    nodes.append(c)
+                    starts.append(len(results))
+                    nexts.append(c.child)
+                elif visit is not None:
+                    # Terminal or epsilon node
+                    results.append(c.process(state, []))
+                else:
+                    # A leaf is never handled
+                    results.append(_COLD)
+            elif not nodes:
+                # Back at the top: we're done
+                return results[0]
+            else:
+                # All children of the node at the top of the stack
+                # have been processed: process the node itself
+                n = nodes.pop()
+                nexts.pop()
+                start = starts.pop()
+                params = results[start:]
+                del results[start:]
+                if visit is None:
+                    hot = False
+                    for r in params:
+                        if r is not _COLD:
+                            hot = True
+                            break
+                    if not hot and not n.is_handled(dispatch):
+                        # Nobody is interested in this subtree:
+                        # don't build any results for it
+                        results.append(_COLD)
+                    else:
+                        if not hot or _COLD in params:
+                            ix = 0
+                            ch = n.child
+                            while ch is not None:
+                                if params[ix] is _COLD:
+                                    params[ix] = ch.lazy_result(state)
+                                ix += 1
+                                ch = ch.nxt
+                        results.append(n.process(state, params))
+                else:
+                    results.append(n.process(state, params))
+            # Move on to the next sibling, if any, of the node being visited
+            if not nexts:
+                c = None
+            else:
+                c = nexts[-1]
+                if c is not None:
+                    nexts[-1] = c.nxt
+
     def visit_children(self, state, node):
         """ Visit the children of node, obtain results from them and pass them to the node """
-        # First check whether the processor has a visit() method
-        visit = state["_visit"]
-        if visit is not None and not visit(state, node):
-            # Call the visit() method and if it returns False, we do not visit this node
-            # or its children
-            return None
-        return node.process(
-            state, [self.visit_children(state, child) for child in node.children()]
-        )
+        result = self._visit(state, node)
+        if result is _COLD:
+            result = node.lazy_result(state)
+        return result
 
     def process_sentence(self, state, tree):
         """ Process a single sentence tree """
@@ -1424,7 +1736,7 @@ class Tree(TreeBase):
         # if present in the processor
         sentence = state["_sentence"]
         if sentence is not None:
-            sentence(state, result)
+            state["_dispatch"].call("sentence", sentence, state, result)
 
     def process(self, session, processor, **kwargs):
         """ Process a tree for an entire article """
@@ -1432,13 +1744,10 @@ class Tree(TreeBase):
         # visiting each parent node after visiting its children
         # Initialize the running state that we keep between sentences
 
-        article_begin = getattr(processor, "article_begin", None) if processor else None
-        article_end = getattr(processor, "article_end", None) if processor else None
-        sentence = getattr(processor, "sentence", None) if processor else None
-        # If visit(state, node) returns False for a node, do not visit child nodes
-        visit = getattr(processor, "visit", None) if processor else None
-        # If no handler exists for a nonterminal, call default() instead
-        default = getattr(processor, "default", None) if processor else None
+        # Obtain the precompiled dispatch table for the processor module
+        dispatch = ProcessorDispatch.get(processor)
+        article_begin = dispatch.article_begin
+        article_end = dispatch.article_end
 
         with BIN_Db.get_db() as bin_db:
 
@@ -1448,9 +1757,12 @@ class Tree(TreeBase):
                 "bin_db": bin_db,
                 "url": self.url,
                 "authority": self.authority,
-                "_sentence": sentence,
-                "_visit": visit,
-                "_default": default,
+                "_dispatch": dispatch,
+                "_sentence": dispatch.sentence,
+                # If visit(state, node) returns False for a node, do not visit child nodes
+                "_visit": dispatch.visit,
+                # If no handler exists for a nonterminal, call default() instead
+                "_default": dispatch.default,
                 "index": 0,
             }
             # Add state parameters passed via keyword arguments, if any
@@ -1458,14 +1770,14 @@ class Tree(TreeBase):
 
             # Call the article_begin(state) function, if it exists
             if article_begin is not None:
-                article_begin(state)
+                dispatch.call("article_begin", article_begin, state)
             # Process the (parsed) sentences in the article
             for index, tree in self.s.items():
                 state["index"] = index
                 self.process_sentence(state, tree)
             # Call the article_end(state) function, if it exists
             if article_end is not None:
-                article_end(state)
+                dispatch.call("article_end", article_end, state)
 
 
 class TreeGist(TreeBase):
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Nearest-neighbour lookup benchmark
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility compares geo.SpatialIndex with a linear scan, i.e.
+    calculating geo.distance() to every point and sorting the list,
+    for point sets of the size of the petrol station list and of the
+    bus stop list, at random locations in Iceland. It also verifies
+    that both methods return the same points.
+
+    Usage:
+        python utils/geobench.py [-n lookups]
+
+"""
+
+import os
+import sys
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+if basepath.endswith("/utils") or basepath.endswith("\\utils"):
+    basepath = basepath[0:-6]
+    sys.path.append(basepath)
+
+import getopt
+import random
+import time
+
+from geo import SpatialIndex, distance
+
+
+# Bounding box of Iceland, (lat, lon)
+_SW = (63.3, -24.5)
+_NE = (66.6, -13.5)
+
+# Number of points in each benchmarked set: the petrol stations
+# and the bus stops, approximately
+_SIZES = (150, 1300)
+
+# Radius for the within() lookups, in km
+_RADIUS = 5.0
+
+
+def random_locations(n):
+    return [
+        (random.uniform(_SW[0], _NE[0]), random.uniform(_SW[1], _NE[1]))
+        for _ in range(n)
+    ]
+
+
+def linear_nearest(points, loc, k):
+    return sorted((distance(loc, p), p) for p in points)[0:k]
+
+
+def linear_within(points, loc, radius):
+    return sorted(t for t in ((distance(loc, p), p) for p in points) if t[0] <= radius)
+
+
+def benchmark(size, lookups):
+    """ Return the time per lookup for each method, in microseconds """
+    points = random_locations(size)
+    locs = random_locations(lookups)
+    index = SpatialIndex(points)
+    # Verify that the results are the same
+    for loc in locs[0:100]:
+        assert [p for _, p in index.nearest(loc, 3)] == [
+            p for _, p in linear_nearest(points, loc, 3)
+        ]
+        assert [p for _, p in index.within(loc, _RADIUS)] == [
+            p for _, p in linear_within(points, loc, _RADIUS)
+        ]
+    result = []
+    for func in (
+        lambda loc: linear_nearest(points, loc, 1),
+        lambda loc: index.nearest(loc, 1),
+        lambda loc: linear_within(points, loc, _RADIUS),
+        lambda loc: index.within(loc, _RADIUS),
+    ):
+        t0 = time.time()
+        for loc in locs:
+            func(loc)
+        t1 = time.time()
+        result.append(1.0e6 * (t1 - t0) / lookups)
+    return result
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts, _ = getopt.getopt(argv[1:], "n:", ["lookups="])
+    lookups = 1000
+    for o, a in opts:
+        if o in ("-n", "--lookups"):
+            lookups = int(a)
+    random.seed(1)
+    for size in _SIZES:
+        lin_nearest, ix_nearest, lin_within, ix_within = benchmark(size, lookups)
+        print(
+            "{0} points: nearest {1:.1f} us (scan) vs. {2:.1f} us (index), "
+            "within {3:.0f} km {4:.1f} us (scan) vs. {5:.1f} us (index)".format(
+                size,
+                lin_nearest,
+                ix_nearest,
+                _RADIUS,
+                lin_within,
+                ix_within,
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
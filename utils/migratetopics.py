@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Topic vector migration utility
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility migrates article topic vectors from the JSON text column
+    articles.topic_vector to the binary column articles.topic_vector_bin,
+    which it adds to the articles table if not already present.
+
+    Articles are converted in batches, each in its own transaction, so the
+    migration can be interrupted and resumed, and can run while the
+    database is in use: readers use the binary column if it is set, and
+    the JSON column otherwise (see db.models.unpack_topic_vector()).
+
+    With --clear-json, the JSON column is also set to NULL for the
+    converted articles, which frees the space (after a VACUUM). Finally,
+    the total size of each column is reported.
+
+    Usage:
+        python utils/migratetopics.py [-b batch_size] [--clear-json]
+
+"""
+
+import os
+import sys
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+if basepath.endswith("/utils") or basepath.endswith("\\utils"):
+    basepath = basepath[0:-6]
+    sys.path.append(basepath)
+
+import getopt
+
+from settings import Settings, ConfigError
+from db import SessionContext
+from db.models import Article, pack_topic_vector, unpack_topic_vector
+
+
+_ADD_COLUMN = "alter table articles add column if not exists topic_vector_bin bytea;"
+
+_COLUMN_SIZES = """
+    select
+        pg_size_pretty(sum(pg_column_size(topic_vector))),
+        pg_size_pretty(sum(pg_column_size(topic_vector_bin)))
+    from articles;
+"""
+
+
+def migrate(batch_size, clear_json):
+    """ Convert the JSON topic vectors of all articles, returning
+        the number of converted and of faulty topic vectors """
+    SessionContext.db.execute(_ADD_COLUMN)
+    converted = faulty = 0
+    last_url = ""
+    while True:
+        with SessionContext(commit=True) as session:
+            # Go through the articles in order of their primary key,
+            # so that faulty vectors that are left alone are not
+            # fetched again
+            q = session.query(
+                Article.url, Article.topic_vector_bin, Article.topic_vector
+            ).filter(Article.topic_vector != None).filter(Article.url > last_url)
+            if not clear_json:
+                q = q.filter(Article.topic_vector_bin == None)
+            batch = q.order_by(Article.url).limit(batch_size).all()
+            if not batch:
+                break
+            mappings = []
+            for url, tv_bin, tv_json in batch:
+                m = dict(url=url)
+                if not tv_bin:
+                    vec = unpack_topic_vector(None, tv_json)
+                    if vec is None:
+                        print("Faulty topic vector for article {0}".format(url))
+                        faulty += 1
+                        continue
+                    m["topic_vector_bin"] = pack_topic_vector(vec)
+                    converted += 1
+                if clear_json:
+                    m["topic_vector"] = None
+                mappings.append(m)
+            session.bulk_update_mappings(Article, mappings)
+            last_url = batch[-1][0]
+        print("{0} topic vectors converted".format(converted))
+    return converted, faulty
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts, _ = getopt.getopt(argv[1:], "b:", ["batch=", "clear-json"])
+    batch_size = 1000
+    clear_json = False
+    for o, a in opts:
+        if o in ("-b", "--batch"):
+            batch_size = int(a)
+        elif o == "--clear-json":
+            clear_json = True
+    try:
+        # Read configuration file
+        Settings.read(os.path.join(basepath, "config", "Greynir.conf"))
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        return 2
+    converted, faulty = migrate(batch_size, clear_json)
+    print(
+        "Migration completed: {0} topic vectors converted, {1} faulty".format(
+            converted, faulty
+        )
+    )
+    json_size, bin_size = SessionContext.db.execute(_COLUMN_SIZES).fetchone()
+    print("Size of topic_vector: {0}, topic_vector_bin: {1}".format(json_size, bin_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Query processor routing benchmark
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility parses the queries found in tests/test_queries.py and
+    compares the number of query processors that process each parse tree
+    when they are tried in turn until the owner of the tree is reached,
+    and when the tree is routed directly to its owner(s) by the matched
+    alternative of the Query nonterminal. It also measures the time spent
+    on the tree traversals that the routing avoids.
+
+    Usage:
+        python utils/querybench.py [-n rounds]
+
+"""
+
+import os
+import sys
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+if basepath.endswith("/utils") or basepath.endswith("\\utils"):
+    basepath = basepath[0:-6]
+    sys.path.append(basepath)
+
+import getopt
+import re
+import time
+
+from main import app
+from query import Query
+
+
+def test_queries():
+    """ Return the query strings used in tests/test_queries.py """
+    with open(
+        os.path.join(basepath, "tests", "test_queries.py"), "r", encoding="utf-8"
+    ) as f:
+        return re.findall(r'"q":\s*"([^"]+)"', f.read())
+
+
+def benchmark(queries, rounds):
+    """ Parse the queries and time the tree traversals by
+        non-owning processors that routing avoids """
+    trees = []
+    for q in queries:
+        query = Query(None, q, True, False, None, None)
+        if query.parse(dict()):
+            trees.append(query)
+    sequential = routed = 0
+    avoided = []
+    for query in trees:
+        owners = query.tree_processors()
+        routed += len(owners)
+        for p in Query._tree_processors:
+            sequential += 1
+            if p in owners:
+                break
+            avoided.append((query, p))
+    t0 = time.time()
+    for _ in range(rounds):
+        for query, p in avoided:
+            query._tree.process(None, p, query=query)
+    t1 = time.time()
+    return len(trees), sequential, routed, (t1 - t0) / rounds
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts, _ = getopt.getopt(argv[1:], "n:", ["rounds="])
+    rounds = 10
+    for o, a in opts:
+        if o in ("-n", "--rounds"):
+            rounds = int(a)
+    os.chdir(basepath)
+    with app.app_context():
+        Query.init_class()
+        queries = test_queries()
+        num_trees, sequential, routed, secs = benchmark(queries, rounds)
+    print(
+        "{0} queries, {1} parsed: {2:.2f} processors per tree in turn, "
+        "{3:.2f} when routed; {4:.2f} ms per tree saved".format(
+            len(queries),
+            num_trees,
+            sequential / num_trees if num_trees else 0.0,
+            routed / num_trees if num_trees else 0.0,
+            1000.0 * secs / num_trees if num_trees else 0.0,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
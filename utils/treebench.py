@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Tree loading and processing micro-benchmark
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility measures the time and peak memory consumption of
+    Tree.load() followed by Tree.process() for the tree processors
+    in the processors/ directory. The trees are either obtained by
+    parsing a text file, or loaded from the articles table in the
+    scraper database.
+
+    Usage:
+        python utils/treebench.py [-n rounds] [-a articles] [textfile]
+
+"""
+
+import os
+import sys
+
+# Hack to make this Python program executable from the utils subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+if basepath.endswith("/utils") or basepath.endswith("\\utils"):
+    basepath = basepath[0:-6]
+    sys.path.append(basepath)
+
+import getopt
+import importlib
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+from reynir import tokenize
+from reynir.incparser import IncrementalParser
+from reynir.fastparser import Fast_Parser, ParseForestDumper
+
+from tree import Tree
+from treeutil import TreeUtility
+from processor import modules_in_dir
+
+
+class SessionShim:
+
+    """ Shim (wrapper) that fakes an SQLAlchemy session class,
+        so that processors can be run without a database """
+
+    def execute(self, command):
+        pass
+
+    def add(self, row):
+        pass
+
+
+def trees_from_text(text):
+    """ Parse a text and return its trees in the text format
+        stored by the scraper """
+    toklist = tokenize(text)
+    fp = Fast_Parser(verbose=False)
+    ip = IncrementalParser(fp, toklist, verbose=False)
+    trees = OrderedDict()
+    num_sent = 0
+    for p in ip.paragraphs():
+        for sent in p.sentences():
+            num_sent += 1
+            if sent.parse():
+                token_dicts = TreeUtility.dump_tokens(sent.tokens, sent.tree)
+                tree = ParseForestDumper.dump_forest(sent.tree, token_dicts=token_dicts)
+                trees[num_sent] = "\n".join(
+                    ["C{0}".format(sent.score), "L{0}".format(len(sent)), tree]
+                )
+    return ["".join("S{0}\n{1}\n".format(key, val) for key, val in trees.items())]
+
+
+def trees_from_db(limit):
+    """ Load parsed article trees from the scraper database """
+    from db import SessionContext
+    from db.models import Article
+
+    with SessionContext(read_only=True) as session:
+        q = session.query(Article.tree).filter(Article.tree != None).limit(limit)
+        return [a.tree for a in q]
+
+
+def run(tree_strings, processors):
+    """ Load and process all trees with all processors """
+    session = SessionShim()
+    for tree_string in tree_strings:
+        tree = Tree()
+        tree.load(tree_string)
+        for p in processors:
+            tree.process(session, p)
+
+
+def benchmark(tree_strings, rounds):
+    """ Run the benchmark, returning the time per round
+        and the peak memory consumption during a round """
+    processors = [
+        importlib.import_module(modname) for modname in modules_in_dir("processors")
+    ]
+    processors = [p for p in processors if p.PROCESSOR_TYPE == "tree"]
+    # Warm-up round, filling the BÍN lookup caches
+    run(tree_strings, processors)
+    t0 = time.time()
+    for _ in range(rounds):
+        run(tree_strings, processors)
+    t1 = time.time()
+    tracemalloc.start()
+    run(tree_strings, processors)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (t1 - t0) / rounds, peak
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts, args = getopt.getopt(argv[1:], "n:a:", ["rounds=", "articles="])
+    rounds = 10
+    articles = 0
+    for o, a in opts:
+        if o in ("-n", "--rounds"):
+            rounds = int(a)
+        elif o in ("-a", "--articles"):
+            articles = int(a)
+    if not articles and not args:
+        print(__doc__)
+        return 2
+    os.chdir(basepath)
+    # Avoid processor output cluttering the benchmark results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        if articles:
+            tree_strings = trees_from_db(articles)
+        else:
+            with open(args[0], "r", encoding="utf-8") as f:
+                tree_strings = trees_from_text(f.read())
+        secs, peak = benchmark(tree_strings, rounds)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(
+        "{0} tree(s), {1} round(s): {2:.3f} seconds per round, "
+        "peak memory {3:.1f} KB".format(len(tree_strings), rounds, secs, peak / 1024.0)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
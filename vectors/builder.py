@@ -46,6 +46,14 @@
     4) Generation of the LSI lower-dimensionality model (matrix) from the corpus
         after transformation of each document through the TFIDF vector
 
+    When the model is built, the words table is exported once, using COPY,
+    and split into shard files, each containing the bags-of-words of a
+    range of articles. Stages 2) and 3) are then run on the shards in
+    parallel: a dictionary is built for each shard, and the shard
+    dictionaries are merged; then each shard is transformed into TFIDF
+    vectors, written as a part of a single Matrix Market corpus file,
+    from which the LSI model is trained in one pass, in chunks.
+
     After the LSI model has been generated, it can be used to calculate LSI
     vectors for any set of words. We calculate such vectors for each topic
     in the topics database table by using the topic keywords as input for each
@@ -53,19 +61,42 @@
     estimated by calculating the cosine similarity between the article's LSI
     vector and the topic's LSI vector.
 
+    Articles can be tagged in batches (the --batch option), optionally
+    in several processes at once. For each batch, the words of all its
+    articles are fetched in one query, the bags-of-words are transformed
+    through the TFIDF and LSI models together, the similarities to all
+    topics are calculated in one matrix product, and the results are
+    written to the database in bulk.
+
 """
 
+from typing import DefaultDict, Dict, List, Tuple
+
+import os
 import sys
+import csv
 import getopt
 import json
+import shutil
 import time
-from datetime import datetime
-from collections import defaultdict
+import threading
+from datetime import datetime, timedelta
+from collections import defaultdict, OrderedDict
+from multiprocessing import Pool, cpu_count
+
+from sqlalchemy import bindparam
 
 from settings import Settings, Topics, NoIndexWords
 from db import SessionContext
-from db.models import Article, Topic, ArticleTopic, Word
-from db.queries import TermTopicsQuery
+from db.models import (
+    Article,
+    Topic,
+    ArticleTopic,
+    Word,
+    pack_topic_vector,
+    unpack_topic_vector,
+)
+from db.queries import TermTopicsQuery, FrequentTermsQuery
 from similar import SimilarityClient
 
 import numpy as np
@@ -77,6 +108,81 @@ def w_from_stem(stem, cat):
     return stem.lower().replace("-", "").replace(" ", "_") + "/" + cat
 
 
+def clean_stem_hyphens(stem):
+    """ Eliminate composite word hyphens from the stem """
+    if "- og " in stem or "- eða " in stem:
+        # Leave 'iðnaðar- og viðskiptaráðuneyti' alone
+        return stem
+    # We want to keep other types of hyphens (surrounded by spaces)
+    # such as 'Vestur - Íslendingar'
+    a = stem.split(" - ")
+    return " - ".join(p.replace("-", "") for p in a)
+
+
+# Value returned by TermVectorCache.get() for terms that are not cached
+_NOT_CACHED = object()
+
+
+class TermVectorCache:
+
+    """ A thread-safe LRU cache of term vectors, i.e. the average topic
+        vectors of the articles where a (stem, cat) term appears, or None
+        if it appears in no article with a topic vector. Entries expire
+        after a time to live. Clearing the cache starts a new generation,
+        and values that were computed before that are not stored. """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Map of (stem, cat) to (expiration time, vector) tuples
+        self._cache = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Return the cached vector for the key, or _NOT_CACHED """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] < now:
+                # Expired: remove the entry
+                del self._cache[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return _NOT_CACHED
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, vector, generation):
+        """ Cache a vector that was computed in the given generation """
+        with self._lock:
+            if generation != self.generation:
+                # The cache was cleared while the vector was being computed
+                return
+            self._cache[key] = (time.monotonic() + self.ttl, vector)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.generation += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._cache),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+
 class CorpusIterator:
 
     """ Iterate through the Greynir words database, yielding a bag-of-words
@@ -149,6 +255,31 @@ class ReynirCorpus:
     _LSI_MODEL_FILE = "./models/lsi-{0}.model"
     _LDA_MODEL_FILE = "./models/lda-{0}.model"
 
+    # Export of the words table, and the bag-of-words and
+    # TFIDF corpus shard files made from it, while building a model
+    _WORDS_EXPORT_FILE = "./models/words.csv"
+    _BAGS_SHARD_FILE = "./models/bags-{0}.jsonl"
+    _TFIDF_SHARD_FILE = "./models/corpus-tfidf-{0}.mm.part"
+
+    # Number of articles per corpus shard
+    _SHARD_ARTICLES = 20000
+
+    # Number of documents that the LSI model is updated with at a time:
+    # larger chunks are faster but take more memory
+    _LSI_CHUNK_SIZE = 40000
+
+    # Number of articles whose topic vectors are averaged into a term vector
+    _TERM_ARTICLES = 25
+
+    # Maximum number of cached term vectors, and their time to live in seconds
+    _TERM_CACHE_SIZE = 10000
+    _TERM_CACHE_TTL = 3600.0
+
+    # Term vectors are precomputed for this number of the most frequent
+    # person and entity names in articles from the given number of days
+    _TERM_PRECOMPUTE_COUNT = 500
+    _TERM_PRECOMPUTE_DAYS = 30
+
     def __init__(self, verbose=False, dimensions=None):
         self._verbose = verbose
         self._dictionary = None
@@ -156,7 +287,13 @@ class ReynirCorpus:
         self._model = None
         self._model_name = None
         self._topics = None
+        # Topic ids, normalized topic vectors and thresholds,
+        # for batched topic assignment
+        self._topic_matrix = None
         self._dimensions = dimensions or ReynirCorpus._DEFAULT_DIMENSIONS
+        self._term_vectors = TermVectorCache(
+            self._TERM_CACHE_SIZE, self._TERM_CACHE_TTL
+        )
 
     @property
     def dimensions(self):
@@ -176,6 +313,149 @@ class ReynirCorpus:
         """ Load a dictionary from a previously prepared file """
         self._dictionary = ReynirDictionary.load(self._DICTIONARY_FILE)
 
+    def export_words(self):
+        """ Export the words table, sorted by article, to a CSV file
+            using COPY, which is much faster than fetching the rows
+            through a query """
+        print("Exporting words table")
+        with SessionContext(commit=True, read_only=True) as session:
+            cursor = session.connection().connection.cursor()
+            with open(self._WORDS_EXPORT_FILE, "w", encoding="utf-8", newline="") as f:
+                cursor.copy_expert(
+                    "copy (select article_id, stem, cat, cnt from words "
+                    "order by article_id) to stdout with (format csv)",
+                    f,
+                )
+
+    def split_words(self):
+        """ Split the exported words into shard files of _SHARD_ARTICLES
+            articles each, with one line per article containing a JSON list
+            of its [word, count] pairs, and delete the export. Returns the
+            list of the numbers of articles in the shards. """
+        print("Splitting words into shards")
+        shards = []  # type: List[int]
+        # Map of (stem, cat) to bag-of-words key, since
+        # the same words occur in many articles
+        keys = dict()  # type: Dict[Tuple[str, str], str]
+        out = None
+        with open(self._WORDS_EXPORT_FILE, "r", encoding="utf-8", newline="") as f:
+            bag = []  # type: List[List]
+            last_uuid = None
+            for uuid, stem, cat, cnt in csv.reader(f):
+                if uuid != last_uuid:
+                    if bag:
+                        out.write(json.dumps(bag, ensure_ascii=False))
+                        out.write("\n")
+                        bag = []
+                    if not shards or shards[-1] == self._SHARD_ARTICLES:
+                        if out is not None:
+                            out.close()
+                        out = open(
+                            self._BAGS_SHARD_FILE.format(len(shards)),
+                            "w",
+                            encoding="utf-8",
+                        )
+                        shards.append(0)
+                    shards[-1] += 1
+                    last_uuid = uuid
+                w = keys.get((stem, cat))
+                if w is None:
+                    w = keys[(stem, cat)] = w_from_stem(stem, cat)
+                bag.append([w, int(cnt)])
+            if bag:
+                out.write(json.dumps(bag, ensure_ascii=False))
+                out.write("\n")
+        if out is not None:
+            out.close()
+        os.remove(self._WORDS_EXPORT_FILE)
+        return shards
+
+    def create_sharded_dictionary(self, shards, pool):
+        """ Create a fresh Gensim dictionary by merging
+            the dictionaries of the corpus shards """
+        dic = ReynirDictionary(None)
+        for shard_dic in pool.imap(_shard_dictionary, range(len(shards))):
+            dic.merge_with(shard_dic)
+        # Drop words that only occur only once or twice in the entire set
+        dic.filter_extremes(no_below=3, keep_n=None)
+        dic.save(self._DICTIONARY_FILE)
+        self._dictionary = dic
+
+    def create_sharded_tfidf_corpus(self, shards, pool):
+        """ Create a TFIDF corpus from the corpus shards, whose parts are
+            written in parallel and then concatenated into a single
+            Matrix Market file. The dictionary and the TFIDF model
+            must have been created. """
+        offsets = np.cumsum([0] + shards[0:-1]).tolist()
+        nnz = sum(pool.map(_shard_tfidf_corpus, list(enumerate(offsets))))
+        # An index of a previous corpus would not match this one;
+        # the corpus is read sequentially, without an index
+        index_file = self._TFIDF_CORPUS_FILE + ".index"
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        with open(self._TFIDF_CORPUS_FILE, "wb") as f:
+            f.write(matutils.MmWriter.HEADER_LINE)
+            f.write(
+                "{0} {1} {2}\n".format(sum(shards), len(self._dictionary), nnz).encode(
+                    "ascii"
+                )
+            )
+            for ix in range(len(shards)):
+                part = self._TFIDF_SHARD_FILE.format(ix)
+                with open(part, "rb") as pf:
+                    shutil.copyfileobj(pf, f)
+                os.remove(part)
+                os.remove(self._BAGS_SHARD_FILE.format(ix))
+
+    def bags_shard(self, ix):
+        """ Iterate through the bags-of-words of the articles in a shard,
+            as lists of [word, count] pairs """
+        with open(self._BAGS_SHARD_FILE.format(ix), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def shard_dictionary(self, ix):
+        """ Return a Gensim dictionary of a corpus shard """
+        dic = ReynirDictionary(None)
+        for bag in self.bags_shard(ix):
+            doc = []
+            for w, cnt in bag:
+                if cnt == 1:
+                    doc.append(w)
+                else:
+                    doc.extend([w] * cnt)
+            dic.doc2bow(doc, allow_update=True)
+        return dic
+
+    def write_tfidf_shard(self, ix, offset):
+        """ Write the TFIDF vectors of the articles in a corpus shard in
+            Matrix Market format, without a header, numbering the articles
+            from the given offset. Returns the number of nonzero entries. """
+        if self._dictionary is None:
+            self.load_dictionary()
+        if self._tfidf is None:
+            self.load_tfidf_model()
+        token2id = self._dictionary.token2id
+        nnz = 0
+        with open(self._TFIDF_SHARD_FILE.format(ix), "w", encoding="ascii") as f:
+            for docno, bag in enumerate(self.bags_shard(ix), start=offset + 1):
+                counts = defaultdict(int)  # type: DefaultDict[int, int]
+                for w, cnt in bag:
+                    wid = token2id.get(w)
+                    if wid is not None:
+                        counts[wid] += cnt
+                # Skip near-zero entries, as gensim's MmWriter does
+                vector = sorted(
+                    (wid, weight)
+                    for wid, weight in self._tfidf[list(counts.items())]
+                    if abs(weight) > 1e-12
+                )
+                for wid, weight in vector:
+                    # Matrix Market indices start at 1
+                    f.write("{0} {1} {2}\n".format(docno, wid + 1, weight))
+                nnz += len(vector)
+        return nnz
+
     def create_plain_corpus(self):
         """ Create a plain vector corpus, where each vector represents a
             document. Each element of the vector contains the count of
@@ -362,93 +642,68 @@ class ReynirCorpus:
         term_weights = []
 
         # We have missing words: look'em up
-        with SessionContext(commit=True, read_only=True) as session:
-            # The same (stem, cat) tuple may appear multiple times:
-            # coalesce into one counting dictionary
-
-            for index, (stem, cat) in enumerate(terms):
-
-                def word_lookup_weight(stem, cat):
-                    """ Does this term call for a lookup in the words database table? """
-                    if cat == "entity" or cat.startswith("person"):
-                        # We look up all entity and person names
-                        # and give them extra weight
-                        return 2.0
-                    if cat in {"kk", "kvk", "hk"} and stem[0].isupper() and index > 0:
-                        # Noun starting with a capital letter, not the first word in a sentence:
-                        # assume it's a proper name and do a lookup with a weight of 1.6
-                        return 1.6
-                    w = w_from_stem(stem, cat)
-                    if isinstance(self._dictionary, ReynirDictionary):
-                        in_dict = w in self._dictionary
-                    else:
-                        # !!! TODO: This else-branch can be removed once a new
-                        # !!! ReynirDictionary has been built and pickled
-                        in_dict = w in self._dictionary.token2id
-                    # Without further reason, we don't look up terms that already
-                    # exist in the LSI model dictionary. For other terms, they
-                    # appear to be rare and we give them a slight overweight if
-                    # they are found in the words table.
-                    return 0.0 if in_dict else 1.2
-
-                weight = word_lookup_weight(stem, cat)
-
-                if weight == 0.0:
-                    # If weight is 0.0, we don't need to bother
-                    # (This means that the word is in the LSI model dictionary
-                    # and not special in any way. From the overall search term
-                    # point of view, we give it a weight of 1.0)
-                    term_weights.append(1.0)
-                    continue
-
-                if (
-                    cat in NoIndexWords.CATEGORIES_TO_INDEX
-                    and (stem, cat) not in NoIndexWords.SET
-                ):
-                    # We have a significant (potentially indexable)
-                    # person, entity, noun, adjective or verb. Give it
-                    # a weight in the final topic vector.
-
-                    def clean(stem):
-                        """ Eliminate composite word hyphens from the stem """
-                        if "- og " in stem or "- eða " in stem:
-                            # Leave 'iðnaðar- og viðskiptaráðuneyti' alone
-                            return stem
-                        # We want to keep other types of hyphens (surrounded by spaces)
-                        # such as 'Vestur - Íslendingar'
-                        a = stem.split(" - ")
-                        return " - ".join(p.replace("-", "") for p in a)
-
-                    clean_stem = clean(stem)
-                    q = TermTopicsQuery().execute(
-                        session, stem=clean_stem, cat=cat, limit=25
-                    )
-                    term_vector = np.zeros(self._dimensions)
-                    total_cnt = 0
-                    # Sum up the topic vectors of the documents where the term
-                    # appears, weighted by the number of times it appears
-                    # print("Found stem/cat '{0}'/{1} in {2} documents via words table".format(clean_stem, cat, len(q)))
-                    for tv_json, cnt in q:
-                        # Get the term vector of a single document where the term appears
-                        if tv_json and cnt:
-                            tv = np.array(json.loads(tv_json))
-                            # Multiply the vector by the number of times the term appears
-                            total_cnt += cnt
-                            term_vector += tv * cnt
-                    # Add the combined (weighted average) topic vector of the
-                    # term to the 'missing' topic vector
-                    if total_cnt > 0:
-                        missing += (term_vector / total_cnt) * weight
-                        # Keep track of how many 'missing' terms have contributed
-                        # to the missing term vector
-                        weight_missing += weight
-                        term_weights.append(weight)
-                    else:
-                        # Not found in the words table: this term contributes nothing
-                        term_weights.append(0.0)
+        # The same (stem, cat) tuple may appear multiple times:
+        # coalesce into one counting dictionary
+
+        for index, (stem, cat) in enumerate(terms):
+
+            def word_lookup_weight(stem, cat):
+                """ Does this term call for a lookup in the words database table? """
+                if cat == "entity" or cat.startswith("person"):
+                    # We look up all entity and person names
+                    # and give them extra weight
+                    return 2.0
+                if cat in {"kk", "kvk", "hk"} and stem[0].isupper() and index > 0:
+                    # Noun starting with a capital letter, not the first word in a sentence:
+                    # assume it's a proper name and do a lookup with a weight of 1.6
+                    return 1.6
+                w = w_from_stem(stem, cat)
+                if isinstance(self._dictionary, ReynirDictionary):
+                    in_dict = w in self._dictionary
                 else:
-                    # print("Discarding term {0} (weight {1:.1f})".format(w_from_stem(stem, cat), weight))
+                    # !!! TODO: This else-branch can be removed once a new
+                    # !!! ReynirDictionary has been built and pickled
+                    in_dict = w in self._dictionary.token2id
+                # Without further reason, we don't look up terms that already
+                # exist in the LSI model dictionary. For other terms, they
+                # appear to be rare and we give them a slight overweight if
+                # they are found in the words table.
+                return 0.0 if in_dict else 1.2
+
+            weight = word_lookup_weight(stem, cat)
+
+            if weight == 0.0:
+                # If weight is 0.0, we don't need to bother
+                # (This means that the word is in the LSI model dictionary
+                # and not special in any way. From the overall search term
+                # point of view, we give it a weight of 1.0)
+                term_weights.append(1.0)
+                continue
+
+            if (
+                cat in NoIndexWords.CATEGORIES_TO_INDEX
+                and (stem, cat) not in NoIndexWords.SET
+            ):
+                # We have a significant (potentially indexable)
+                # person, entity, noun, adjective or verb. Give it
+                # a weight in the final topic vector.
+
+                clean_stem = clean_stem_hyphens(stem)
+                term_vector = self.term_vector(clean_stem, cat)
+                # Add the combined (weighted average) topic vector of the
+                # term to the 'missing' topic vector
+                if term_vector is not None:
+                    missing += term_vector * weight
+                    # Keep track of how many 'missing' terms have contributed
+                    # to the missing term vector
+                    weight_missing += weight
+                    term_weights.append(weight)
+                else:
+                    # Not found in the words table: this term contributes nothing
                     term_weights.append(0.0)
+            else:
+                # print("Discarding term {0} (weight {1:.1f})".format(w_from_stem(stem, cat), weight))
+                term_weights.append(0.0)
 
         assert len(terms) == len(term_weights)
 
@@ -463,6 +718,60 @@ class ReynirCorpus:
 
         return topic_vector, term_weights
 
+    def term_vector(self, stem, cat):
+        """ Return the average topic vector of the most recent articles where
+            the given term appears, weighted by the number of times it
+            appears in each, or None if it appears in no article having a
+            topic vector. Term vectors are cached. """
+        key = (stem, cat)
+        vector = self._term_vectors.get(key)
+        if vector is not _NOT_CACHED:
+            return vector
+        generation = self._term_vectors.generation
+        with SessionContext(commit=True, read_only=True) as session:
+            q = TermTopicsQuery().execute(
+                session, stem=stem, cat=cat, limit=self._TERM_ARTICLES
+            )
+        term_vector = np.zeros(self._dimensions)
+        total_cnt = 0
+        # Sum up the topic vectors of the documents where the term
+        # appears, weighted by the number of times it appears
+        for tv_bin, tv_json, cnt in q:
+            # Get the term vector of a single document where the term appears
+            tv = unpack_topic_vector(tv_bin, tv_json) if cnt else None
+            if tv is not None and len(tv) == self._dimensions:
+                # Multiply the vector by the number of times the term appears
+                total_cnt += cnt
+                term_vector += tv * cnt
+        vector = None
+        if total_cnt > 0:
+            vector = term_vector / total_cnt
+            # The vector is shared by all callers
+            vector.setflags(write=False)
+        self._term_vectors.put(key, vector, generation)
+        return vector
+
+    def refresh_term_vectors(self):
+        """ Clear the term vector cache, as article topic vectors have changed,
+            and compute the vectors of the most frequent person and entity
+            names in recent articles """
+        self._term_vectors.clear()
+        t0 = time.time()
+        since = datetime.utcnow() - timedelta(days=self._TERM_PRECOMPUTE_DAYS)
+        with SessionContext(commit=True, read_only=True) as session:
+            q = FrequentTermsQuery().execute(
+                session,
+                since=since,
+                cats=("person_kk", "person_kvk", "entity"),
+                limit=self._TERM_PRECOMPUTE_COUNT,
+            )
+        for stem, cat, _ in q:
+            self.term_vector(clean_stem_hyphens(stem), cat)
+        t1 = time.time()
+        print(
+            "Precomputed {0} term vectors in {1:.2f} seconds".format(len(q), t1 - t0)
+        )
+
     def assign_article_topics(self, article_id, heading, process_all=False):
         """ Assign the appropriate topics to the given article in the database """
         if self._dictionary is None:
@@ -528,14 +837,133 @@ class ReynirCorpus:
             if a is not None:
                 a.indexed = datetime.utcnow()
                 if article_vector:
-                    # Store a pure list of floats
+                    # Store the floats in binary form
                     topic_vector = [t[1] for t in article_vector]
-                    a.topic_vector = json.dumps(topic_vector)
+                    a.topic_vector_bin = pack_topic_vector(topic_vector)
                 else:
-                    a.topic_vector = None
-
-    def assign_topics(self, limit=None, process_all=False, uuid=None):
-        """ Assign topics to all articles that have no such assignment yet """
+                    a.topic_vector_bin = None
+                # The JSON column has been superseded by the binary one
+                a.topic_vector = None
+
+    def _load_topic_matrix(self):
+        """ Create a matrix of the normalized topic vectors, one row per
+            topic, along with lists of the topic ids and names and an array
+            of the similarity thresholds """
+        dims = self._model.num_topics
+        ids = []
+        names = []
+        matrix = np.zeros((len(self._topics), dims), dtype=np.float32)
+        thresholds = np.zeros(len(self._topics), dtype=np.float32)
+        for row, (topic_id, topic_info) in enumerate(self._topics.items()):
+            ids.append(topic_id)
+            names.append(topic_info["name"])
+            matrix[row] = matutils.sparse2full(topic_info["vector"], dims)
+            thresholds[row] = topic_info["threshold"]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1.0e-6)
+        self._topic_matrix = (ids, names, matrix, thresholds)
+
+    def assign_topics_batch(self, articles, process_all=False):
+        """ Assign the appropriate topics to a batch of articles, given
+            as a list of (article_id, heading) tuples, in the database.
+            The result is the same as that of assign_article_topics()
+            for each article. Returns the number of articles. """
+        if self._dictionary is None:
+            self.load_dictionary()
+        if self._tfidf is None:
+            self.load_tfidf_model()
+        if self._model is None:
+            self.load_lsi_model()
+        if self._topics is None:
+            self.load_topics()
+        if self._topic_matrix is None:
+            self._load_topic_matrix()
+        topic_ids, topic_names, topic_matrix, thresholds = self._topic_matrix
+        article_ids = [article_id for article_id, _ in articles]
+        wlists = {article_id: [] for article_id in article_ids}
+        with SessionContext(commit=True, read_only=True) as session:
+            # Fetch the words of all articles in the batch at once
+            q = session.query(Word.article_id, Word.stem, Word.cat, Word.cnt).filter(
+                Word.article_id.in_(article_ids)
+            )
+            for article_id, stem, cat, cnt in q:
+                # Convert stem to lowercase and replace spaces with underscores
+                w = w_from_stem(stem, cat)
+                if cnt == 1:
+                    wlists[article_id].append(w)
+                else:
+                    wlists[article_id].extend([w] * cnt)
+        if self._topics:
+            bags = [self._dictionary.doc2bow(wlists[a]) for a in article_ids]
+            # Transform the bags through the TFIDF and LSI models together,
+            # into a matrix with one row per article
+            vectors = matutils.corpus2dense(
+                self._model[self._tfidf[bags]],
+                num_terms=self._model.num_topics,
+                num_docs=len(bags),
+            ).T
+            norms = np.linalg.norm(vectors, axis=1)
+            # The cosine similarity of each article to each topic
+            similarities = (vectors / np.maximum(norms, 1.0e-6)[:, None]) @ topic_matrix.T
+        else:
+            # No topics: no topic vectors either, as in assign_article_topics()
+            norms = np.zeros(len(article_ids))
+        atopics = []
+        updates = []
+        now = datetime.utcnow()
+        for ix, (article_id, heading) in enumerate(articles):
+            if norms[ix] == 0.0:
+                # No words in the dictionary
+                updates.append(dict(aid=article_id, indexed=now, tv=None))
+                continue
+            if self._verbose:
+                print("{0} : {1}".format(article_id, heading))
+                for name, similarity in zip(topic_names, similarities[ix]):
+                    print(
+                        "   Similarity to topic {0} is {1:.3f}".format(name, similarity)
+                    )
+            found = np.flatnonzero(similarities[ix] >= thresholds)
+            atopics.extend(
+                dict(article_id=article_id, topic_id=topic_ids[t]) for t in found
+            )
+            if len(found) and not process_all:
+                print(
+                    "Article '{0}':\n   topics {1}".format(
+                        heading,
+                        [(topic_names[t], float(similarities[ix, t])) for t in found],
+                    )
+                )
+            updates.append(
+                dict(aid=article_id, indexed=now, tv=pack_topic_vector(vectors[ix]))
+            )
+        with SessionContext(commit=True) as session:
+            # Replace the previous topics (if any) of the articles
+            session.execute(
+                ArticleTopic.table()
+                .delete()
+                .where(ArticleTopic.article_id.in_(article_ids))
+            )
+            if atopics:
+                session.bulk_insert_mappings(ArticleTopic, atopics)
+            # Update the indexed timestamp and the topic vector of the articles
+            session.execute(
+                Article.__table__.update()
+                .where(Article.id == bindparam("aid"))
+                .values(
+                    indexed=bindparam("indexed"),
+                    topic_vector_bin=bindparam("tv"),
+                    topic_vector=None,
+                ),
+                updates,
+            )
+        return len(articles)
+
+    def assign_topics(
+        self, limit=None, process_all=False, uuid=None, batch_size=None, processes=1
+    ):
+        """ Assign topics to all articles that have no such assignment yet.
+            If batch_size is given, the articles are processed in batches
+            of that size, distributed over the given number of processes. """
         with SessionContext(commit=True) as session:
             # Fetch articles that haven't been indexed (or have been parsed since),
             # and that have at least one associated Word in the words table.
@@ -553,11 +981,82 @@ class ReynirCorpus:
                 q = q.yield_per(2000)
             else:
                 q = q[0:limit]
-        for article_id, heading in q:
-            self.assign_article_topics(article_id, heading, process_all=process_all)
+            if batch_size:
+                # Fetch the list of articles before any worker processes start
+                articles = list(q)
+        if not batch_size:
+            for article_id, heading in q:
+                self.assign_article_topics(article_id, heading, process_all=process_all)
+            return
+        batches = [
+            articles[i : i + batch_size] for i in range(0, len(articles), batch_size)
+        ]
+        print(
+            "Tagging {0} articles in {1} batches".format(len(articles), len(batches))
+        )
+        if processes <= 1 or len(batches) <= 1:
+            for batch in batches:
+                self.assign_topics_batch(batch, process_all=process_all)
+            return
+        pool = Pool(
+            processes,
+            initializer=_init_tagging_process,
+            initargs=(self._verbose, self._dimensions),
+        )
+        try:
+            cnt = 0
+            for n in pool.imap_unordered(
+                _tag_batch, [(batch, process_all) for batch in batches]
+            ):
+                cnt += n
+                print("{0} articles tagged".format(cnt))
+        finally:
+            pool.close()
+            pool.join()
+
+
+# The corpus instance of each tagging process
+_tagging_corpus = None
+
+
+def _init_tagging_process(verbose, dimensions):
+    """ Initialize a process in the tagging pool """
+    global _tagging_corpus
+    # Don't share the parent process' database connections
+    SessionContext.cleanup()
+    _tagging_corpus = ReynirCorpus(verbose=verbose, dimensions=dimensions)
+
+
+def _tag_batch(args):
+    """ Tag a batch of articles in a process of the tagging pool """
+    batch, process_all = args
+    return _tagging_corpus.assign_topics_batch(batch, process_all=process_all)
+
 
+# The corpus used by a process in the model building pool
+_building_corpus = None
 
-def build_model(verbose=False):
+
+def _init_building_process(verbose):
+    """ Initialize a process in the model building pool """
+    global _building_corpus
+    _building_corpus = ReynirCorpus(verbose=verbose)
+
+
+def _shard_dictionary(ix):
+    """ Create the dictionary of a corpus shard in a process
+        of the model building pool """
+    return _building_corpus.shard_dictionary(ix)
+
+
+def _shard_tfidf_corpus(args):
+    """ Write the TFIDF vectors of a corpus shard in a process
+        of the model building pool """
+    ix, offset = args
+    return _building_corpus.write_tfidf_shard(ix, offset)
+
+
+def build_model(verbose=False, processes=1, distributed=False):
     """ Build a new model from the words (and articles) table """
 
     print("------ Greynir starting model build -------")
@@ -567,17 +1066,30 @@ def build_model(verbose=False):
     t0 = time.time()
 
     rc = ReynirCorpus(verbose=verbose)
-    print("Creating dictionary")
-    rc.create_dictionary()
-    print("Creating plain corpus")
-    rc.create_plain_corpus()
-    print("Creating TF-IDF model")
-    rc.create_tfidf_model()
-    print("Creating TF-IDF corpus")
-    rc.create_tfidf_corpus()
+    rc.export_words()
+    shards = rc.split_words()
+    if not shards:
+        print("The words table is empty: no model built")
+        return
+    print(
+        "Processing {0} articles in {1} shards, {2} processes".format(
+            sum(shards), len(shards), processes
+        )
+    )
+    with Pool(processes, _init_building_process, (verbose,)) as pool:
+        print("Creating dictionary")
+        rc.create_sharded_dictionary(shards, pool)
+        print("Creating TF-IDF model")
+        rc.create_tfidf_model()
+        print("Creating TF-IDF corpus")
+        rc.create_sharded_tfidf_corpus(shards, pool)
     # rc.create_lda_model(passes = 15)
     print("Creating LSI model")
-    rc.create_lsi_model()
+    # With distributed=True, gensim distributes the LSI training to
+    # its workers, which must be running (see gensim.models.lsi_dispatcher)
+    rc.create_lsi_model(
+        chunksize=ReynirCorpus._LSI_CHUNK_SIZE, distributed=distributed
+    )
 
     t1 = time.time()
 
@@ -597,7 +1109,9 @@ def calculate_topics(verbose=False):
     print("------ Greynir recalculation complete -------")
 
 
-def tag_articles(limit, verbose=False, process_all=False, uuid=None):
+def tag_articles(
+    limit, verbose=False, process_all=False, uuid=None, batch_size=None, processes=1
+):
     """ Tag all untagged articles or articles that
         have been parsed since they were tagged """
 
@@ -608,6 +1122,8 @@ def tag_articles(limit, verbose=False, process_all=False, uuid=None):
         print("Processing all articles")
     elif limit:
         print("Limit: {0} articles".format(limit))
+    if batch_size and not uuid:
+        print("Batches of {0} articles, {1} processes".format(batch_size, processes))
     ts = "{0}".format(datetime.utcnow())[0:19]
     print("Time: {0}".format(ts))
 
@@ -615,7 +1131,7 @@ def tag_articles(limit, verbose=False, process_all=False, uuid=None):
 
     rc = ReynirCorpus(verbose=verbose)
     rc.load_lsi_model()
-    rc.assign_topics(limit, process_all, uuid)
+    rc.assign_topics(limit, process_all, uuid, batch_size, processes)
 
     t1 = time.time()
 
@@ -653,6 +1169,11 @@ __doc__ = """
         -h, --help       : Show this help text
         -l N, --limit=N  : Limit processing to N articles
         -a, --all        : Process all articles
+        -b N, --batch=N  : Tag articles in batches of N
+        -p N, --processes=N : Number of processes for batches and
+                           for building a model (default: number of CPUs)
+        --distributed    : Train the LSI model on gensim's distributed
+                           workers when building a model
         -v, --verbose    : Show diagnostics while processing
 
     Commands:
@@ -670,7 +1191,18 @@ def _main(argv=None):
     try:
         try:
             opts, args = getopt.getopt(
-                argv[1:], "hl:van", ["help", "limit=", "verbose", "all", "notify"]
+                argv[1:],
+                "hl:vanb:p:",
+                [
+                    "help",
+                    "limit=",
+                    "verbose",
+                    "all",
+                    "notify",
+                    "batch=",
+                    "processes=",
+                    "distributed",
+                ],
             )
         except getopt.error as msg:
             raise Usage(msg)
@@ -680,6 +1212,9 @@ def _main(argv=None):
         verbose = False
         process_all = False
         notify = False
+        batch_size = None
+        processes = cpu_count()
+        distributed = False
 
         # Process options
         for o, a in opts:
@@ -699,6 +1234,18 @@ def _main(argv=None):
                 process_all = True
             elif o in ("-n", "--notify"):
                 notify = True
+            elif o in ("-b", "--batch"):
+                try:
+                    batch_size = int(a)
+                except ValueError:
+                    raise Usage("Invalid batch size: '{0}'".format(a))
+            elif o in ("-p", "--processes"):
+                try:
+                    processes = int(a)
+                except ValueError:
+                    raise Usage("Invalid number of processes: '{0}'".format(a))
+            elif o == "--distributed":
+                distributed = True
 
         # if process_all and limit_specified:
         #    raise Usage("--all and --limit cannot be used together")
@@ -724,7 +1271,12 @@ def _main(argv=None):
             if process_all and not limit_specified:
                 limit = None
             tag_articles(
-                limit=limit, verbose=verbose, process_all=process_all, uuid=uuid
+                limit=limit,
+                verbose=verbose,
+                process_all=process_all,
+                uuid=uuid,
+                batch_size=batch_size,
+                processes=processes,
             )
             if notify:
                 # Inform the similarity server that we have new article tags
@@ -738,7 +1290,7 @@ def _main(argv=None):
             # Rebuild model
             if la > 1:
                 raise Usage("Too many arguments")
-            build_model(verbose=verbose)
+            build_model(verbose=verbose, processes=processes, distributed=distributed)
         else:
             raise Usage("Unknown command: '{0}'".format(arg))
 
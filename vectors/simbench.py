@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Similarity query benchmark
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This utility compares the top-N similarity search of
+    simserver.TopicVectors with the previous implementation, which
+    computed the cosine similarity of each article's topic vector in a
+    Python loop and selected the top N with heapq.nlargest(), and verifies
+    that both return the same articles.
+
+    It then builds an approximate nearest-neighbour (IVF) index and reports
+    the recall@10 against the exact search, and the time per query, for
+    a range of probe counts, so that the simserver_ann_probes setting can
+    be chosen.
+
+    Synthetic topic vectors are used, so no database is required: each is
+    a random mixture of a few of a set of random topic directions, plus
+    noise. Real topic vectors are less clustered, so expect a lower recall
+    for a given probe count.
+
+    Usage:
+        python simbench.py [-a articles] [-d dimensions] [-n queries] [-l lists]
+
+"""
+
+import os
+import sys
+
+# Hack to make this Python program executable from the vectors subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+if basepath.endswith("/vectors") or basepath.endswith("\\vectors"):
+    sys.path.append(basepath[0:-8])
+
+import getopt
+import heapq
+import math
+import operator
+import time
+
+import numpy as np
+
+from simserver import TopicVectors
+
+
+# Number of results per query
+_TOP_N = 10
+
+# Number of topic directions in the synthetic data,
+# and number of topics mixed into each vector
+_TOPICS = 500
+_MIX = 3
+
+# Standard deviation of the noise added to each vector component
+_NOISE = 0.5
+
+# Probe counts for which the IVF index is benchmarked
+_PROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def loop_similar(atopics, n, vector):
+    """ The previous implementation of SimilarityServer.find_similar() """
+    base = np.array(vector)
+    norm_base = np.dot(base, base)
+
+    def iter_similarities():
+        for article_id, v in atopics.items():
+            norm_v = np.dot(v, v)
+            yield article_id, float(np.dot(v, base) / math.sqrt(norm_v * norm_base))
+
+    return heapq.nlargest(n, iter_similarities(), key=operator.itemgetter(1))
+
+
+def topic_vectors(rng, n, topics):
+    """ Return n synthetic topic vectors """
+    weights = rng.dirichlet(np.ones(_MIX), size=n)
+    mix = topics[rng.randint(len(topics), size=(n, _MIX))]
+    noise = _NOISE * rng.standard_normal((n, topics.shape[1]))
+    return np.einsum("nk,nkd->nd", weights, mix) + noise
+
+
+def benchmark(tv, articles, dimensions, queries):
+    """ Return the load time in seconds and the time per query in milliseconds
+        for the loop and for the matrix """
+    rng = np.random.RandomState(1)
+    topics = rng.standard_normal((_TOPICS, dimensions))
+    vectors = topic_vectors(rng, articles, topics)
+    ids = ["{0:08x}".format(i) for i in range(articles)]
+    atopics = dict(zip(ids, vectors))
+    t0 = time.time()
+    for article_id, v in zip(ids, vectors):
+        tv.add(article_id, v.tolist())
+    load = time.time() - t0
+    qvecs = topic_vectors(rng, queries, topics)
+    # Verify that the results are the same
+    for q in qvecs[0:10]:
+        expected = loop_similar(atopics, _TOP_N, q)
+        result = tv.top_n(_TOP_N, q)
+        assert [a for a, _ in expected] == [a for a, _ in result]
+        assert all(abs(s1 - s2) < 1.0e-5 for (_, s1), (_, s2) in zip(expected, result))
+    timings = []
+    for func in (
+        lambda q: loop_similar(atopics, _TOP_N, q),
+        lambda q: tv.top_n(_TOP_N, q),
+    ):
+        t0 = time.time()
+        for q in qvecs:
+            func(q)
+        t1 = time.time()
+        timings.append(1000.0 * (t1 - t0) / queries)
+    return qvecs, load, timings[0], timings[1]
+
+
+def benchmark_index(tv, qvecs, lists):
+    """ Build an IVF index and return the build time in seconds, along with
+        a list of (probes, recall@10, time per query in milliseconds) """
+    exact = [set(a for a, _ in tv.top_n(_TOP_N, q)) for q in qvecs]
+    t0 = time.time()
+    tv.build_index(lists)
+    build = time.time() - t0
+    result = []
+    for probes in _PROBES:
+        t0 = time.time()
+        found = [tv.top_n(_TOP_N, q, probes) for q in qvecs]
+        t1 = time.time()
+        recall = sum(
+            len(e.intersection(a for a, _ in f)) for e, f in zip(exact, found)
+        ) / (_TOP_N * len(qvecs))
+        result.append((probes, recall, 1000.0 * (t1 - t0) / len(qvecs)))
+    return build, result
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    opts, _ = getopt.getopt(
+        argv[1:], "a:d:n:l:", ["articles=", "dimensions=", "queries=", "lists="]
+    )
+    articles = 100000
+    dimensions = 200
+    queries = 20
+    lists = None
+    for o, a in opts:
+        if o in ("-a", "--articles"):
+            articles = int(a)
+        elif o in ("-d", "--dimensions"):
+            dimensions = int(a)
+        elif o in ("-n", "--queries"):
+            queries = int(a)
+        elif o in ("-l", "--lists"):
+            lists = int(a)
+    tv = TopicVectors(dimensions)
+    qvecs, load, loop_ms, matrix_ms = benchmark(tv, articles, dimensions, queries)
+    print(
+        "{0} articles of {1} dimensions, loaded in {2:.2f} s: "
+        "top {3} in {4:.1f} ms (loop) vs. {5:.2f} ms (matrix)".format(
+            articles, dimensions, load, _TOP_N, loop_ms, matrix_ms
+        )
+    )
+    build, result = benchmark_index(tv, qvecs, lists)
+    print(
+        "IVF index of {0} lists built in {1:.2f} s".format(len(tv.index), build)
+    )
+    for probes, recall, ms in result:
+        print(
+            "  {0:3} probes: recall@{1} {2:.3f}, {3:.2f} ms".format(
+                probes, _TOP_N, recall, ms
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
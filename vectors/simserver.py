@@ -23,7 +23,20 @@
     This module implements a similarity query server. The server can
     answer queries about articles that are similar to a given article
     or topic vector. This assumes that articles already have topic vectors
-    that are stored in the topic_vector column in the articles database table.
+    that are stored in the topic_vector_bin column in the articles database table.
+
+    The topic vectors are saved in a snapshot, in the models directory,
+    after a full load from the database and periodically after refreshes.
+    On startup, the server memory-maps the snapshot matrix and only loads
+    the articles that have been indexed since the snapshot was saved,
+    instead of loading all topic vectors from the database.
+
+    Similarity queries never wait for refreshes or reloads. The topic
+    vectors are not modified once queries can see them: a refresh or a
+    reload builds a new TopicVectors instance, sharing what it can with
+    the current one, and then replaces the current one in a single
+    assignment. A query uses the instance that was current when it
+    started, throughout.
 
     The similarity server by default accepts TCP connections on port 5001.
     For security, this port should be closed from outside access via iptables or
@@ -62,23 +75,25 @@
 
 """
 
+from typing import Dict, List, Optional, Tuple
+
+import os
+import copy
 import json
 import time
 import math
-import heapq
 import sys
-import operator
 
 import numpy as np
 
 from threading import Thread, Lock
-from datetime import datetime
+from datetime import datetime, timedelta
 from multiprocessing import AuthenticationError
 from multiprocessing.connection import Listener, Client
 
 from settings import Settings, ConfigError
 from db import SessionContext, desc
-from db.models import Article, Root
+from db.models import Article, Root, RelatedArticle, unpack_topic_vector
 from builder import ReynirCorpus
 
 
@@ -89,43 +104,434 @@ class InternalError(RuntimeError):
         super().__init__(s)
 
 
+class ClientError(RuntimeError):
+    """ Exception for handling erroneous requests from clients """
+
+    def __init__(self, request):
+        super().__init__("Invalid request received: {0!r}".format(request))
+
+
+# Maximum number of similarity queries in a single batch request
+_MAX_BATCH_REQUESTS = 1000
+
+
+# Snapshot files: the topic vector matrix, and a JSON file with the article ids
+# of its rows, the number of dimensions and the time of the last refresh
+_SNAPSHOT_MATRIX_FILE = "./models/topic-vectors.npy"
+_SNAPSHOT_INFO_FILE = "./models/topic-vectors.json"
+
+# Format version of the snapshot info file
+_SNAPSHOT_VERSION = 1
+
+# Format of the refresh timestamp in the snapshot info file
+_SNAPSHOT_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Minimum number of seconds between snapshots saved after refreshes
+_SNAPSHOT_INTERVAL = 3600.0
+
+# Minimum number of articles for building an IVF index
+_IVF_MIN_ARTICLES = 10000
+
+# Default number of IVF lists per square root of the number of articles
+_IVF_LISTS_FACTOR = 2.0
+
+# Number of k-means iterations when training an IVF index
+_KMEANS_ITERATIONS = 10
+
+# Maximum number of training vectors per IVF list
+_KMEANS_SAMPLE_PER_LIST = 64
+
+# Number of rows that are assigned to IVF lists at a time,
+# limiting the size of the temporary similarity matrix
+_ASSIGN_CHUNK = 8192
+
+# Maximum number of elements of the temporary similarity matrix
+# when finding the articles similar to many articles at a time
+_NEIGHBOURS_CHUNK_CELLS = 1 << 24
+
+# Number of similarity queries by article id after which
+# the related articles of the article are precomputed
+_RELATED_POPULAR_QUERIES = 3
+
+# Maximum number of articles whose queries are counted: when it is
+# reached, the counts are reset
+_RELATED_MAX_COUNTED = 100000
+
+# Seconds to wait before retrying a failed update of the related articles
+_RELATED_RETRY_INTERVAL = 60.0
+
+# Maximum number of article ids in each statement
+# that deletes rows from the related table
+_RELATED_DELETE_CHUNK = 1000
+
+
+def _top_indices(sims, n):
+    """ Return the indices of the n highest values in the
+        sims array, in decreasing order of value """
+    if n < len(sims):
+        # Find the n highest values without sorting the whole array
+        ix = np.argpartition(-sims, n - 1)[0:n]
+    else:
+        ix = np.arange(len(sims))
+    return ix[np.argsort(-sims[ix], kind="stable")]
+
+
+class IVFIndex:
+
+    """ An approximate nearest-neighbour index of normalized vectors, using
+        an inverted file (IVF): the vectors are partitioned into lists by
+        the nearest of a set of centroids, found by spherical k-means
+        clustering. A query only considers the vectors in the lists of the
+        centroids nearest to it. The more lists are probed, the higher the
+        recall, and the slower the query. New vectors are added to the list
+        of their nearest centroid, without retraining the centroids. """
+
+    def __init__(self, centroids):
+        self.centroids = centroids
+        # The rows of the vectors in each list
+        self._lists = [
+            np.zeros(0, dtype=np.int64) for _ in range(len(centroids))
+        ]  # type: List[np.ndarray]
+        # The list of each row, or -1 if the row has not been added
+        self._assigned = np.zeros(0, dtype=np.int32)
+        # Number of rows when the index was trained
+        self.trained_size = 0
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def copy(self):
+        """ Return a copy of the index that can be added to without
+            changing this one. The lists are replaced, not modified,
+            when rows are added, so they can be shared. """
+        index = copy.copy(self)
+        index._lists = list(self._lists)
+        index._assigned = self._assigned.copy()
+        return index
+
+    @classmethod
+    def train(cls, matrix, lists, seed=0):
+        """ Create an index with the given number of lists by clustering
+            the rows of matrix, and add all of them to it """
+        rng = np.random.RandomState(seed)
+        size = len(matrix)
+        lists = max(1, min(lists, size))
+        sample_size = min(size, lists * _KMEANS_SAMPLE_PER_LIST)
+        sample = matrix[np.sort(rng.choice(size, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, lists, replace=False)]
+        for _ in range(_KMEANS_ITERATIONS):
+            assigned = cls._nearest(centroids, sample)
+            order = np.argsort(assigned, kind="stable")
+            counts = np.bincount(assigned, minlength=lists)
+            nonempty = counts > 0
+            starts = np.concatenate(([0], np.cumsum(counts)[0:-1]))
+            sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+            centroids[nonempty] = sums
+            # Empty lists get a new centroid from a random sample vector
+            empty = np.flatnonzero(~nonempty)
+            centroids[empty] = sample[rng.choice(sample_size, len(empty))]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.maximum(norms, 1.0e-6)
+        index = cls(centroids.astype(np.float32))
+        index.add_rows(matrix, 0)
+        index.trained_size = size
+        return index
+
+    @staticmethod
+    def _nearest(centroids, vectors):
+        """ Return the index of the nearest centroid to each of the vectors """
+        result = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), _ASSIGN_CHUNK):
+            chunk = vectors[i : i + _ASSIGN_CHUNK]
+            result[i : i + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return result
+
+    def add_rows(self, vectors, first_row):
+        """ Add a block of vectors, having consecutive rows
+            starting at first_row, that are not in the index """
+        assigned = self._nearest(self.centroids, vectors)
+        rows = np.arange(first_row, first_row + len(vectors))
+        self._grow(first_row + len(vectors))
+        self._assigned[rows] = assigned
+        order = np.argsort(assigned, kind="stable")
+        counts = np.bincount(assigned, minlength=len(self.centroids))
+        for c, r in zip(
+            np.flatnonzero(counts), np.split(rows[order], np.cumsum(counts)[0:-1])
+        ):
+            self._lists[c] = np.concatenate((self._lists[c], r))
+
+    def add(self, row, vector):
+        """ Add or move the vector in the given row """
+        c = int(np.argmax(self.centroids @ vector))
+        self._grow(row + 1)
+        old = self._assigned[row]
+        if old == c:
+            return
+        if old >= 0:
+            self._lists[old] = self._lists[old][self._lists[old] != row]
+        self._assigned[row] = c
+        self._lists[c] = np.append(self._lists[c], row)
+
+    def _grow(self, size):
+        if size > len(self._assigned):
+            assigned = np.full(
+                max(size, 2 * len(self._assigned)), -1, dtype=np.int32
+            )
+            assigned[0 : len(self._assigned)] = self._assigned
+            self._assigned = assigned
+
+    def candidates(self, vector, probes):
+        """ Return an array of the rows in the lists of
+            the centroids that are nearest to the vector """
+        sims = self.centroids @ vector
+        probe = _top_indices(sims, min(probes, len(sims)))
+        return np.concatenate([self._lists[c] for c in probe])
+
+
+class TopicVectors:
+
+    """ The topic vectors of articles, L2-normalized and stored as the rows
+        of a contiguous float32 matrix, along with the corresponding article
+        ids. The cosine similarity of a vector to all articles is then a
+        single matrix-vector product. The matrix grows by doubling its
+        capacity as articles are added. Optionally, an IVFIndex can be
+        built to find similar articles approximately, without computing
+        the similarity to all of them.
+
+        Once an instance is being searched, it should not be modified;
+        updated() returns a new instance with added or replaced vectors. """
+
+    _INITIAL_CAPACITY = 1024
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self._matrix = np.zeros(
+            (self._INITIAL_CAPACITY, dimensions), dtype=np.float32
+        )
+        # Article ids, by row
+        self._ids = []  # type: List[str]
+        # Map of article id to row
+        self._rows = dict()  # type: Dict[str, int]
+        self._index = None  # type: Optional[IVFIndex]
+        # True if the matrix is shared with the instance that this one
+        # was created from by updated()
+        self._shared = False
+        # True if an instance created from this one by updated() may have
+        # added rows after this instance's rows in the shared matrix
+        self._extended = False
+
+    def __len__(self):
+        return len(self._ids)
+
+    @classmethod
+    def from_matrix(cls, matrix, ids):
+        """ Create an instance from a matrix of normalized vectors, such as a
+            memory-mapped snapshot, and the article ids of its rows. The
+            matrix is not copied until rows are added beyond its end. """
+        tv = cls(matrix.shape[1])
+        tv._matrix = matrix
+        tv._ids = list(ids)
+        tv._rows = {article_id: row for row, article_id in enumerate(tv._ids)}
+        return tv
+
+    def updated(self, vectors):
+        """ Return a new instance with the given (article_id, vector) pairs
+            added or replaced, leaving this instance unchanged. The matrix
+            is shared as long as rows are only added after the end of this
+            instance's rows, and is copied if a row in this instance is
+            replaced. Only the first instance created from this one shares
+            the spare capacity after its rows; later ones get a copy, so
+            that their added rows don't overwrite each other. """
+        tv = copy.copy(self)
+        tv._ids = list(self._ids)
+        tv._rows = dict(self._rows)
+        tv._extended = False
+        if self._extended:
+            tv._matrix = np.array(self._matrix)
+            tv._shared = False
+        else:
+            tv._shared = True
+            self._extended = True
+        if self._index is not None:
+            tv._index = self._index.copy()
+        for article_id, vector in vectors:
+            tv.add(article_id, vector)
+        return tv
+
+    @property
+    def matrix(self):
+        """ The matrix of normalized vectors, one row per article """
+        return self._matrix[0 : len(self._ids)]
+
+    @property
+    def ids(self):
+        """ The article ids of the rows of the matrix """
+        return self._ids
+
+    @property
+    def index(self):
+        return self._index
+
+    def add(self, article_id, vector):
+        """ Add or replace the topic vector of an article. Returns False
+            if the vector is not valid, i.e. of the wrong length. """
+        v = np.asarray(vector, dtype=np.float32)
+        if v.shape != (self.dimensions,):
+            return False
+        norm = float(np.linalg.norm(v))
+        if not (norm >= 1.0e-6 and math.isfinite(norm)):
+            # A zero vector is not similar to anything: leave it out
+            return True
+        row = self._rows.get(article_id)
+        if row is None:
+            row = len(self._ids)
+            if row == len(self._matrix):
+                # Full: double the capacity
+                capacity = max(2 * len(self._matrix), self._INITIAL_CAPACITY)
+                matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+                matrix[0:row] = self._matrix
+                self._matrix = matrix
+                self._shared = False
+            self._ids.append(article_id)
+            self._rows[article_id] = row
+        elif self._shared:
+            # The row is visible in the instance that shares the matrix
+            self._matrix = np.array(self._matrix)
+            self._shared = False
+        v = v / norm
+        self._matrix[row] = v
+        if self._index is not None:
+            self._index.add(row, v)
+        return True
+
+    def build_index(self, lists=None):
+        """ Build an IVF index with the given number of lists, by default
+            proportional to the square root of the number of articles """
+        size = len(self._ids)
+        if lists is None:
+            lists = int(_IVF_LISTS_FACTOR * math.sqrt(size))
+        self._index = IVFIndex.train(self._matrix[0:size], lists)
+
+    def vector(self, article_id):
+        """ Return the normalized topic vector of an article, or None """
+        row = self._rows.get(article_id)
+        return None if row is None else self._matrix[row]
+
+    def _normalized(self, vector):
+        """ Return the vector normalized, or None if it is not valid """
+        base = np.asarray(vector, dtype=np.float32)
+        if base.shape != (self.dimensions,):
+            return None
+        norm = float(np.linalg.norm(base))
+        if norm < 1.0e-6:
+            # No data to search by
+            return None
+        return base / norm
+
+    def top_n(self, n, vector, probes=0):
+        """ Return a list of (article_id, similarity) tuples for the n articles
+            most similar to the given vector, in decreasing order of similarity.
+            If probes is nonzero and an index has been built, the search is
+            approximate, covering the given number of index lists. """
+        base = self._normalized(vector)
+        if base is None or n < 1:
+            return []
+        ids = self._ids
+        if probes and self._index is not None:
+            rows = self._index.candidates(base, probes)
+            sims = self._matrix[rows] @ base
+            return [(ids[rows[i]], float(sims[i])) for i in _top_indices(sims, n)]
+        sims = self._matrix[0 : len(ids)] @ base
+        return [(ids[i], float(sims[i])) for i in _top_indices(sims, n)]
+
+    def neighbours(self, n, article_ids, candidates=None):
+        """ Return a list containing, for each of the given articles, a list
+            of (article_id, similarity) tuples for the n other articles most
+            similar to it, in decreasing order of similarity. If candidates is
+            given, only the articles with those ids are considered. All the
+            articles must have topic vectors. """
+        size = len(self._ids)
+        if candidates is None:
+            cand_rows = np.arange(size)
+            cand = self._matrix[0:size]
+        else:
+            cand_rows = np.array([self._rows[a] for a in candidates], dtype=np.int64)
+            cand = self._matrix[cand_rows]
+        rows = [self._rows[a] for a in article_ids]
+        ids = self._ids
+        result = []  # type: List[List[Tuple[str, float]]]
+        chunk = max(1, _NEIGHBOURS_CHUNK_CELLS // max(1, len(cand_rows)))
+        for i in range(0, len(rows), chunk):
+            sims = self._matrix[rows[i : i + chunk]] @ cand.T
+            for row, row_sims in zip(rows[i : i + chunk], sims):
+                # One more, in case the article itself is among the candidates
+                top = _top_indices(row_sims, n + 1)
+                result.append(
+                    [
+                        (ids[cand_rows[j]], float(row_sims[j]))
+                        for j in top
+                        if cand_rows[j] != row
+                    ][0:n]
+                )
+        return result
+
+
 class SimilarityServer:
 
-    """ A class that manages an in-memory dictionary of articles
-        and their topic vectors, and allows similarity queries of that
-        dictionary. The dictionary is refreshed upon request from the
-        articles database table.
+    """ A class that manages an in-memory matrix of article topic vectors,
+        and allows similarity queries of that matrix. The matrix is
+        refreshed upon request from the articles database table.
     """
 
     def __init__(self):
-        # Do an initial load of all article topic vectors
+        # Serializes refreshes and reloads; queries don't use it
         self._lock = Lock()
         self._timestamp = None
-        self._atopics = {}
+        # The current topic vectors, replaced as a whole when updated
+        self._atopics = None  # type: Optional[TopicVectors]
         self._corpus = None
+        # Time of the last snapshot save, if any
+        self._saved = None  # type: Optional[float]
+        # The precomputed related articles: a map of article id to a list
+        # of (article_id, similarity) tuples, as stored in the related table.
+        # Only the thread that updates them uses this.
+        self._related = dict()  # type: Dict[str, List[Tuple[str, float]]]
+        # Guards the following state of related article updates
+        self._related_lock = Lock()
+        self._related_running = False
+        self._related_due = False
+        self._related_full = False
+        # Ids of articles whose topic vectors have been added or replaced
+        # since the last update of the related articles
+        self._related_new = []  # type: List[str]
+        # Number of similarity queries by article id, and the articles
+        # that have had enough queries to be considered popular, with
+        # the time of their last query
+        self._queries = dict()  # type: Dict[str, int]
+        self._popular = dict()  # type: Dict[str, float]
 
     def _load_topics(self):
-        """ Load all article topics into the self._atopics dictionary """
-        self._atopics = {}
+        """ Load all article topics into a new matrix and publish it """
+        atopics = TopicVectors(self._corpus.dimensions)
         with SessionContext(commit=True, read_only=True) as session:
             print("Starting load of all article topic vectors")
             t0 = time.time()
             # Do the next refresh from this time point
-            self._timestamp = datetime.utcnow()
+            timestamp = datetime.utcnow()
             q = (
                 session.query(Article)
                 .join(Root)
                 .filter(Root.visible)
-                .with_entities(Article.id, Article.topic_vector)
+                .with_entities(
+                    Article.id, Article.topic_vector_bin, Article.topic_vector
+                )
             )
 
             for a in q.yield_per(2000):
-                if a.topic_vector:
-                    # Load topic vector in to a numpy array
-                    vec = json.loads(a.topic_vector)
-                    if isinstance(vec, list) and len(vec) == self._corpus.dimensions:
-                        self._atopics[a.id] = np.array(vec)
-                    else:
+                if a.topic_vector_bin or a.topic_vector:
+                    # Load topic vector in to the matrix
+                    vec = unpack_topic_vector(a.topic_vector_bin, a.topic_vector)
+                    if vec is None or not atopics.add(a.id, vec):
                         print(
                             "Warning: faulty topic vector for article {0}".format(a.id)
                         )
@@ -133,24 +539,133 @@ class SimilarityServer:
             t1 = time.time()
             print(
                 "Loading of {0} topic vectors completed in {1:.2f} seconds".format(
-                    len(self._atopics), t1 - t0
+                    len(atopics), t1 - t0
                 )
             )
+        self._publish(atopics)
+        self._timestamp = timestamp
+        self._save_snapshot()
+
+    def _publish(self, atopics):
+        """ Make new topic vectors visible to queries, building
+            their approximate nearest-neighbour index first if due """
+        if self._index_due(atopics):
+            t0 = time.time()
+            atopics.build_index()
+            t1 = time.time()
+            print(
+                "Built index of {0} lists for {1} topic vectors in {2:.2f} seconds".format(
+                    len(atopics.index), len(atopics), t1 - t0
+                )
+            )
+        # Queries see either the previous topic vectors or these
+        self._atopics = atopics
+
+    def _load_snapshot(self):
+        """ Load the topic vectors from the snapshot files, memory-mapping
+            the matrix. Returns False if there is no valid snapshot. """
+        try:
+            with open(_SNAPSHOT_INFO_FILE, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("version") != _SNAPSHOT_VERSION:
+                print("Ignoring snapshot of an unknown version")
+                return False
+            # Mode 'c' is copy-on-write: rows that are replaced
+            # in memory are not written to the file
+            matrix = np.load(_SNAPSHOT_MATRIX_FILE, mmap_mode="c")
+            ids = info["ids"]
+            timestamp = datetime.strptime(
+                info["timestamp"], _SNAPSHOT_TIMESTAMP_FORMAT
+            )
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print("Unable to load snapshot: {0}".format(e))
+            return False
+        if matrix.shape != (len(ids), self._corpus.dimensions):
+            # The snapshot files don't match, or the
+            # model dimensions have changed since it was saved
+            print("Ignoring snapshot with a matrix of shape {0}".format(matrix.shape))
+            return False
+        self._atopics = TopicVectors.from_matrix(matrix, ids)
+        self._timestamp = timestamp
+        print(
+            "Loaded snapshot of {0} topic vectors, refreshed at {1}".format(
+                len(ids), timestamp
+            )
+        )
+        return True
+
+    def _save_snapshot(self):
+        """ Save the topic vectors in the snapshot files. The files are
+            written under temporary names and then renamed, so a snapshot
+            that is being loaded or memory-mapped is never overwritten. """
+        t0 = time.time()
+        info = dict(
+            version=_SNAPSHOT_VERSION,
+            dimensions=self._atopics.dimensions,
+            timestamp=self._timestamp.strftime(_SNAPSHOT_TIMESTAMP_FORMAT),
+            ids=self._atopics.ids,
+        )
+        try:
+            # np.save() would append .npy to a name without that suffix
+            tmp_matrix = _SNAPSHOT_MATRIX_FILE[0:-4] + ".tmp.npy"
+            tmp_info = _SNAPSHOT_INFO_FILE + ".tmp"
+            np.save(tmp_matrix, self._atopics.matrix)
+            with open(tmp_info, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(tmp_matrix, _SNAPSHOT_MATRIX_FILE)
+            os.replace(tmp_info, _SNAPSHOT_INFO_FILE)
+        except OSError as e:
+            print("Unable to save snapshot: {0}".format(e))
+            return
+        self._saved = t1 = time.time()
+        print(
+            "Saved snapshot of {0} topic vectors in {1:.2f} seconds".format(
+                len(self._atopics), t1 - t0
+            )
+        )
+
+    @staticmethod
+    def _index_due(atopics):
+        """ Return True if an approximate nearest-neighbour index of the
+            topic vectors should be built: if enabled, when there are enough
+            articles, and again when their number has doubled since it was
+            built. In between, new articles are added to the index as they
+            are loaded. """
+        if not Settings.SIMSERVER_ANN_PROBES:
+            return False
+        size = len(atopics)
+        if size < _IVF_MIN_ARTICLES:
+            return False
+        index = atopics.index
+        return index is None or size >= 2 * index.trained_size
 
     def article_topic(self, article_id):
         """ Return the topic vector of the article having the given uuid,
             or None if no such article exists """
-        return self._atopics.get(article_id)
+        atopics = self._atopics
+        return None if atopics is None else atopics.vector(article_id)
+
+    def _refresh_term_vectors(self):
+        """ Recompute the cached term vectors of the corpus in the background,
+            since the article topic vectors they are averaged from have changed """
+        Thread(target=self._corpus.refresh_term_vectors, daemon=True).start()
 
     def reload_topics(self):
         """ Reload all article topic vectors from the database """
         with self._lock:
-            # Can't serve queries while we're doing this
+            # Queries use the current topic vectors in the meantime
             self._load_topics()
+            self._refresh_term_vectors()
+            self._schedule_related(full=True)
 
     def refresh_topics(self):
-        """ Load any new article topics into the _atopics dict """
+        """ Load any new article topics from the database, and publish
+            the current topic vectors updated with them. Returns the
+            number of articles loaded. """
         with self._lock:
+            dimensions = self._corpus.dimensions
             with SessionContext(commit=True, read_only=True) as session:
                 # Do the next refresh from this time point
                 ts = datetime.utcnow()
@@ -159,68 +674,212 @@ class SimilarityServer:
                     .join(Root)
                     .filter(Root.visible)
                     .filter(Article.indexed >= self._timestamp)
-                    .with_entities(Article.id, Article.topic_vector)
+                    .with_entities(
+                        Article.id, Article.topic_vector_bin, Article.topic_vector
+                    )
                 )
-                self._timestamp = ts
-                count = 0
+                vectors = []
                 for a in q.yield_per(100):
-                    if a.topic_vector:
-                        # Load topic vector in to a numpy array
-                        vec = json.loads(a.topic_vector)
-                        if (
-                            isinstance(vec, list)
-                            and len(vec) == self._corpus.dimensions
-                        ):
-                            self._atopics[a.id] = np.array(vec)
-                            count += 1
+                    if a.topic_vector_bin or a.topic_vector:
+                        vec = unpack_topic_vector(a.topic_vector_bin, a.topic_vector)
+                        if vec is not None and len(vec) == dimensions:
+                            vectors.append((a.id, vec))
                         else:
                             print(
                                 "Warning: faulty topic vector for article {0}".format(
                                     a.id
                                 )
                             )
-                print(
-                    "Completed refresh_topics, {0} article vectors added".format(count)
+            if vectors or self._index_due(self._atopics):
+                self._publish(self._atopics.updated(vectors))
+            if vectors:
+                self._refresh_term_vectors()
+                self._schedule_related([article_id for article_id, _ in vectors])
+            self._timestamp = ts
+            print(
+                "Completed refresh_topics, {0} article vectors added".format(
+                    len(vectors)
                 )
+            )
+            if vectors and (
+                self._saved is None or time.time() - self._saved >= _SNAPSHOT_INTERVAL
+            ):
+                self._save_snapshot()
+            return len(vectors)
 
-    def _iter_similarities(self, vector):
-        """ Generator of (id, similarity) tuples for all articles to the given vector """
-        base = np.array(vector)
-        norm_base = np.dot(base, base)  # This is faster than linalg.norm()
-        if norm_base < 1.0e-6:
-            # No data to search by
+    def _schedule_related(self, new_ids=None, full=False):
+        """ Update the precomputed related articles in a background thread,
+            either fully or by comparing the articles with the given ids,
+            whose topic vectors have been added or replaced, to the existing
+            lists. Updates run one at a time: if one is running, it does
+            this update when it is done. """
+        if not Settings.SIMSERVER_RELATED_DAYS:
             return
+        with self._related_lock:
+            if new_ids:
+                self._related_new.extend(new_ids)
+            if full:
+                self._related_full = True
+            self._related_due = True
+            if self._related_running:
+                return
+            self._related_running = True
+        Thread(target=self._related_worker, daemon=True).start()
 
-        def cosine_similarity(v):
-            """ Compute cosine similarity of v1 to v2: (v1 dot v2)/(|v1|*|v2|) """
-            norm_v = np.dot(v, v)  # This is faster than linalg.norm()
-            dot_product = np.dot(v, base)
-            return float(dot_product / math.sqrt(norm_v * norm_base))
-
-        for article_id, topic_vector in self._atopics.items():
+    def _related_worker(self):
+        """ Run the scheduled updates of the related articles """
+        while True:
+            with self._related_lock:
+                if not self._related_due:
+                    self._related_running = False
+                    return
+                full = self._related_full
+                new_ids = self._related_new
+                self._related_due = self._related_full = False
+                self._related_new = []
+            failed = False
             try:
-                cs = cosine_similarity(topic_vector)
-                yield article_id, cs
-            except Exception as ex:
-                # If there is an error in the calculations, probably
-                # due to a faulty topic vector, simply don't include
-                # the article
-                print(
-                    "Error in cosine similarity for article {0}: {1}".format(
-                        article_id, ex
+                self._update_related(full, new_ids)
+            except Exception as e:
+                print("Unable to update related articles: {0}".format(e))
+                with self._related_lock:
+                    # The related table may not match self._related:
+                    # retry with a full update
+                    self._related_full = True
+                    self._related_due = True
+                failed = True
+            finally:
+                sys.stdout.flush()
+            if failed:
+                # Don't retry at once, in case the database is unavailable
+                time.sleep(_RELATED_RETRY_INTERVAL)
+
+    def _related_targets(self, atopics):
+        """ Return the set of ids of the articles whose related articles are
+            precomputed: the recent articles and the popular ones """
+        since = datetime.utcnow() - timedelta(days=Settings.SIMSERVER_RELATED_DAYS)
+        with SessionContext(commit=True, read_only=True) as session:
+            q = session.query(Article.id).filter(Article.timestamp >= since)
+            targets = set(a for a, in q)
+        targets.update(self._recent_popular())
+        # Only articles with topic vectors have related articles
+        return set(a for a in targets if atopics.vector(a) is not None)
+
+    def _update_related(self, full, new_ids):
+        """ Update the precomputed related articles of the recent and popular
+            articles, and store the lists that have changed in the related
+            table. Unless full is True, only the articles that don't have a
+            list, and the articles with the given ids or with them in their
+            lists, get a new list; the other lists are updated by comparing
+            their articles to the articles with the given ids. """
+        atopics = self._atopics
+        if atopics is None:
+            return
+        t0 = time.time()
+        count = RelatedArticle.MAX_RELATED
+        targets = self._related_targets(atopics)
+        related = dict() if full else dict(self._related)
+        # Lists of articles that are no longer recent or popular
+        removed = [a for a in related if a not in targets]
+        for a in removed:
+            del related[a]
+        new = set(a for a in new_ids if atopics.vector(a) is not None)
+        # Articles that get a new list: those that don't have one, the new
+        # ones, and those whose list contains a new article, since its topic
+        # vector may have been replaced, changing its similarity
+        compute = [
+            a
+            for a in targets
+            if a not in related or a in new or any(r in new for r, _ in related[a])
+        ]
+        for a, lst in zip(compute, atopics.neighbours(count, compute)):
+            related[a] = lst
+        changed = set(compute)
+        # Merge the new articles into the other lists
+        merge = [a for a in related if a not in changed]
+        if merge and new:
+            for a, lst in zip(merge, atopics.neighbours(count, merge, list(new))):
+                old = related[a]
+                merged = sorted(old + lst, key=lambda t: -t[1])[0:count]
+                if merged != old:
+                    related[a] = merged
+                    changed.add(a)
+        self._store_related(full, related, changed, removed)
+        self._related = related
+        t1 = time.time()
+        print(
+            "Updated related articles of {0} articles, {1} lists changed, "
+            "in {2:.2f} seconds".format(len(related), len(changed), t1 - t0)
+        )
+
+    @staticmethod
+    def _store_related(full, related, changed, removed):
+        """ Store the changed lists of related articles in the related table,
+            and delete the removed ones, or replace the whole table if full """
+        table = RelatedArticle.table()
+        with SessionContext(commit=True) as session:
+            if full:
+                session.execute(table.delete())
+            else:
+                deleted = list(changed) + removed
+                for i in range(0, len(deleted), _RELATED_DELETE_CHUNK):
+                    session.execute(
+                        table.delete().where(
+                            table.c.article_id.in_(
+                                deleted[i : i + _RELATED_DELETE_CHUNK]
+                            )
+                        )
                     )
-                )
-                pass
+            rows = [
+                dict(article_id=a, related_id=r, similarity=sim)
+                for a in changed
+                for r, sim in related[a]
+            ]
+            if rows:
+                session.execute(table.insert(), rows)
+
+    def _recent_popular(self):
+        """ Return the ids of the popular articles, after dropping those
+            that have not been queried within the last
+            SIMSERVER_RELATED_DAYS days """
+        since = time.time() - Settings.SIMSERVER_RELATED_DAYS * 24 * 3600
+        for a, t in list(self._popular.items()):
+            if t < since:
+                self._popular.pop(a, None)
+        return set(self._popular)
+
+    def _count_query(self, article_id):
+        """ Count a similarity query by article id, and schedule the
+            precomputation of the related articles of articles that
+            are queried often enough """
+        if not Settings.SIMSERVER_RELATED_DAYS:
+            return
+        now = time.time()
+        if article_id in self._popular:
+            self._popular[article_id] = now
+            return
+        # Counts may be lost in races between client threads, which is harmless
+        count = self._queries.get(article_id, 0) + 1
+        if count < _RELATED_POPULAR_QUERIES:
+            if len(self._queries) >= _RELATED_MAX_COUNTED:
+                # Don't let the counts of rarely queried articles accumulate
+                self._queries.clear()
+            self._queries[article_id] = count
+            return
+        self._queries.pop(article_id, None)
+        self._popular[article_id] = now
+        self._schedule_related()
 
     def find_similar(self, n, vector):
         """ Return the N articles with the highest similarity score to the given vector,
             as a list of tuples (article_uuid, similarity) """
-        if vector is None or len(vector) == 0 or all(e == 0.0 for e in vector):
+        if vector is None or len(vector) == 0:
             return []
-        with self._lock:
-            return heapq.nlargest(
-                n, self._iter_similarities(vector), key=operator.itemgetter(1)
-            )
+        # No locking: the current topic vectors are never modified
+        atopics = self._atopics
+        if atopics is None:
+            return []
+        return atopics.top_n(n, vector, probes=Settings.SIMSERVER_ANN_PROBES)
 
     def run(self, host, port):
         """ Run a similarity server serving requests that come in at the given port """
@@ -246,7 +905,18 @@ class SimilarityServer:
 
         with Listener(address, authkey=secret_password) as listener:
             self._corpus = ReynirCorpus()
-            self._load_topics()
+            if not self._load_snapshot():
+                self._load_topics()
+                self._refresh_term_vectors()
+                self._schedule_related(full=True)
+            else:
+                # The related articles are not kept between runs. Articles
+                # that the refresh loads are merged into them afterwards.
+                self._schedule_related(full=True)
+                if not self.refresh_topics():
+                    # No articles have been indexed since the snapshot
+                    # was saved, so the refresh didn't do this
+                    self._refresh_term_vectors()
             while True:
                 try:
                     conn = listener.accept()
@@ -262,14 +932,67 @@ class SimilarityServer:
                 finally:
                     sys.stdout.flush()
 
-    def _command_loop(self, conn):
-        """ Run a command loop for this server inside a client thread """
+    def _similar(self, request):
+        """ Run a similarity query, returning a result dict with a list of
+            (article_uuid, similarity) tuples under the articles key """
+        if not isinstance(request, dict):
+            raise ClientError(request)
+        # Obtain number of desired results
+        try:
+            n = int(request.get("n", 10))
+        except:
+            n = 10
+        topic = None
+        result = dict()
+        if "id" in request:
+            try:
+                # Compare similarity to an article identified by UUID
+                uuid = request["id"].strip().lower()
+                topic = self.article_topic(uuid)
+            except:
+                raise ClientError(request)
+            if topic is not None:
+                self._count_query(uuid)
+        elif "terms" in request:
+            # Compare similarity to the given terms, which are assumed to
+            # be normalized, i.e. of the form (stem, category).
+            # Examples: ('sjómaður', 'kk'), ('Jóna Hrönn Bolladóttir', 'person_kvk')
+            terms = request["terms"]
+            if not isinstance(terms, list):
+                raise ClientError(request)
+            # Convert the list of search terms to a topic vector
+            topic, term_weights = self._corpus.get_topic_vector(terms)
+            result["weights"] = term_weights
+        elif "topic" in request:
+            # Compare similarity to the given topic vector
+            topic = request["topic"]
+            if not isinstance(topic, list):
+                raise ClientError(request)
+        else:
+            raise ClientError(request)
+        result["articles"] = self.find_similar(n, topic)
+        return result
 
-        class ClientError(RuntimeError):
-            """ Local exception class for handling erroneous requests from clients """
+    def _similar_batch(self, request):
+        """ Run a batch of similarity queries, returning a result dict with
+            a list of the results of each query, in order, under the results key.
+            An invalid query in the batch gets an empty result. """
+        requests = request.get("requests")
+        if not isinstance(requests, list) or len(requests) > _MAX_BATCH_REQUESTS:
+            raise ClientError(request)
+        results = []
+        for r in requests:
+            try:
+                results.append(self._similar(r))
+            except ClientError as e:
+                print(str(e))
+                results.append(dict(articles=[]))
+        return dict(results=results)
 
-            def __init__(self, request):
-                super().__init__("Invalid request received: {0!r}".format(request))
+    def _command_loop(self, conn):
+        """ Run a command loop for this server inside a client thread. Clients
+            may pipeline requests, i.e. send several before receiving the
+            replies, which are sent in the same order as the requests. """
 
         with conn:
             # conn is automatically closed when leaving the 'with' scope
@@ -291,43 +1014,21 @@ class SimilarityServer:
                         print("Client logged out")
                         break
 
-                    if cmd == "similar":
-                        # Run a similarity query
-                        # Obtain number of desired results
+                    if cmd == "similar" or cmd == "similar_batch":
+                        # Run a similarity query, or a batch of them, and send
+                        # the reply back to the client. Erroneous requests get an
+                        # empty reply, so that the client isn't left waiting
+                        # and the replies to pipelined requests stay in order.
                         try:
-                            n = int(request.get("n", 10))
-                        except:
-                            n = 10
-                        topic = None
-                        result = dict()
-                        if "id" in request:
-                            try:
-                                # Compare similarity to an article identified by UUID
-                                uuid = request["id"].strip().lower()
-                                topic = self.article_topic(uuid)
-                            except:
-                                raise ClientError(request)
-                        elif "terms" in request:
-                            # Compare similarity to the given terms, which are assumed to
-                            # be normalized, i.e. of the form (stem, category).
-                            # Examples: ('sjómaður', 'kk'), ('Jóna Hrönn Bolladóttir', 'person_kvk')
-                            terms = request["terms"]
-                            if not isinstance(terms, list):
-                                raise ClientError(request)
-                            # Convert the list of search terms to a topic vector
-                            topic, term_weights = self._corpus.get_topic_vector(terms)
-                            result["weights"] = term_weights
-                        elif "topic" in request:
-                            # Compare similarity to the given topic vector
-                            topic = request["topic"]
-                            if not isinstance(topic, list):
-                                raise ClientError(request)
-                        else:
-                            raise ClientError(request)
-                        # Launch the command and send the reply back to the client
-                        t0 = time.time()
-                        result["articles"] = self.find_similar(n, topic)
-                        t1 = time.time()
+                            if cmd == "similar":
+                                result = self._similar(request)
+                            else:
+                                result = self._similar_batch(request)
+                        except ClientError:
+                            conn.send(
+                                dict(articles=[]) if cmd == "similar" else dict(results=[])
+                            )
+                            raise
                         conn.send(result)
                     elif cmd == "refresh":
                         # Load any new article topic vectors from the articles table